@@ -0,0 +1,27 @@
+# Helpers shared by the benchmark scripts: result files and baseline checks.
+import json
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def check_baseline(results, baseline_path, key, lower_is_better, higher_is_better=(), tolerance=0.2):
+    # Compare results against a saved run; a row regresses when a
+    # lower-is-better metric grew, or a higher-is-better metric shrank, by
+    # more than the tolerance. Returns the regression messages.
+    with open(baseline_path) as f:
+        baseline = {key(row): row for row in json.load(f)}
+    regressions = []
+    for row in results:
+        previous = baseline.get(key(row))
+        if previous is None:
+            continue
+        for metric in lower_is_better:
+            if previous.get(metric) and row[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{key(row)}: {metric} {previous[metric]:.4g} -> {row[metric]:.4g}")
+        for metric in higher_is_better:
+            if previous.get(metric) and row[metric] < previous[metric] * (1 - tolerance):
+                regressions.append(f"{key(row)}: {metric} {previous[metric]:.4g} -> {row[metric]:.4g}")
+    return regressions
@@ -0,0 +1,223 @@
+# Local stand-in for PubChem PUG REST and RCSB, for load tests.
+#
+# Requests whose path is in the fixture file are replayed from it; any other
+# compound or receptor gets a deterministic synthetic response (seeded by its
+# CID / PDB ID), so load tests can use as many distinct IDs as they need.
+# Latency and error rate are configurable.
+#
+#   python benchmarks/fake_upstream.py serve --port 8900 --latency-ms 80 --jitter-ms 30 --error-rate 0.01
+#   python benchmarks/fake_upstream.py record 2244 2519 --pdb 1HSG   # refresh fixtures from the real services
+#
+# Point the service at it with
+#   PUBCHEM_PUG_URL=http://127.0.0.1:8900/rest/pug RCSB_DATA_URL=http://127.0.0.1:8900 RCSB_FILES_URL=http://127.0.0.1:8900/download
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from urllib.parse import parse_qs
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "upstream.json")
+PUBCHEM_URL = "https://pubchem.ncbi.nlm.nih.gov"
+RCSB_DATA_URL = "https://data.rcsb.org"
+
+# The routes the service requests for one compound and one receptor
+BASIC_PROPERTIES = "MolecularWeight,XLogP,HBondDonorCount,HBondAcceptorCount,RotatableBondCount,MolecularFormula,IUPACName,InChIKey"
+COMPUTED_PROPERTIES = "Volume3D,Complexity"
+COMPOUND_ROUTES = (
+    f"property/{BASIC_PROPERTIES}/JSON",
+    f"property/{COMPUTED_PROPERTIES}/JSON",
+    "description/JSON",
+    "synonyms/JSON",
+    "assaysummary/JSON",
+    "protein_targets/JSON",
+    "pathway/JSON",
+)
+ELEMENT_COUNTS = (("C", 6, 30), ("H", 6, 40), ("N", 0, 5), ("O", 0, 8), ("S", 0, 2))
+
+
+def synthetic_properties(cid):
+    rng = random.Random(cid)
+    formula = "".join(f"{symbol}{n}" if n > 1 else symbol
+                      for symbol, low, high in ELEMENT_COUNTS for n in [rng.randint(low, high)] if n)
+    return {
+        "CID": cid,
+        "MolecularFormula": formula,
+        "MolecularWeight": f"{rng.uniform(100, 800):.2f}",
+        "IUPACName": f"synthetic compound {cid}",
+        "InChIKey": "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(14)) + "-UHFFFAOYSA-N",
+        "XLogP": round(rng.uniform(-2, 7), 1),
+        "HBondDonorCount": rng.randint(0, 6),
+        "HBondAcceptorCount": rng.randint(0, 12),
+        "RotatableBondCount": rng.randint(0, 14),
+        "Complexity": rng.randint(50, 1200),
+        "Volume3D": round(rng.uniform(80, 600), 1),
+    }
+
+
+def synthetic_compound_route(cid, operation):
+    rng = random.Random(f"{cid}:{operation}")
+    if operation == "description":
+        return 200, {"InformationList": {"Information": [{"CID": cid, "Description": f"Synthetic compound {cid} used for load testing."}]}}
+    if operation == "synonyms":
+        return 200, {"InformationList": {"Information": [{"CID": cid, "Synonym": [f"SYN-{cid}", f"compound {cid}"]}]}}
+    if operation == "assaysummary":
+        targets = ["DNA polymerase beta", "Protein kinase C", "Gene expression reporter", "Cytochrome P450 3A4"]
+        return 200, {"AssaySummaries": {"AssaySummary": [
+            {"AID": rng.randint(1, 10 ** 6), "TargetName": rng.choice(targets), "BioActivitySummary": rng.choice(["Active", "Inactive"])}
+            for _ in range(rng.randint(0, 40))
+        ]}}
+    if operation == "protein_targets":
+        return 200, {"ProteinTargets": [{"ProteinName": f"Protein {rng.randint(1, 500)}", "InteractionType": "inhibitor"} for _ in range(3)]}
+    if operation == "pathway":
+        return 200, {"Pathways": [{"PathwayName": f"Pathway {rng.randint(1, 300)}"} for _ in range(2)]}
+    return 400, {"Fault": {"Code": "PUGREST.BadRequest", "Message": f"Unsupported operation {operation}"}}
+
+
+def synthetic_entry(pdb_id):
+    rng = random.Random(pdb_id)
+    return {
+        "rcsb_id": pdb_id,
+        "struct": {"title": f"Synthetic receptor {pdb_id}"},
+        "exptl": [{"method": "X-RAY DIFFRACTION"}],
+        "rcsb_entry_info": {"resolution_combined": [round(rng.uniform(1.2, 3.5), 2)], "polymer_entity_count": rng.randint(1, 4)},
+    }
+
+
+def property_table(props, names):
+    row = {"CID": props["CID"]}
+    row.update({name: props[name] for name in names if name in props})
+    return {"PropertyTable": {"Properties": [row]}}
+
+
+class FakeUpstream:
+    def __init__(self, fixtures, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=503, seed=0):
+        self.routes = fixtures.get("routes", {})
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+
+    def compound_properties(self, cid):
+        # Recorded basic + computed properties of a CID, else synthetic ones
+        recorded = {}
+        for names in (BASIC_PROPERTIES, COMPUTED_PROPERTIES):
+            route = self.routes.get(f"/rest/pug/compound/cid/{cid}/property/{names}/JSON")
+            if route and route["status"] == 200:
+                recorded.update(route["body"]["PropertyTable"]["Properties"][0])
+        return recorded or synthetic_properties(cid)
+
+    def respond(self, method, path, form):
+        if method == "GET" and path in self.routes:
+            route = self.routes[path]
+            return route["status"], route["body"]
+        parts = path.strip("/").split("/")
+        # /rest/pug/compound/cid/property/<names>/JSON (multi-CID POST)
+        if parts[:5] == ["rest", "pug", "compound", "cid", "property"] and len(parts) == 7:
+            names = parts[5].split(",")
+            cids = [int(cid) for cid in ",".join(form.get("cid", [])).split(",") if cid.strip().isdigit()]
+            rows = [property_table(self.compound_properties(cid), names)["PropertyTable"]["Properties"][0] for cid in cids]
+            return (200, {"PropertyTable": {"Properties": rows}}) if rows else (404, {"Fault": {"Code": "PUGREST.NotFound"}})
+        # /rest/pug/compound/cid/<cid>/<operation>[/<names>]/JSON
+        if parts[:4] == ["rest", "pug", "compound", "cid"] and len(parts) >= 7 and parts[4].isdigit():
+            cid = int(parts[4])
+            if parts[5] == "property":
+                return 200, property_table(self.compound_properties(cid), parts[6].split(","))
+            return synthetic_compound_route(cid, parts[5])
+        # /rest/v1/core/entry/<pdb_id> and /download/<pdb_id>.cif
+        if parts[:4] == ["rest", "v1", "core", "entry"] and len(parts) == 5:
+            return 200, synthetic_entry(parts[4].upper())
+        if parts[:1] == ["download"] and len(parts) == 2 and parts[1].endswith(".cif"):
+            return 200, f"data_{parts[1][:-4].upper()}\n#\n"
+        return 404, {"Fault": {"Code": "PUGREST.NotFound"}}
+
+    async def __call__(self, scope, receive, send):
+        # Minimal ASGI app, so the stand-in adds as little overhead as possible
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000 if self.latency_ms else 0.0
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            status, payload = self.error_status, {"Fault": {"Code": "ServerBusy", "Message": "Injected error"}}
+        else:
+            status, payload = self.respond(scope["method"], scope["path"], parse_qs(body.decode("latin-1")))
+        if isinstance(payload, str):
+            data, content_type = payload.encode("utf-8"), b"text/plain"
+        else:
+            data, content_type = json.dumps(payload).encode("utf-8"), b"application/json"
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", content_type), (b"content-length", str(len(data)).encode())]})
+        await send({"type": "http.response.body", "body": data})
+
+
+def load_fixtures(path=FIXTURES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def record(cids, pdb_ids, path=FIXTURES_PATH):
+    # Fetch the service's routes for the given IDs from the real upstreams and
+    # merge them into the fixture file
+    import httpx
+
+    fixtures = load_fixtures(path)
+    routes = fixtures.setdefault("routes", {})
+    paths = [f"/rest/pug/compound/cid/{cid}/{route}" for cid in cids for route in COMPOUND_ROUTES]
+    with httpx.Client(timeout=30) as client:
+        for route in paths:
+            r = client.get(PUBCHEM_URL + route)
+            routes[route] = {"status": r.status_code, "body": r.json() if "json" in r.headers.get("content-type", "") else r.text}
+            print(f"{r.status_code} {route}")
+        for pdb_id in pdb_ids:
+            route = f"/rest/v1/core/entry/{pdb_id.upper()}"
+            r = client.get(RCSB_DATA_URL + route)
+            routes[route] = {"status": r.status_code, "body": r.json() if r.status_code == 200 else r.text}
+            print(f"{r.status_code} {route}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(fixtures, f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local PubChem/RCSB stand-in for load tests")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Serve recorded and synthetic responses")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8900)
+    serve.add_argument("--latency-ms", type=float, default=0.0, help="Mean added latency per request")
+    serve.add_argument("--jitter-ms", type=float, default=0.0, help="Standard deviation of the added latency")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    serve.add_argument("--error-status", type=int, default=503)
+    serve.add_argument("--fixtures", default=FIXTURES_PATH)
+    serve.add_argument("--seed", type=int, default=0)
+    rec = commands.add_parser("record", help="Record real responses into the fixture file")
+    rec.add_argument("cids", nargs="*")
+    rec.add_argument("--pdb", nargs="*", default=[])
+    rec.add_argument("--fixtures", default=FIXTURES_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args.cids, args.pdb, args.fixtures)
+        return
+    import uvicorn
+
+    app = FakeUpstream(load_fixtures(args.fixtures), args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# Benchmark of the formula parser in formula.py against the original
+# calculate_molecular_weight from main.py (kept below as legacy_*).
+#
+# The cold row parses every distinct formula once with empty caches; the
+# warm row repeats the sample once they are all cached, so --unique has to
+# fit in molecular_mass's cache.
+#
+#   python benchmarks/formula_bench.py [--formulas 1000000] [--unique 20000]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from formula import bulk_masses, molecular_mass, parse_formula
+
+
+def legacy_calculate_molecular_weight(formula):
+    try:
+        # Basic molecular weight calculation
+        # This is a simplified version - you might want to use a chemistry library for more accuracy
+        atomic_weights = {
+            'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'P': 30.974,
+            'S': 32.065, 'F': 18.998, 'Cl': 35.453, 'Br': 79.904, 'I': 126.904
+        }
+        
+        import re
+        pattern = r'([A-Z][a-z]*)(\d*)'
+        matches = re.findall(pattern, formula)
+        
+        total_weight = 0
+        for element, count in matches:
+            count = int(count) if count else 1
+            if element in atomic_weights:
+                total_weight += atomic_weights[element] * count
+        
+        return round(total_weight, 3)
+    except Exception as e:
+        print(f"Error calculating molecular weight: {e}")
+        return None
+
+
+# The legacy function only knows these elements
+ELEMENTS = ["C", "H", "N", "O", "P", "F", "Br", "I"]
+
+
+def random_formula(rng):
+    parts = []
+    for element in ELEMENTS:
+        if element in ("C", "H") or rng.random() < 0.4:
+            count = rng.randint(1, 40)
+            parts.append(element + (str(count) if count > 1 else ""))
+    return "".join(parts)
+
+
+def timed(label, n, fn, repeat=5):
+    # Best of repeat runs
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{label:<34} {elapsed * 1e6 / n:9.3f} us/formula  ({n} formulas, {elapsed:.2f}s)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark formula parsing and molecular masses")
+    parser.add_argument("--formulas", type=int, default=1000000)
+    parser.add_argument("--unique", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.unique > molecular_mass.cache_info().maxsize:
+        parser.error(f"--unique must fit in the molecular_mass cache ({molecular_mass.cache_info().maxsize})")
+
+    rng = random.Random(args.seed)
+    unique = list({random_formula(rng) for _ in range(args.unique)})
+    formulas = [rng.choice(unique) for _ in range(args.formulas)]
+    sample = formulas[:min(len(formulas), 200000)]
+
+    legacy = timed("legacy calculate_molecular_weight", len(sample), lambda: [legacy_calculate_molecular_weight(f) for f in sample])
+
+    def cold():
+        parse_formula.cache_clear()
+        molecular_mass.cache_clear()
+        return [molecular_mass(f) for f in unique]
+
+    timed("molecular_mass (cold cache)", len(unique), cold)
+    current = timed("molecular_mass (warm cache)", len(sample), lambda: [molecular_mass(f) for f in sample])
+
+    masses = timed("bulk_masses (average)", len(formulas), lambda: bulk_masses(formulas))
+    timed("bulk_masses (monoisotopic)", len(formulas), lambda: bulk_masses(formulas, kind="monoisotopic"))
+
+    difference = np.max(np.abs(np.round(current, 3) - np.asarray(legacy)))
+    print(f"max |legacy - current| over the shared elements: {difference:.6f}")
+    print(f"bulk and scalar agree: {bool(np.allclose(masses[:len(sample)], current))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Load test for /predict and /predict-unknown against a local PubChem/RCSB
+# stand-in (benchmarks/fake_upstream.py), so no real upstream is touched.
+#
+# Starts the stand-in and the service (uvicorn main:app) as subprocesses,
+# drives each endpoint at fixed concurrency levels and reports p50/p95/p99
+# latency and requests/sec:
+#
+#   python benchmarks/load_test.py --concurrency 1,8,32 --requests 500 --latency-ms 80 --jitter-ms 30
+#   python benchmarks/load_test.py --json results.json
+#   python benchmarks/load_test.py --baseline results.json   # exits 1 on a >20% regression
+#
+# --unique-cids controls how many distinct compounds are requested, and so
+# the cache hit ratio; --url targets an already running service instead.
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+
+import httpx
+import numpy as np
+
+from benchmarks.common import check_baseline, save_results
+
+RECEPTORS = ["1HSG", "6LU7", "3PBL", "4DKL", "5R7Y"]
+FORMULAS = ["C9H8O4", "C8H10N4O2", "C13H18O2", "C8H9NO2", "C17H19NO3", "C21H30O2", "C6H12O6", "CuSO4·5H2O"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def start_stack(args, workdir):
+    upstream_port = free_port()
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_upstream.py"), "serve", "--port", str(upstream_port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+    ])
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    wait_ready(upstream_url, upstream)
+
+    service_port = free_port()
+    env = dict(
+        os.environ,
+        PUBCHEM_PUG_URL=f"{upstream_url}/rest/pug",
+        RCSB_DATA_URL=upstream_url,
+        RCSB_FILES_URL=f"{upstream_url}/download",
+        RECEPTOR_CACHE_DIR=os.path.join(workdir, "receptors"),
+        JOB_DB_PATH=os.path.join(workdir, "jobs.sqlite"),
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+        # The stand-in has no quota; keep PubChem's client-side limit out of the way
+        PUBCHEM_RATE_LIMIT=os.environ.get("PUBCHEM_RATE_LIMIT", "0"),
+    )
+    # Every store the service writes is left in memory or under the workdir
+    for name in ("PUBCHEM_CACHE_PATH", "GENOME_REPORT_CACHE_PATH", "RESULT_STORE_PATH", "PUBCHEM_LOCAL_STORE", "RECEPTOR_PREFETCH"):
+        env.pop(name, None)
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(service_port), "--log-level", "warning", "--no-access-log"],
+        cwd=SERVICE_DIR, env=env,
+    )
+    service_url = f"http://127.0.0.1:{service_port}"
+    try:
+        wait_ready(service_url, service)
+    except Exception:
+        upstream.terminate()
+        service.terminate()
+        raise
+    return service_url, [service, upstream]
+
+
+def make_payloads(endpoint, count, unique_cids, rng):
+    if endpoint == "predict":
+        # The fixture compounds plus synthetic ones
+        pool = ["2244", "2519"] + [str(1000000 + i) for i in range(max(0, unique_cids - 2))]
+        return [{"cid": rng.choice(pool), "smiles": "C"} for _ in range(count)]
+    return [{"chemical_formula": rng.choice(FORMULAS), "receptor_pdb_id": rng.choice(RECEPTORS)} for _ in range(count)]
+
+
+async def run_level(client, url, endpoint, payloads, concurrency):
+    latencies = []
+    errors = 0
+    queue = list(reversed(payloads))
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            payload = queue.pop()
+            start = time.perf_counter()
+            try:
+                r = await client.post(f"{url}/{endpoint}", json=payload)
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(payloads),
+        "errors": errors,
+        "rps": len(payloads) / elapsed,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+async def run(args, url):
+    rng = random.Random(args.seed)
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        for endpoint in args.endpoints:
+            if args.warmup:
+                await run_level(client, url, endpoint, make_payloads(endpoint, args.warmup, args.unique_cids, rng), 1)
+            for concurrency in args.concurrency:
+                payloads = make_payloads(endpoint, args.requests, args.unique_cids, rng)
+                results.append(await run_level(client, url, endpoint, payloads, concurrency))
+                row = results[-1]
+                print(f"{row['endpoint']:<16}{row['concurrency']:>6}{row['requests']:>9}{row['errors']:>8}"
+                      f"{row['rps']:>10.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /predict and /predict-unknown against a local upstream stand-in")
+    parser.add_argument("--url", help="Test a running service instead of starting one")
+    parser.add_argument("--endpoints", type=lambda v: v.split(","), default=["predict", "predict-unknown"])
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=300, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--unique-cids", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=15.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail on a regression against a results file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    print(f"{'endpoint':<16}{'conc':>6}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = []
+        try:
+            url = args.url
+            if url is None:
+                url, processes = start_stack(args, workdir)
+            results = asyncio.run(run(args, url.rstrip("/")))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+    if args.json:
+        save_results(args.json, results)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, lambda row: f"{row['endpoint']}@{row['concurrency']}",
+                                     ("p95_ms", "p99_ms"), ("rps",), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
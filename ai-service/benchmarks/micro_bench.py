@@ -0,0 +1,99 @@
+# Micro-benchmarks for the per-compound hot path: safe_get, property record
+# parsing, the scoring functions, the whole parse/score/build step of a
+# /predict response and calculate_molecular_weight, reported in
+# microseconds per call (per compound for the 1k batch cases).
+#
+#   python benchmarks/micro_bench.py --json micro.json
+#   python benchmarks/micro_bench.py --baseline micro.json   # exits 1 on a >20% regression
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.common import check_baseline, save_results
+from formula import molecular_mass, parse_formula
+from main import calculate_molecular_weight
+from predictions import build_prediction
+from scoring import (PropertyRecord, as_records, calculate_drug_likeness, calculate_effectiveness, predict_binding_affinity,
+                     predict_toxicity, safe_get, score_batch, score_record)
+
+# Aspirin, as returned by PubChem (numbers partly as strings)
+PROPS = {
+    "CID": 2244, "MolecularFormula": "C9H8O4", "MolecularWeight": "180.16", "IUPACName": "2-acetyloxybenzoic acid",
+    "InChIKey": "BSYNRYMUTXBXSQ-UHFFFAOYSA-N", "XLogP": 1.2, "HBondDonorCount": 1, "HBondAcceptorCount": 4,
+    "RotatableBondCount": 3, "Complexity": 212, "Volume3D": 136,
+}
+BATCH = [PROPS] * 1000
+RECORD = PropertyRecord(PROPS)
+
+
+def predict_path(props):
+    # What /predict does with fetched properties: parse, score, build
+    record = PropertyRecord(props)
+    return build_prediction("2244", record, "Aspirin", None, score_record(record), None)
+
+
+def predict_batch_path(batch):
+    # What /predict/batch does with them
+    records = as_records(batch)
+    return [build_prediction("2244", record, "Aspirin", None, scores, None)
+            for record, scores in zip(records, score_batch(records))]
+
+
+def cold_molecular_weight(formula):
+    molecular_mass.cache_clear()
+    parse_formula.cache_clear()
+    return calculate_molecular_weight(formula)
+
+
+CASES = [
+    ("safe_get numeric string", lambda: safe_get(PROPS, "MolecularWeight")),
+    ("safe_get number", lambda: safe_get(PROPS, "XLogP")),
+    ("safe_get missing", lambda: safe_get(PROPS, "Charge")),
+    ("PropertyRecord parse", lambda: PropertyRecord(PROPS)),
+    ("score_record", lambda: score_record(RECORD)),
+    ("predict_binding_affinity", lambda: predict_binding_affinity(PROPS)),
+    ("predict_toxicity", lambda: predict_toxicity(PROPS)),
+    ("calculate_drug_likeness", lambda: calculate_drug_likeness(PROPS)),
+    ("calculate_effectiveness", lambda: calculate_effectiveness(PROPS)),
+    ("score_batch per compound (1k batch)", lambda: score_batch(BATCH)),
+    ("parse, score and build response", lambda: predict_path(PROPS)),
+    ("parse, score and build response (1k batch)", lambda: predict_batch_path(BATCH)),
+    ("calculate_molecular_weight cached", lambda: calculate_molecular_weight("C9H8O4")),
+    ("calculate_molecular_weight uncached", lambda: cold_molecular_weight("C17H19NO3·H2O")),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for scoring and formula parsing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail on a regression against a results file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, fn in CASES:
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(args.repeat, number)) / number
+        per_call = best / len(BATCH) if "1k batch" in name else best
+        results.append({"name": name, "us_per_call": per_call * 1e6})
+        print(f"{name:<46}{per_call * 1e6:>12.3f} us")
+
+    if args.json:
+        save_results(args.json, results)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, lambda row: row["name"], ("us_per_call",), tolerance=args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
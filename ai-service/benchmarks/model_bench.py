@@ -0,0 +1,84 @@
+# Inference latency of the trained scoring models in models.py, per 1000
+# compounds, for one batched score_matrix call and for 1000 single-compound
+# score_properties calls, next to the heuristic engine.
+#
+#   python benchmarks/model_bench.py [--model models/scoring] [--compounds 100000]
+#
+# Without --model a model is trained on synthetic descriptors labelled with
+# the heuristic scores plus noise, and timed both as the joblib artifact
+# (scikit-learn) and compiled (numpy over memory-mapped node tables).
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from models import ScoringModel, compile_artifact, save_artifact, train_models
+from scoring import SCORING_COLUMNS, score_matrix, score_properties
+
+
+def synthetic_matrix(n, rng):
+    return np.column_stack([
+        rng.uniform(50, 900, n),
+        rng.normal(2, 2.5, n),
+        rng.integers(0, 15, n),
+        rng.integers(0, 8, n),
+        rng.integers(0, 15, n),
+        rng.uniform(0, 1200, n),
+    ])
+
+
+def time_per_1k(fn, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best / rows * 1000 * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scoring model inference latency")
+    parser.add_argument("--model", help="Trained artifact (default: train one on synthetic data)")
+    parser.add_argument("--compounds", type=int, default=100000)
+    parser.add_argument("--train-rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    if args.model:
+        models = {"model": ScoringModel.load(args.model)}
+    else:
+        matrix = synthetic_matrix(args.train_rows, rng)
+        heuristic = score_matrix(matrix)
+        labels = {target: heuristic[target] + rng.normal(0, 3, len(matrix)) for target in ("binding_affinity", "toxicity")}
+        start = time.perf_counter()
+        artifact = train_models(matrix, labels, version="bench")
+        print(f"Trained on {args.train_rows} rows in {time.perf_counter() - start:.2f}s: {artifact['metrics']}")
+        models = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            save_artifact(artifact, os.path.join(tmp, "scoring.joblib"))
+            compile_artifact(artifact, os.path.join(tmp, "scoring"))
+            for name, path in (("joblib", "scoring.joblib"), ("compiled", "scoring")):
+                start = time.perf_counter()
+                models[name] = ScoringModel.load(os.path.join(tmp, path))
+                print(f"Loaded {name} artifact in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    matrix = synthetic_matrix(args.compounds, rng)
+    singles = [dict(zip(SCORING_COLUMNS, row)) for row in matrix[:1000]]
+
+    print(f"{args.compounds} compounds, ms per 1000 compounds (best of {args.repeat}):")
+    print(f"  {'heuristic batch:':<24}{time_per_1k(lambda: score_matrix(matrix), len(matrix), args.repeat):8.3f}")
+    for name, model in models.items():
+        print(f"  {name + ' batch:':<24}{time_per_1k(lambda: score_matrix(matrix, model), len(matrix), args.repeat):8.3f}")
+    print(f"  {'heuristic single:':<24}{time_per_1k(lambda: [score_properties(p) for p in singles], len(singles), args.repeat):8.3f}")
+    for name, model in models.items():
+        print(f"  {name + ' single:':<24}{time_per_1k(lambda: [score_properties(p, model) for p in singles], len(singles), args.repeat):8.3f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
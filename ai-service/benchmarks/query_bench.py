@@ -0,0 +1,137 @@
+# Property range queries over the local property store (property_store.py),
+# on a synthetic store of millions of compounds: the sorted indexes against
+# scanning the columns, for counting every match and for the first and a
+# deep page of 100.
+#
+#   python benchmarks/query_bench.py --compounds 5000000
+#   python benchmarks/query_bench.py --store data/pubchem-props   # a real store
+#   python benchmarks/query_bench.py --json query.json
+#   python benchmarks/query_bench.py --baseline query.json        # exits 1 on a >20% regression
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.common import check_baseline, save_results
+from property_store import NUMERIC_COLUMNS, STORE_VERSION, TEXT_COLUMNS, PropertyStore, build_indexes, intersect_ranges
+from scoring import DRUG_LIKENESS_RANGES
+
+QUERIES = {
+    "drug_like": DRUG_LIKENESS_RANGES,
+    "mw<=500,xlogp 1-3,hbd<=5": {"MolecularWeight": (None, 500), "XLogP": (1, 3), "HBondDonorCount": (None, 5)},
+    "drug_like,complexity 300-320": intersect_ranges(DRUG_LIKENESS_RANGES, {"Complexity": (300, 320)}),
+    "mw 300-301,xlogp>=4": {"MolecularWeight": (300, 301), "XLogP": (4, None)},
+    "volume3d 400-400.5": {"Volume3D": (400, 400.5)},
+}
+
+
+def synthetic_store(path, n, rng):
+    # Written column by column in the store's format; text columns are empty
+    os.makedirs(path)
+    np.save(os.path.join(path, "cid.npy"), np.sort(rng.choice(n * 4, n, replace=False)).astype(np.int64))
+    columns = {
+        "MolecularWeight": rng.lognormal(5.9, 0.45, n),
+        "XLogP": rng.normal(2.5, 2.5, n),
+        "HBondDonorCount": rng.poisson(2, n).astype(float),
+        "HBondAcceptorCount": rng.poisson(5, n).astype(float),
+        "RotatableBondCount": rng.poisson(5, n).astype(float),
+        "Complexity": rng.gamma(2.5, 180, n),
+        "Volume3D": rng.normal(300, 90, n),
+    }
+    # PubChem has no XLogP or 3D volume for part of its compounds
+    columns["XLogP"][rng.random(n) < 0.1] = np.nan
+    columns["Volume3D"][rng.random(n) < 0.3] = np.nan
+    for name in NUMERIC_COLUMNS:
+        np.save(os.path.join(path, f"{name}.npy"), columns[name])
+    for name in TEXT_COLUMNS:
+        np.save(os.path.join(path, f"{name}.offsets.npy"), np.zeros(n + 1, dtype=np.int64))
+        open(os.path.join(path, f"{name}.bytes"), "wb").close()
+    start = time.perf_counter()
+    build_indexes(path)
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"version": STORE_VERSION, "count": n}, f)
+    return elapsed
+
+
+def best_ms(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def first_page(store, ranges, after=None):
+    return [row for rows in store.query(ranges, after, 100) for row in rows.tolist()]
+
+
+def run(store, repeat):
+    scan = PropertyStore(store.path)
+    # The same store with its indexes ignored, so every query scans
+    scan.indexes = {}
+    print(f"{len(store)} compounds, ms (best of {repeat})")
+    print(f"{'query':<30}{'matches':>10}{'count idx':>11}{'count scan':>11}{'page idx':>10}{'page scan':>10}{'deep idx':>10}{'deep scan':>10}")
+    results = []
+    for name, ranges in QUERIES.items():
+        matches = store.count(ranges)
+        if scan.count(ranges) != matches:
+            raise AssertionError(f"{name}: indexed and scanned counts differ")
+        # A cursor about 90% of the way through the matches
+        rows = np.concatenate(list(store.match(ranges)) or [np.zeros(0, dtype=np.int64)])
+        after = int(store.cids[rows[int(len(rows) * 0.9)]]) if len(rows) else None
+        if first_page(store, ranges, after) != first_page(scan, ranges, after):
+            raise AssertionError(f"{name}: indexed and scanned pages differ")
+        row = {
+            "query": name, "matches": matches,
+            "count_index_ms": best_ms(lambda: store.count(ranges), repeat),
+            "count_scan_ms": best_ms(lambda: scan.count(ranges), repeat),
+            "page_index_ms": best_ms(lambda: first_page(store, ranges), repeat),
+            "page_scan_ms": best_ms(lambda: first_page(scan, ranges), repeat),
+            "deep_page_index_ms": best_ms(lambda: first_page(store, ranges, after), repeat),
+            "deep_page_scan_ms": best_ms(lambda: first_page(scan, ranges, after), repeat),
+        }
+        results.append(row)
+        print(f"{name:<30}{matches:>10}{row['count_index_ms']:>11.2f}{row['count_scan_ms']:>11.2f}{row['page_index_ms']:>10.2f}"
+              f"{row['page_scan_ms']:>10.2f}{row['deep_page_index_ms']:>10.2f}{row['deep_page_scan_ms']:>10.2f}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark property range queries over the local property store")
+    parser.add_argument("--store", help="Existing store (default: build a synthetic one)")
+    parser.add_argument("--compounds", type=int, default=2000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail on a regression against a results file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.store
+        if path is None:
+            path = os.path.join(tmp, "store")
+            elapsed = synthetic_store(path, args.compounds, np.random.default_rng(0))
+            print(f"Built the indexes of {args.compounds} compounds in {elapsed:.1f}s")
+        results = run(PropertyStore(path), args.repeat)
+
+    if args.json:
+        save_results(args.json, results)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, lambda row: row["query"],
+                                     ("count_index_ms", "page_index_ms", "deep_page_index_ms"), (), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
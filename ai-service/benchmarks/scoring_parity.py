@@ -0,0 +1,286 @@
+# Parity check and timing for the vectorised scoring engine in scoring.py.
+#
+# The legacy_* functions below are the original scalar implementations from
+# main.py, kept verbatim as the reference. Random property dicts (including
+# missing, "N/A", numeric strings, unparseable strings, zeros and negative
+# values) are scored by both and every output must be identical.
+#
+#   python benchmarks/scoring_parity.py [--rows 20000] [--seed 0]
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from scoring import SCORING_COLUMNS, as_records, property_matrix, score_batch, score_matrix, score_properties
+
+
+def legacy_safe_get(props, key, default="N/A"):
+    try:
+        value = props.get(key)
+        # Convert empty strings, None, or "N/A" to default
+        if value in [None, "", "N/A"]:
+            return default
+        # Try to convert numerical strings to float
+        if isinstance(value, str) and any(c.isdigit() for c in value):
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        return value
+    except Exception as e:
+        print(f"Error getting property {key}: {e}")
+        return default
+
+def legacy_predict_binding_affinity(props):
+    try:
+        # Get properties with fallback values
+        mw = float(legacy_safe_get(props, "MolecularWeight", 0))
+        logp = float(legacy_safe_get(props, "XLogP", 0))
+        hba = int(legacy_safe_get(props, "HBondAcceptorCount", 0))
+        hbd = int(legacy_safe_get(props, "HBondDonorCount", 0))
+        complexity = float(legacy_safe_get(props, "Complexity", 0))
+        
+        # Calculate score even if some properties are missing
+        mw_score = min(mw / 1000, 1) if mw else 0
+        logp_score = min(abs(logp) / 5, 1) if logp else 0
+        hba_score = min(hba / 10, 1) if hba else 0
+        hbd_score = min(hbd / 5, 1) if hbd else 0
+        complexity_score = min(complexity / 1000, 1) if complexity else 0
+        
+        # Weight the scores, giving more weight to available properties
+        total_weight = sum(bool(x) for x in [mw_score, logp_score, hba_score, hbd_score, complexity_score])
+        if total_weight == 0:
+            return "N/A"
+            
+        score = ((mw_score + logp_score + hba_score + hbd_score + complexity_score) / total_weight) * 100
+        return f"{score:.2f}%"
+    except Exception as e:
+        print('Binding affinity error:', e)
+        return {"score": None, "display": "N/A"}
+
+def legacy_predict_toxicity(props):
+    try:
+        # Get properties with fallback values
+        mw = float(legacy_safe_get(props, "MolecularWeight", 0))
+        logp = float(legacy_safe_get(props, "XLogP", 0))
+        rotatable_bonds = int(legacy_safe_get(props, "RotatableBondCount", 0))
+        complexity = float(legacy_safe_get(props, "Complexity", 0))
+        
+        # Calculate score even if some properties are missing
+        mw_score = min(mw / 1000, 1) if mw else 0
+        logp_score = min(abs(logp) / 5, 1) if logp else 0
+        rot_score = min(rotatable_bonds / 10, 1) if rotatable_bonds else 0
+        complexity_score = min(complexity / 1000, 1) if complexity else 0
+        
+        # Weight the scores, giving more weight to available properties
+        total_weight = sum(bool(x) for x in [mw_score, logp_score, rot_score, complexity_score])
+        if total_weight == 0:
+            return "N/A"
+            
+        toxicity_score = ((logp_score * 0.4 + rot_score * 0.3 + mw_score * 0.2 + complexity_score * 0.1) / total_weight) * 100
+        
+        if toxicity_score < 30:
+            return "Low"
+        elif toxicity_score < 70:
+            return "Medium"
+        else:
+            return "High"
+    except Exception as e:
+        print('Toxicity error:', e)
+        return {"score": None, "display": "N/A"}
+
+def legacy_calculate_drug_likeness(props):
+    try:
+        # Get properties with fallback values
+        mw = float(legacy_safe_get(props, "MolecularWeight", 0))
+        logp = float(legacy_safe_get(props, "XLogP", 0))
+        hba = int(legacy_safe_get(props, "HBondAcceptorCount", 0))
+        hbd = int(legacy_safe_get(props, "HBondDonorCount", 0))
+        rotatable_bonds = int(legacy_safe_get(props, "RotatableBondCount", 0))
+        
+        # Calculate Lipinski's Rule of 5 and additional criteria
+        rules_passed = 0
+        total_rules = 0
+        
+        if mw:
+            total_rules += 1
+            if mw <= 500: rules_passed += 1
+            
+        if logp is not None:
+            total_rules += 1
+            if -0.4 <= logp <= 5.6: rules_passed += 1
+            
+        if hba is not None:
+            total_rules += 1
+            if hba <= 10: rules_passed += 1
+            
+        if hbd is not None:
+            total_rules += 1
+            if hbd <= 5: rules_passed += 1
+            
+        if rotatable_bonds is not None:
+            total_rules += 1
+            if rotatable_bonds <= 10: rules_passed += 1
+            
+        if total_rules == 0:
+            return "N/A"
+            
+        likeness_score = (rules_passed / total_rules) * 100
+        
+        if likeness_score >= 80:
+            return "Excellent"
+        elif likeness_score >= 60:
+            return "Good"
+        elif likeness_score >= 40:
+            return "Moderate"
+        else:
+            return "Poor"
+    except Exception as e:
+        print('Drug-likeness error:', e)
+        return {"score": None, "display": "N/A"}
+
+
+def legacy_effectiveness(props):
+    # Inline effectiveness block from the original predict_properties
+    try:
+        mw = float(legacy_safe_get(props, "MolecularWeight", 0))
+        logp = float(legacy_safe_get(props, "XLogP", 0))
+        hba = int(legacy_safe_get(props, "HBondAcceptorCount", 0))
+        hbd = int(legacy_safe_get(props, "HBondDonorCount", 0))
+        complexity = float(legacy_safe_get(props, "Complexity", 0))
+
+        mw_score = min(mw / 1000, 1) if mw else 0
+        logp_score = min(abs(logp) / 5, 1) if logp else 0
+        hba_score = min(hba / 10, 1) if hba else 0
+        hbd_score = min(hbd / 5, 1) if hbd else 0
+        complexity_score = min(complexity / 1000, 1) if complexity else 0
+
+        weights = {
+            'mw': 0.25 if mw_score else 0,
+            'logp': 0.25 if logp_score else 0,
+            'hba': 0.2 if hba_score else 0,
+            'hbd': 0.2 if hbd_score else 0,
+            'complexity': 0.1 if complexity_score else 0
+        }
+
+        total_weight = sum(weights.values())
+        if total_weight == 0:
+            return None
+        weights = {k: v/total_weight for k, v in weights.items()}
+        return (
+            mw_score * weights['mw'] +
+            logp_score * weights['logp'] +
+            hba_score * weights['hba'] +
+            hbd_score * weights['hbd'] +
+            complexity_score * weights['complexity']
+        ) * 100
+    except Exception:
+        return None
+
+
+def legacy_scores(props):
+    # The legacy scorers print on every unparseable value
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {
+            "binding_affinity": legacy_predict_binding_affinity(props),
+            "toxicity": legacy_predict_toxicity(props),
+            "drug_likeness": legacy_calculate_drug_likeness(props),
+            "effectiveness": legacy_effectiveness(props),
+        }
+
+
+def random_value(rng, key):
+    kind = rng.random()
+    if kind < 0.08:
+        return None
+    if kind < 0.12:
+        return rng.choice(["", "N/A"])
+    if kind < 0.15:
+        return 0
+    if kind < 0.17:
+        return rng.choice(["abc", "12abc", "-"])
+    if key in ("HBondAcceptorCount", "HBondDonorCount", "RotatableBondCount"):
+        value = rng.randint(0, 20)
+    elif key == "XLogP":
+        value = round(rng.uniform(-4, 9), 1)
+    else:
+        value = round(rng.uniform(-5, 1500), 2)
+    if rng.random() < 0.3:
+        return str(value)
+    return value
+
+
+def random_props(rng):
+    return {key: random_value(rng, key) for key in SCORING_COLUMNS if rng.random() > 0.05}
+
+
+def check_parity(records):
+    expected = [legacy_scores(props) for props in records]
+    actual = score_batch(records)
+    mismatches = [(props, e, a) for props, e, a in zip(records, expected, actual) if e != a]
+    for props, e, a in mismatches[:10]:
+        print("MISMATCH", props, e, a)
+    # The scalar path used by /predict (plain Python over a PropertyRecord)
+    # must agree as well, as must batches of already parsed records
+    for props, e in zip(records, expected):
+        if score_properties(props) != e:
+            mismatches.append((props, e, score_properties(props)))
+    parsed = as_records(records)
+    mismatches.extend((props, e, a) for props, e, a in zip(records, expected, score_batch(parsed)) if e != a)
+    return len(mismatches)
+
+
+def check_dataframe_parity(rng, rows):
+    # Numeric DataFrame columns use NaN for missing values
+    records = []
+    for _ in range(rows):
+        props = {}
+        for key in SCORING_COLUMNS:
+            value = random_value(rng, key)
+            if isinstance(value, (int, float)) and value != 0 and rng.random() > 0.1:
+                props[key] = float(value)
+        records.append(props)
+    frame = pd.DataFrame(records, columns=list(SCORING_COLUMNS))
+    expected = [legacy_scores(props) for props in records]
+    return sum(1 for e, a in zip(expected, score_batch(frame)) if e != a)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check vectorised scoring against the original scalar scorers")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    records = [random_props(rng) for _ in range(args.rows)]
+
+    failures = check_parity(records) + check_dataframe_parity(rng, args.rows // 4)
+    print(f"parity: {args.rows + args.rows // 4} rows, {failures} mismatches")
+
+    start = time.perf_counter()
+    for props in records:
+        legacy_scores(props)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = property_matrix(records)
+    parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    score_matrix(matrix)
+    vector_time = time.perf_counter() - start
+
+    print(f"legacy scalar:      {legacy_time * 1e6 / args.rows:8.2f} us/compound")
+    print(f"matrix build:       {parse_time * 1e6 / args.rows:8.2f} us/compound")
+    print(f"vectorised scoring: {vector_time * 1e6 / args.rows:8.2f} us/compound")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
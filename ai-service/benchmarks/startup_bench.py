@@ -0,0 +1,168 @@
+# Cold start of the service: import-time profile of main.py and time to the
+# first response, against a local PubChem/RCSB stand-in.
+#
+# Starts the stand-in once, then for each run starts uvicorn main:app from
+# scratch and times, from process start, the first answer to GET / (what a
+# platform health check waits for) and the first POST /predict:
+#
+#   python benchmarks/startup_bench.py --runs 5 --model models/scoring
+#   python benchmarks/startup_bench.py --service-dir ../old/ai-service   # another checkout, e.g. the previous release
+#   python benchmarks/startup_bench.py --json startup.json
+#   python benchmarks/startup_bench.py --baseline startup.json           # exits 1 on a >20% regression
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+
+from benchmarks.common import check_baseline, save_results
+from benchmarks.load_test import free_port, wait_ready
+
+# Libraries whose import dominates a cold start when they are on the path
+HEAVY_MODULES = ("numpy", "pandas", "sklearn", "joblib", "scipy", "pubchempy")
+
+
+def import_profile(service_dir, env, top):
+    # python -X importtime lines: "import time: self [us] | cumulative | name"
+    code = f"import json, sys, main; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=service_dir, env=env,
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1000, name.rstrip()))
+    total = next(ms for ms, name in modules if name.strip() == "main")
+    heavy = json.loads(result.stdout.strip().splitlines()[-1])
+    return total, heavy, sorted(modules, reverse=True)[:top]
+
+
+def request(port, method, path, body=None):
+    # http.client rather than httpx: polling must not compete for the CPU
+    # with the server that is starting up (an httpx client per attempt builds
+    # an SSL context)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def first_responses(service_dir, env, predict_payload, timeout=60):
+    # Seconds from starting the server to the first GET / and the first
+    # POST /predict answers
+    port = free_port()
+    started = time.perf_counter()
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=service_dir, env=env,
+    )
+    try:
+        deadline = started + timeout
+        while True:
+            if service.poll() is not None:
+                raise RuntimeError(f"Service exited with code {service.returncode}")
+            try:
+                if request(port, "GET", "/") == 200:
+                    break
+            except OSError:
+                pass
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Service did not answer within {timeout}s")
+            time.sleep(0.01)
+        root = time.perf_counter() - started
+        status = request(port, "POST", "/predict", predict_payload)
+        if status != 200:
+            raise RuntimeError(f"POST /predict answered {status}")
+        return root, time.perf_counter() - started
+    finally:
+        service.terminate()
+        service.wait()
+
+
+def summarise(name, samples):
+    samples = [sample * 1000 for sample in samples]
+    return {"name": name, "median_ms": statistics.median(samples), "min_ms": min(samples), "max_ms": max(samples), "runs": len(samples)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and time to first response of the service")
+    parser.add_argument("--service-dir", default=SERVICE_DIR, help="ai-service checkout to measure (default: this one)")
+    parser.add_argument("--model", help="SCORING_MODEL_PATH for the service (a compiled directory or joblib artifact)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Stand-in upstream latency")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Fail on a regression against a results file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    service_dir = os.path.abspath(args.service_dir)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        upstream_port = free_port()
+        upstream = subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, "fake_upstream.py"), "serve", "--port", str(upstream_port),
+            "--latency-ms", str(args.latency_ms), "--jitter-ms", "0",
+        ])
+        upstream_url = f"http://127.0.0.1:{upstream_port}"
+        env = dict(
+            os.environ,
+            PUBCHEM_PUG_URL=f"{upstream_url}/rest/pug",
+            RCSB_DATA_URL=upstream_url,
+            RCSB_FILES_URL=f"{upstream_url}/download",
+            RECEPTOR_CACHE_DIR=os.path.join(workdir, "receptors"),
+            JOB_DB_PATH=os.path.join(workdir, "jobs.sqlite"),
+            LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+            PUBCHEM_RATE_LIMIT="0",
+        )
+        for name in ("PUBCHEM_CACHE_PATH", "GENOME_REPORT_CACHE_PATH", "RESULT_STORE_PATH", "RECEPTOR_PREFETCH", "SCORING_MODEL_PATH"):
+            env.pop(name, None)
+        if args.model:
+            env["SCORING_MODEL_PATH"] = os.path.abspath(args.model)
+        try:
+            wait_ready(upstream_url, upstream)
+            imports, roots, predicts = [], [], []
+            for run in range(args.runs):
+                total, heavy, slowest = import_profile(service_dir, env, args.top)
+                imports.append(total / 1000)
+                # A new CID each run, so every first /predict misses the caches
+                root, predict = first_responses(service_dir, env, {"cid": str(2000000 + run), "smiles": "C"})
+                roots.append(root)
+                predicts.append(predict)
+        finally:
+            upstream.terminate()
+            upstream.wait()
+
+    print("Slowest imports under 'import main' (cumulative ms), last run:")
+    for ms, name in slowest:
+        print(f"{ms:>9.1f}  {name}")
+    print(f"Heavy libraries loaded by 'import main': {', '.join(heavy) or 'none'}")
+    results = [summarise("import_main", imports), summarise("first_response_root", roots), summarise("first_response_predict", predicts)]
+    print(f"\n{'':<26}{'median ms':>10}{'min ms':>10}{'max ms':>10}")
+    for row in results:
+        print(f"{row['name']:<26}{row['median_ms']:>10.0f}{row['min_ms']:>10.0f}{row['max_ms']:>10.0f}")
+
+    if args.json:
+        save_results(args.json, results)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, lambda row: row["name"], ("median_ms",), (), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
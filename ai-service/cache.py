@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Bytes of each SQLite cache file read through a shared memory map, so
+# server processes using the same file share its pages
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+class DiskTier:
+    # Persistent second tier backed by SQLite, so cached entries survive
+    # restarts. The connection is opened lazily on first use.
+    def __init__(self, path, stale_ttl=0):
+        self.path = path
+        self.stale_ttl = stale_ttl
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time() - self.stale_ttl,))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        # (value, expires_at), including expired entries still within the
+        # stale window; callers check expires_at
+        try:
+            with self._lock:
+                row = self._connect().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            # The file is shared with other processes; a locked or unreadable
+            # database is a miss, not a failed request
+            logger.warning("Cache read from %s failed: %s", self.path, e)
+            return None
+        if row is None or row[1] + self.stale_ttl <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(value), expires_at))
+                conn.commit()
+            except sqlite3.Error as e:
+                if self._conn is not None:
+                    self._conn.rollback()
+                logger.warning("Cache write to %s failed: %s", self.path, e)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class TieredCache:
+    # In-process LRU with size and TTL eviction, an optional on-disk tier and
+    # single-flight de-duplication of concurrent loads for the same key.
+    # Values must be JSON serialisable when a disk tier is configured.
+    # Expired entries are kept for another stale_ttl seconds and served only
+    # when reloading them fails, e.g. while the upstream is down.
+    def __init__(self, maxsize=4096, ttl=7 * 24 * 3600, disk_path=None, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.disk = DiskTier(disk_path, stale_ttl) if disk_path else None
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if entry[0] <= now:
+            if entry[0] + self.stale_ttl <= now:
+                del self._entries[key]
+                self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _set_memory(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key, fetcher):
+        # fetcher is an async callable; exceptions it raises are propagated
+        # to every waiter and nothing is cached
+        entry = self._get_memory(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._load(key, fetcher))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, key, fetcher):
+        entry = self._entries.get(key)
+        stale = entry[1] if entry is not None else None
+        if self.disk is not None:
+            stored = await asyncio.to_thread(self.disk.get, key)
+            if stored is not None:
+                value, expires_at = stored
+                if expires_at > time.time():
+                    self.disk_hits += 1
+                    self._set_memory(key, value, expires_at)
+                    return value
+                stale = value if stale is None else stale
+
+        self.misses += 1
+        try:
+            value = await fetcher()
+        except Exception:
+            if stale is None:
+                raise
+            self.stale_hits += 1
+            return stale
+        await self.set(key, value)
+        return value
+
+    async def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, value, expires_at)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value, expires_at)
+
+    def contains(self, key):
+        return self._get_memory(key) is not None
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "persistent": self.disk is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else None,
+        }
+
+    def clear(self):
+        self._entries.clear()
+
+
+pubchem_cache = TieredCache(
+    maxsize=int(os.getenv("PUBCHEM_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("PUBCHEM_CACHE_TTL", str(7 * 24 * 3600))),
+    disk_path=os.getenv("PUBCHEM_CACHE_PATH") or None,
+    stale_ttl=float(os.getenv("PUBCHEM_CACHE_STALE_TTL", str(30 * 24 * 3600))),
+)
+
+# Finished genome reports, so a deferred report is built once per compound
+# and served from here by /genome-report/{cid}
+genome_report_cache = TieredCache(
+    maxsize=int(os.getenv("GENOME_REPORT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("GENOME_REPORT_CACHE_TTL", str(7 * 24 * 3600))),
+    disk_path=os.getenv("GENOME_REPORT_CACHE_PATH") or None,
+    stale_ttl=float(os.getenv("PUBCHEM_CACHE_STALE_TTL", str(30 * 24 * 3600))),
+)
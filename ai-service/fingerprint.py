@@ -0,0 +1,193 @@
+import re
+import zlib
+
+import numpy as np
+
+FINGERPRINT_BITS = 1024
+MAX_PATH_LENGTH = 6
+
+# SMILES tokens: bracket atoms, organic-subset atoms, bonds, branches and ring closures
+SMILES_TOKEN = re.compile(r"(\[[^\]]+\])|(Br|Cl|[BCNOPSFI]|[bcnops]|\*)|([-=#$:/\\.])|([()])|(%\d\d|\d)")
+BRACKET_ATOM = re.compile(r"^\[\d*([A-Z][a-z]?|[a-z][a-z]?|\*)[^\]]*?([+-]+\d*)?\]$")
+BOND_SYMBOLS = {"-": "-", "=": "=", "#": "#", "$": "$", ":": ":", "/": "-", "\\": "-"}
+# Elements that take part in aromatic rings through a double bond, and those
+# that can give one a lone pair (pyrrole, furan, thiophene)
+PI_ELEMENTS = {"C", "N"}
+LONE_PAIR_ELEMENTS = {"N", "O", "S", "Se"}
+
+
+class SmilesError(ValueError):
+    pass
+
+
+def _bond_between(bond, label_a, label_b):
+    # Implicit bonds between two aromatic atoms are aromatic, otherwise single
+    if bond is not None:
+        return BOND_SYMBOLS[bond]
+    return ":" if label_a.islower() and label_b.islower() else "-"
+
+
+def parse_smiles(smiles):
+    # Parse SMILES into atom labels and an adjacency list {atom: [(neighbour, bond)]}.
+    # Stereo, isotopes and hydrogen counts are ignored; charges are kept.
+    # Aromatic rings are perceived, whether written aromatic or Kekulé.
+    labels = []
+    neighbours = []
+    previous = None
+    bond = None
+    branches = []
+    rings = {}
+    pos = 0
+    for match in SMILES_TOKEN.finditer(smiles):
+        if match.start() != pos:
+            break
+        pos = match.end()
+        bracket, organic, bond_token, branch, ring = match.groups()
+        if bracket or organic:
+            if bracket:
+                atom = BRACKET_ATOM.match(bracket)
+                if not atom:
+                    raise SmilesError(f"Invalid atom '{bracket}'")
+                label = atom.group(1) + ("+" if atom.group(2) and "+" in atom.group(2) else "-" if atom.group(2) else "")
+            else:
+                label = organic
+            index = len(labels)
+            labels.append(label)
+            neighbours.append([])
+            if previous is not None:
+                symbol = _bond_between(bond, labels[previous], label)
+                neighbours[previous].append((index, symbol))
+                neighbours[index].append((previous, symbol))
+            previous = index
+            bond = None
+        elif bond_token:
+            if bond_token == ".":
+                previous = None
+            else:
+                bond = bond_token
+        elif branch == "(":
+            if previous is None:
+                raise SmilesError("Branch without a preceding atom")
+            branches.append(previous)
+        elif branch == ")":
+            if not branches:
+                raise SmilesError("Unbalanced ')'")
+            previous = branches.pop()
+        else:
+            if previous is None:
+                raise SmilesError("Ring closure without a preceding atom")
+            if ring in rings:
+                other, ring_bond = rings.pop(ring)
+                symbol = _bond_between(bond or ring_bond, labels[other], labels[previous])
+                neighbours[other].append((previous, symbol))
+                neighbours[previous].append((other, symbol))
+            else:
+                rings[ring] = (previous, bond)
+            bond = None
+    if pos != len(smiles):
+        raise SmilesError(f"Unexpected '{smiles[pos:]}' in SMILES")
+    if branches or rings:
+        raise SmilesError("Unclosed branch or ring in SMILES")
+    if not labels:
+        raise SmilesError("Empty SMILES")
+    return _normalise_aromaticity(labels, neighbours)
+
+
+def _element(label):
+    element = label.rstrip("+-")
+    return element[0].upper() + element[1:]
+
+
+def _small_rings(neighbours, sizes=(5, 6)):
+    # Every simple cycle of the given sizes, as a tuple of atoms starting
+    # from its lowest atom
+    rings = set()
+    largest = max(sizes)
+    for start in range(len(neighbours)):
+        stack = [(start, (start,))]
+        while stack:
+            atom, path = stack.pop()
+            for neighbour, _ in neighbours[atom]:
+                if neighbour == start and len(path) in sizes and path[1] < path[-1]:
+                    rings.add(path)
+                elif neighbour > start and neighbour not in path and len(path) < largest:
+                    stack.append((neighbour, path + (neighbour,)))
+    return rings
+
+
+def _pi_electrons(atom, labels, neighbours, ring_atoms):
+    # Electrons an atom gives a ring's pi system, or None when it cannot be
+    # part of an aromatic ring: one for a C or N double-bonded within the ring
+    # system, none for a C double-bonded outside it (as in C=O), and a lone
+    # pair for an N, O, S or Se with no double bond
+    element = _element(labels[atom])
+    double = [neighbour for neighbour, bond in neighbours[atom] if bond in ("=", ":")]
+    if element in PI_ELEMENTS and any(neighbour in ring_atoms for neighbour in double):
+        return 1
+    if element == "C" and double:
+        return 0
+    if element in LONE_PAIR_ELEMENTS and not double and not any(bond == "#" for _, bond in neighbours[atom]):
+        return 2
+    return None
+
+
+def _normalise_aromaticity(labels, neighbours):
+    # Kekulé and aromatic SMILES of a molecule must give the same graph, so
+    # aromatic rings are perceived in both: five- and six-membered rings
+    # written with aromatic atoms, or whose atoms all give the pi system
+    # electrons adding up to 4n + 2 (Hückel's rule). Their atoms get
+    # lowercase labels and their bonds ":"; any other bond written or implied
+    # as ":" becomes single.
+    rings = _small_rings(neighbours)
+    ring_atoms = {atom for ring in rings for atom in ring}
+    aromatic_bonds = set()
+    aromatic_atoms = set()
+    for ring in rings:
+        if all(labels[atom][0].islower() for atom in ring):
+            aromatic = True
+        else:
+            electrons = [_pi_electrons(atom, labels, neighbours, ring_atoms) for atom in ring]
+            aromatic = None not in electrons and sum(electrons) % 4 == 2
+        if aromatic:
+            aromatic_atoms.update(ring)
+            aromatic_bonds.update(frozenset((ring[i], ring[i - 1])) for i in range(len(ring)))
+
+    labels = [label.lower() if atom in aromatic_atoms else label for atom, label in enumerate(labels)]
+    neighbours = [
+        [(neighbour, ":" if frozenset((atom, neighbour)) in aromatic_bonds else "-" if bond == ":" else bond)
+         for neighbour, bond in bonds]
+        for atom, bonds in enumerate(neighbours)
+    ]
+    return labels, neighbours
+
+
+def _paths(labels, neighbours, max_length):
+    # Every simple path of up to max_length bonds, as a canonical string that
+    # is the same whichever end the path is read from
+    for start in range(len(labels)):
+        stack = [(start, (start,), (labels[start],))]
+        while stack:
+            atom, visited, tokens = stack.pop()
+            forward = "".join(tokens)
+            backward = "".join(reversed(tokens))
+            yield forward if forward <= backward else backward
+            if len(visited) > max_length:
+                continue
+            for neighbour, bond in neighbours[atom]:
+                if neighbour not in visited:
+                    stack.append((neighbour, visited + (neighbour,), tokens + (bond, labels[neighbour])))
+
+
+def fingerprint_bits(smiles, nbits=FINGERPRINT_BITS, max_length=MAX_PATH_LENGTH):
+    # Hashed path fingerprint (Daylight-style): one bit per distinct linear
+    # path of atoms and bonds, folded into nbits
+    labels, neighbours = parse_smiles(smiles)
+    bits = np.zeros(nbits, dtype=np.uint8)
+    for path in set(_paths(labels, neighbours, max_length)):
+        bits[zlib.crc32(path.encode("ascii", "replace")) % nbits] = 1
+    return bits
+
+
+def fingerprint(smiles, nbits=FINGERPRINT_BITS, max_length=MAX_PATH_LENGTH):
+    # Bit-packed fingerprint as nbits / 64 uint64 words
+    return np.packbits(fingerprint_bits(smiles, nbits, max_length)).view(np.uint64)
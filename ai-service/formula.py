@@ -0,0 +1,279 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+ELECTRON_MASS = 0.000548579909
+
+# symbol: (standard atomic weight, monoisotopic mass of the most abundant isotope).
+# Elements without a standard atomic weight use their longest-lived isotope for both.
+ELEMENTS = {
+    "H": (1.008, 1.00782503207), "He": (4.002602, 4.00260325415), "Li": (6.94, 7.0160034366),
+    "Be": (9.0121831, 9.012183065), "B": (10.81, 11.00930536), "C": (12.011, 12.0),
+    "N": (14.007, 14.00307400443), "O": (15.999, 15.99491461957), "F": (18.998403163, 18.99840316273),
+    "Ne": (20.1797, 19.9924401762), "Na": (22.98976928, 22.989769282), "Mg": (24.305, 23.985041697),
+    "Al": (26.9815385, 26.98153853), "Si": (28.085, 27.97692653465), "P": (30.973761998, 30.97376199842),
+    "S": (32.06, 31.9720711744), "Cl": (35.45, 34.968852682), "Ar": (39.948, 39.9623831237),
+    "K": (39.0983, 38.9637064864), "Ca": (40.078, 39.962590863), "Sc": (44.955908, 44.95590828),
+    "Ti": (47.867, 47.94794198), "V": (50.9415, 50.94395704), "Cr": (51.9961, 51.94050623),
+    "Mn": (54.938044, 54.93804391), "Fe": (55.845, 55.93493633), "Co": (58.933194, 58.93319429),
+    "Ni": (58.6934, 57.93534241), "Cu": (63.546, 62.92959772), "Zn": (65.38, 63.92914201),
+    "Ga": (69.723, 68.9255735), "Ge": (72.630, 73.921177761), "As": (74.921595, 74.92159457),
+    "Se": (78.971, 79.9165218), "Br": (79.904, 78.9183376), "Kr": (83.798, 83.9114977282),
+    "Rb": (85.4678, 84.9117897379), "Sr": (87.62, 87.9056125), "Y": (88.90584, 88.9058403),
+    "Zr": (91.224, 89.9046977), "Nb": (92.90637, 92.906373), "Mo": (95.95, 97.90540482),
+    "Tc": (98.0, 97.9072124), "Ru": (101.07, 101.9043441), "Rh": (102.90550, 102.905498),
+    "Pd": (106.42, 105.9034804), "Ag": (107.8682, 106.9050916), "Cd": (112.414, 113.90336509),
+    "In": (114.818, 114.903878776), "Sn": (118.710, 119.90220163), "Sb": (121.760, 120.903812),
+    "Te": (127.60, 129.906222748), "I": (126.90447, 126.9044719), "Xe": (131.293, 131.9041550856),
+    "Cs": (132.90545196, 132.905451961), "Ba": (137.327, 137.905247), "La": (138.90547, 138.9063563),
+    "Ce": (140.116, 139.9054431), "Pr": (140.90766, 140.9076576), "Nd": (144.242, 141.907729),
+    "Pm": (145.0, 144.9127559), "Sm": (150.36, 151.9197397), "Eu": (151.964, 152.921238),
+    "Gd": (157.25, 157.9241123), "Tb": (158.92535, 158.9253547), "Dy": (162.500, 163.9291819),
+    "Ho": (164.93033, 164.9303288), "Er": (167.259, 165.9302995), "Tm": (168.93422, 168.9342179),
+    "Yb": (173.045, 173.9388664), "Lu": (174.9668, 174.9407752), "Hf": (178.49, 179.946557),
+    "Ta": (180.94788, 180.9479958), "W": (183.84, 183.95093092), "Re": (186.207, 186.9557501),
+    "Os": (190.23, 191.961477), "Ir": (192.217, 192.9629216), "Pt": (195.084, 194.9647917),
+    "Au": (196.966569, 196.96656879), "Hg": (200.592, 201.9706434), "Tl": (204.38, 204.9744278),
+    "Pb": (207.2, 207.9766525), "Bi": (208.98040, 208.9803991), "Po": (209.0, 208.9824308),
+    "At": (210.0, 209.9871479), "Rn": (222.0, 222.0175782), "Fr": (223.0, 223.019736),
+    "Ra": (226.0, 226.0254103), "Ac": (227.0, 227.0277523), "Th": (232.0377, 232.0380558),
+    "Pa": (231.03588, 231.0358842), "U": (238.02891, 238.0507884), "Np": (237.0, 237.0481736),
+    "Pu": (244.0, 244.0642053), "Am": (243.0, 243.0613813), "Cm": (247.0, 247.0703541),
+    "Bk": (247.0, 247.0703073), "Cf": (251.0, 251.0795886), "Es": (252.0, 252.08298),
+    "Fm": (257.0, 257.0951061), "Md": (258.0, 258.0984315), "No": (259.0, 259.10103),
+    "Lr": (266.0, 266.11983), "Rf": (267.0, 267.12179), "Db": (268.0, 268.12567),
+    "Sg": (269.0, 269.12863), "Bh": (270.0, 270.13336), "Hs": (269.0, 269.13375),
+    "Mt": (278.0, 278.15631), "Ds": (281.0, 281.16451), "Rg": (282.0, 282.16912),
+    "Cn": (285.0, 285.17712), "Nh": (286.0, 286.18221), "Fl": (289.0, 289.19042),
+    "Mc": (290.0, 290.19598), "Lv": (293.0, 293.20449), "Ts": (294.0, 294.21046),
+    "Og": (294.0, 294.21392),
+}
+
+# Exact masses of isotopes that appear in labelled formulas, written [13C] or D/T
+ISOTOPES = {
+    "1H": 1.00782503207, "2H": 2.01410177812, "3H": 3.0160492779,
+    "11C": 11.0114336, "12C": 12.0, "13C": 13.00335483507, "14C": 14.0032419884,
+    "13N": 13.00573861, "14N": 14.00307400443, "15N": 15.00010889888,
+    "15O": 15.0030656, "16O": 15.99491461957, "17O": 16.9991317565, "18O": 17.99915961286,
+    "18F": 18.0009380, "19F": 18.99840316273,
+    "31P": 30.97376199842, "32P": 31.97390764, "33P": 32.9717257,
+    "32S": 31.9720711744, "33S": 32.9714589098, "34S": 33.967867004, "35S": 34.96903231,
+    "35Cl": 34.968852682, "36Cl": 35.968306809, "37Cl": 36.965902602,
+    "76Br": 75.924541, "77Br": 76.921379, "79Br": 78.9183376, "81Br": 80.9162897,
+    "123I": 122.905589, "124I": 123.9062099, "125I": 124.9046302, "127I": 126.9044719, "131I": 130.9061246,
+    "64Cu": 63.92976434, "67Ga": 66.9282025, "68Ga": 67.9279805, "82Rb": 81.9182090,
+    "89Zr": 88.9088814, "90Y": 89.9071439, "99Tc": 98.9062508, "111In": 110.9051085,
+    "177Lu": 176.9437615, "201Tl": 200.9708189, "223Ra": 223.0185023,
+}
+ISOTOPE_ALIASES = {"D": "2H", "T": "3H"}
+
+# Mass table indexed by label; isotopes use their exact mass for both kinds
+MASS_LABELS = list(ELEMENTS) + [f"[{iso}]" for iso in ISOTOPES]
+LABEL_INDEX = {label: i for i, label in enumerate(MASS_LABELS)}
+AVERAGE_MASSES = np.array([ELEMENTS[s][0] for s in ELEMENTS] + list(ISOTOPES.values()))
+MONOISOTOPIC_MASSES = np.array([ELEMENTS[s][1] for s in ELEMENTS] + list(ISOTOPES.values()))
+# The same tables as lists of Python floats, for summing one formula
+MASS_LISTS = {"average": AVERAGE_MASSES.tolist(), "monoisotopic": MONOISOTOPIC_MASSES.tolist()}
+
+# One token per match: isotope, element, opening or closing group, each with
+# an optional count; anything else is a syntax error
+TOKEN = re.compile(r"\[(\d+)([A-Z][a-z]?)\](\d*)|([A-Z][a-z]?)(\d*)|([(\[{])|([)\]}])(\d*)")
+HYDRATE_SEPARATOR = re.compile(r"\s*[·•*]\s*")
+DOT_SEPARATOR = re.compile(r"\s*\.\s*(?=\d*\.?\d*[A-Z(\[{])")
+LEADING_MULTIPLIER = re.compile(r"^(\d+(?:\.\d+)?)(?=[A-Z(\[{])")
+CHARGE = re.compile(r"(?:\^(\d*)([+-])|\s+(\d*)([+-])|([+-])(\d+)|([+-]+))$")
+CLOSING = {"(": ")", "[": "]", "{": "}"}
+# Most formulas are plain element counts (C9H8O4). Those are split on their
+# element symbols and skip the general parser; counts are looked up rather
+# than converted, and any other count (leading zeros, over 999) falls back
+ELEMENT_SYMBOL = re.compile(r"([A-Z][a-z]?)")
+SIMPLE_COUNTS = {"": 1, **{str(n): n for n in range(1000)}}
+
+Composition = namedtuple("Composition", ["counts", "charge"])
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def _number(text, default=1):
+    if not text:
+        return default
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _label(symbol, mass_number=None):
+    if mass_number is None:
+        if symbol in ISOTOPE_ALIASES:
+            return f"[{ISOTOPE_ALIASES[symbol]}]"
+        if symbol not in ELEMENTS:
+            raise FormulaError(f"Unknown element '{symbol}'")
+        return symbol
+    isotope = f"{mass_number}{symbol}"
+    if isotope not in ISOTOPES:
+        raise FormulaError(f"Unknown isotope '{isotope}'")
+    return f"[{isotope}]"
+
+
+def _parse_charge(formula):
+    match = CHARGE.search(formula)
+    if not match:
+        return formula, 0
+    caret_n, caret_sign, space_n, space_sign, sign_first, n_after, repeated = match.groups()
+    if repeated:
+        charge = len(repeated) * (1 if repeated[0] == "+" else -1)
+    elif sign_first:
+        charge = int(n_after) * (1 if sign_first == "+" else -1)
+    else:
+        sign = caret_sign or space_sign
+        n = caret_n if caret_sign else space_n
+        charge = int(n or 1) * (1 if sign == "+" else -1)
+    return formula[:match.start()], charge
+
+
+def _components(text):
+    # Split hydrates and adducts into components. "." also separates
+    # components (CuSO4.5H2O) unless it is the decimal point of a leading
+    # multiplier (C17H19NO3*0.5H2O)
+    for component in HYDRATE_SEPARATOR.split(text):
+        pieces = DOT_SEPARATOR.split(component)
+        merged = [pieces[0]]
+        for piece in pieces[1:]:
+            if merged[-1].isdigit():
+                merged[-1] = f"{merged[-1]}.{piece}"
+            else:
+                merged.append(piece)
+        yield from merged
+
+
+def _parse_part(part, formula):
+    # Single pass over the tokens with an explicit stack for nested groups
+    stack = [{}]
+    openers = []
+    pos = 0
+    for match in TOKEN.finditer(part):
+        if match.start() != pos:
+            break
+        pos = match.end()
+        mass_number, iso_symbol, iso_count, symbol, count, opener, closer, group_count = match.groups()
+        if opener:
+            stack.append({})
+            openers.append(opener)
+        elif closer:
+            if not openers or CLOSING[openers.pop()] != closer:
+                raise FormulaError(f"Unbalanced '{closer}' in formula '{formula}'")
+            group = stack.pop()
+            multiplier = _number(group_count)
+            target = stack[-1]
+            for label, n in group.items():
+                target[label] = target.get(label, 0) + n * multiplier
+        else:
+            label = _label(iso_symbol, mass_number) if iso_symbol else _label(symbol)
+            target = stack[-1]
+            target[label] = target.get(label, 0) + _number(iso_count if iso_symbol else count)
+    if pos != len(part):
+        raise FormulaError(f"Unexpected '{part[pos:]}' in formula '{formula}'")
+    if openers:
+        raise FormulaError(f"Unclosed '{openers[-1]}' in formula '{formula}'")
+    return stack[0]
+
+
+def _simple_counts(text):
+    # {label index: count} of a plain formula (C9H8O4), or None for anything
+    # else, including an element written twice, which the general parser sums
+    pieces = ELEMENT_SYMBOL.split(text)
+    if pieces[0] or len(pieces) == 1:
+        return None
+    counts = {}
+    # Symbols and counts alternate after the (empty) text before the first symbol
+    pairs = iter(pieces[1:])
+    for symbol, number in zip(pairs, pairs):
+        index = LABEL_INDEX.get(symbol)
+        n = SIMPLE_COUNTS.get(number)
+        if index is None or n is None or index in counts:
+            return None
+        counts[index] = n
+    return counts
+
+
+@lru_cache(maxsize=65536)
+def parse_formula(formula):
+    # Parse a molecular formula into element counts and a net charge. Supports
+    # nested (), [] and {} groups, hydrates and adducts (CuSO4·5H2O), isotope
+    # labels ([13C], D, T) and trailing charges (^2+, " 2-", +2, ++, -).
+    # A bare "2+" is not read as a charge, since "SO42-" would be ambiguous.
+    text = formula.strip()
+    if not text:
+        raise FormulaError("Empty formula")
+    simple = _simple_counts(text)
+    if simple is not None:
+        return Composition(tuple([(MASS_LABELS[index], simple[index]) for index in sorted(simple)]), 0)
+    text, charge = _parse_charge(text)
+    counts = {}
+    for part in _components(text):
+        multiplier = 1
+        leading = LEADING_MULTIPLIER.match(part)
+        if leading:
+            multiplier = _number(leading.group(1))
+            part = part[leading.end():]
+        if not part:
+            raise FormulaError(f"Empty component in formula '{formula}'")
+        for label, n in _parse_part(part, formula).items():
+            counts[label] = counts.get(label, 0) + n * multiplier
+    return Composition(tuple(sorted(counts.items(), key=lambda item: LABEL_INDEX[item[0]])), charge)
+
+
+def _mass_table(kind):
+    if kind == "average":
+        return AVERAGE_MASSES
+    if kind == "monoisotopic":
+        return MONOISOTOPIC_MASSES
+    raise ValueError("kind must be 'average' or 'monoisotopic'")
+
+
+@lru_cache(maxsize=65536)
+def molecular_mass(formula, kind="average"):
+    masses = MASS_LISTS.get(kind)
+    if masses is None:
+        raise ValueError("kind must be 'average' or 'monoisotopic'")
+    simple = _simple_counts(formula.strip())
+    if simple is not None:
+        # Summed in label order, like a parsed composition, so the float is the same
+        total = 0
+        for index in sorted(simple):
+            total += masses[index] * simple[index]
+        return float(total)
+    composition = parse_formula(formula)
+    total = sum(masses[LABEL_INDEX[label]] * n for label, n in composition.counts)
+    return float(total - composition.charge * ELECTRON_MASS)
+
+
+def bulk_masses(formulas, kind="average"):
+    # Masses for many formulas at once, NaN where a formula does not parse.
+    # Each distinct formula is parsed once (and memoised); the mass sums are
+    # computed for all of them with a single weighted bincount.
+    masses = _mass_table(kind)
+    unique = {}
+    inverse = np.fromiter((unique.setdefault(f, len(unique)) for f in formulas), dtype=np.int64)
+    rows, labels, counts = [], [], []
+    charges = np.zeros(len(unique))
+    valid = np.ones(len(unique), dtype=bool)
+    for row, formula in enumerate(unique):
+        try:
+            composition = parse_formula(formula)
+        except (FormulaError, TypeError, AttributeError):
+            valid[row] = False
+            continue
+        charges[row] = composition.charge
+        for label, n in composition.counts:
+            rows.append(row)
+            labels.append(LABEL_INDEX[label])
+            counts.append(n)
+    weights = np.asarray(counts, dtype=float) * masses[np.asarray(labels, dtype=np.int64)]
+    totals = np.bincount(np.asarray(rows, dtype=np.int64), weights=weights, minlength=len(unique))
+    totals = totals - charges * ELECTRON_MASS
+    totals[~valid] = np.nan
+    return totals[inverse]
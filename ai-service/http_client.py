@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import httpx
+
+from telemetry import UPSTREAM_ERRORS, span
+
+# Per-call timeout (seconds) for upstream services, so one slow endpoint
+# cannot hold up the rest of a fan-out
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+
+_client = None
+
+
+class UpstreamError(Exception):
+    # Raised for a non-200 answer from an upstream service
+    def __init__(self, status_code, url):
+        super().__init__(f"Upstream returned {status_code} for {url}")
+        self.status_code = status_code
+        self.url = url
+
+
+def get_client():
+    # One pooled keep-alive client shared by every request in this process
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+            ),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _send(name, request, timeout):
+    # Time the call as an "upstream.<name>" span and count failures by reason;
+    # a 404 is an answer, not a failure
+    with span(f"upstream.{name}"):
+        try:
+            r = await asyncio.wait_for(request, timeout)
+        except asyncio.TimeoutError:
+            UPSTREAM_ERRORS.inc(call=name, reason="timeout")
+            raise
+        except httpx.HTTPError:
+            UPSTREAM_ERRORS.inc(call=name, reason="transport")
+            raise
+    if r.status_code >= 400 and r.status_code != 404:
+        UPSTREAM_ERRORS.inc(call=name, reason=f"http_{r.status_code}")
+    return r
+
+
+async def _stream(url, headers, timeout, consume):
+    # Hand a 200 response to consume() while its body is still arriving;
+    # whatever consume leaves unread is never downloaded
+    async with get_client().stream("GET", url, timeout=timeout, headers=headers) as r:
+        if r.status_code == 200:
+            await consume(r)
+        return r
+
+
+async def fetch(url, timeout=None, headers=None, name="upstream", consume=None):
+    # httpx applies its timeout per phase (connect/read/...), so wrap the whole
+    # call as well to bound the total time spent on a single upstream call.
+    # With consume (an async callable) the body is streamed to it instead of
+    # being read into the returned response.
+    timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+    if consume is not None:
+        return await _send(name, _stream(url, headers, timeout, consume), timeout)
+    return await _send(name, get_client().get(url, timeout=timeout, headers=headers), timeout)
+
+
+async def post(url, data, timeout=None, name="upstream"):
+    timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+    return await _send(name, get_client().post(url, data=data, timeout=timeout), timeout)
@@ -0,0 +1,406 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import Counter
+
+# Jobs are kept in SQLite, so queued work survives restarts and several
+# server processes can share one queue
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("cache", "jobs.sqlite"))
+# Async workers per server process (each runs one job at a time); at most
+# JOB_BULK_WORKERS of them take bulk jobs, so interactive jobs never wait
+# behind a screening run
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_BULK_WORKERS = int(os.getenv("JOB_BULK_WORKERS", str(max(1, JOB_WORKERS - 1))))
+# Worker processes for CPU-bound scoring; 0 scores in a thread instead
+JOB_PROCESSES = int(os.getenv("JOB_PROCESSES", "0"))
+# Seconds finished jobs and their results are kept
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# A running job whose process has not touched it for this long (the process
+# died) is queued again; a live process touches its jobs several times per
+# timeout even while a chunk is slow
+JOB_STALE_TIMEOUT = float(os.getenv("JOB_STALE_TIMEOUT", "600"))
+JOB_HEARTBEAT_INTERVAL = JOB_STALE_TIMEOUT / 4
+
+# In priority order
+LANES = ("interactive", "bulk")
+FINISHED = ("done", "failed", "cancelled")
+
+JOBS_FINISHED = Counter("ai_service_jobs_finished_total", "Jobs finished, by lane and status", ("lane", "status"))
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    lane TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL NOT NULL,
+    finished_at REAL,
+    expires_at REAL,
+    claim TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, lane, created_at);
+CREATE INDEX IF NOT EXISTS jobs_expiry ON jobs (expires_at);
+"""
+_COLUMNS = "id, lane, status, error, total, done, failed, created_at, started_at, finished_at, expires_at"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    # SQLite job table. The connection is opened lazily on first use; every
+    # method is blocking and is called through asyncio.to_thread.
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode, so claims can take an immediate write lock
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row(row):
+        job = dict(zip(_COLUMNS.split(", "), row))
+        job["job_id"] = job.pop("id")
+        return job
+
+    def submit(self, payload, total, lane):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO jobs (id, lane, status, payload, total, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, lane, json.dumps(payload), total, now, now))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (job_id, time.time())).fetchone()
+        return self._row(row) if row is not None else None
+
+    def result(self, job_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = 'done' AND expires_at > ?", (job_id, time.time())).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def claim(self, lanes):
+        # Atomically move the oldest queued job of the highest-priority lane
+        # to running; returns (job, payload, claim) or None. The claim token
+        # must be passed to progress and finish, so a run whose job was
+        # queued again as stale and claimed by another worker cannot write
+        # to it any more.
+        now = time.time()
+        token = uuid.uuid4().hex
+        placeholders = ",".join("?" * len(lanes))
+        order = " ".join(f"WHEN '{lane}' THEN {rank}" for rank, lane in enumerate(LANES))
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("UPDATE jobs SET status = 'queued', claim = NULL WHERE status = 'running' AND updated_at < ?",
+                             (now - JOB_STALE_TIMEOUT,))
+                row = conn.execute(
+                    f"SELECT id, payload FROM jobs WHERE status = 'queued' AND lane IN ({placeholders}) "
+                    f"ORDER BY CASE lane {order} END, created_at LIMIT 1", lanes).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = 'running', claim = ?, done = 0, failed = 0, started_at = ?, updated_at = ? "
+                                 "WHERE id = ?", (token, now, now, row[0]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return self.get(row[0]), json.loads(row[1]), token
+
+    def progress(self, job_id, claim, done, failed):
+        # False once this claim no longer runs the job: it was cancelled, or
+        # queued again and claimed by another worker
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET done = ?, failed = ?, updated_at = ? WHERE id = ? AND claim = ? AND status = 'running'",
+                (done, failed, time.time(), job_id, claim))
+        return cursor.rowcount > 0
+
+    def finish(self, job_id, claim, status, result=None, error=None):
+        # False, and the result is dropped, when this claim no longer runs the job
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, finished_at = ?, expires_at = ? "
+                "WHERE id = ? AND claim = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, now, now, now + JOB_RESULT_TTL, job_id, claim))
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id):
+        # Queued jobs are never started; running ones stop at their next
+        # progress update
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ?, finished_at = ?, expires_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (now, now, now + JOB_RESULT_TTL, job_id))
+        return cursor.rowcount > 0
+
+    def counts(self):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT lane, status, COUNT(*) FROM jobs WHERE expires_at IS NULL OR expires_at > ? GROUP BY lane, status",
+                (time.time(),)).fetchall()
+        counts = {lane: {} for lane in LANES}
+        for lane, status, count in rows:
+            counts.setdefault(lane, {})[status] = count
+        return counts
+
+    def purge(self):
+        with self._lock:
+            cursor = self._connect().execute("DELETE FROM jobs WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobProgress:
+    # Counts finished items; the store is written at most every
+    # JOB_POLL_INTERVAL seconds rather than once per item
+    def __init__(self, store, job_id, claim):
+        self.store = store
+        self.job_id = job_id
+        self.claim = claim
+        self.done = 0
+        self.failed = 0
+        self._written = 0.0
+
+    def advance(self, ok=True):
+        self.done += 1
+        self.failed += not ok
+
+    async def update(self, force=False):
+        if not force and time.monotonic() - self._written < JOB_POLL_INTERVAL:
+            return
+        self._written = time.monotonic()
+        if not await asyncio.to_thread(self.store.progress, self.job_id, self.claim, self.done, self.failed):
+            raise JobCancelled(self.job_id)
+
+    async def heartbeat(self):
+        # Touches the job while the handler runs, so a slow chunk does not
+        # make a live job look stale
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            if not await asyncio.to_thread(self.store.progress, self.job_id, self.claim, self.done, self.failed):
+                return
+
+
+class JobQueue:
+    # Runs queued jobs with `workers` async workers. handler(payload,
+    # progress) is an async callable returning the JSON-serialisable result.
+    def __init__(self, handler, store=None, workers=JOB_WORKERS, bulk_workers=JOB_BULK_WORKERS):
+        self.handler = handler
+        self.store = store if store is not None else JobStore()
+        self.workers = workers
+        self.bulk_workers = bulk_workers
+        self._bulk_running = 0
+        self._tasks = []
+        self._wakeup = None
+        self._purged = 0.0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Interrupted jobs stay "running" and are picked up again once stale
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+
+    async def submit(self, payload, total, lane):
+        job_id = await asyncio.to_thread(self.store.submit, payload, total, lane)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def result(self, job_id):
+        return await asyncio.to_thread(self.store.result, job_id)
+
+    async def cancel(self, job_id):
+        return await asyncio.to_thread(self.store.cancel, job_id)
+
+    async def counts(self):
+        return await asyncio.to_thread(self.store.counts)
+
+    async def _work(self):
+        while True:
+            try:
+                await self._work_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker error")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def _work_once(self):
+        # A bulk slot is reserved before claiming, so concurrent claims by
+        # several workers cannot exceed bulk_workers
+        bulk = self._bulk_running < self.bulk_workers
+        self._bulk_running += bulk
+        try:
+            claimed = await asyncio.to_thread(self.store.claim, LANES if bulk else LANES[:1])
+        except BaseException:
+            self._bulk_running -= bulk
+            raise
+        if claimed is None or claimed[0]["lane"] == LANES[0]:
+            self._bulk_running -= bulk
+            bulk = False
+        if claimed is None:
+            if time.monotonic() - self._purged > 60:
+                self._purged = time.monotonic()
+                await asyncio.to_thread(self.store.purge)
+            # Jobs submitted by other processes are found by polling
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            return
+        job, payload, claim = claimed
+        try:
+            await self._run(job, payload, claim)
+        finally:
+            self._bulk_running -= bulk
+            if bulk:
+                self._wakeup.set()
+
+    async def _run(self, job, payload, claim):
+        job_id = job["job_id"]
+        progress = JobProgress(self.store, job_id, claim)
+        heartbeat = asyncio.ensure_future(progress.heartbeat())
+        started = time.monotonic()
+        try:
+            result = await self.handler(payload, progress)
+            await progress.update(force=True)
+        except JobCancelled:
+            finished = False
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            finished = await asyncio.to_thread(self.store.finish, job_id, claim, "failed", None, str(e))
+            status = "failed"
+        else:
+            finished = await asyncio.to_thread(self.store.finish, job_id, claim, "done", result)
+            status = "done"
+        finally:
+            heartbeat.cancel()
+        if not finished:
+            # Cancelled, or queued again as stale and run by another worker,
+            # whose result stands
+            current = await asyncio.to_thread(self.store.get, job_id)
+            status = "cancelled" if current is None or current["status"] == "cancelled" else "superseded"
+        JOBS_FINISHED.inc(lane=job["lane"], status=status)
+        logger.info("Job %s %s: %d items in %.2fs", job_id, status, progress.done, time.monotonic() - started)
+
+
+async def job_events(queue, job_id):
+    # Server-Sent Events with the job's state whenever its progress changes,
+    # ending with an "end" event once it has finished
+    last = None
+    while True:
+        job = await queue.get(job_id)
+        if job is None:
+            yield f"event: end\ndata: {json.dumps({'job_id': job_id, 'status': 'expired'})}\n\n"
+            return
+        state = (job["status"], job["done"], job["failed"])
+        if state != last:
+            last = state
+            yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+        if job["status"] in FINISHED:
+            yield f"event: end\ndata: {json.dumps(job)}\n\n"
+            return
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+_pool = None
+
+
+def _score_in_process(data):
+    # Runs in a pool process, which loads its own copy of the scoring model
+    from models import get_scoring_model
+    from scoring import score_batch
+
+    return score_batch(data, get_scoring_model())
+
+
+def get_process_pool():
+    global _pool
+    if _pool is None and JOB_PROCESSES > 0:
+        # spawn rather than fork: the server process runs threads (logging,
+        # SQLite, to_thread) that a forked child would inherit mid-operation
+        _pool = ProcessPoolExecutor(JOB_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def close_process_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def score_in_pool(data, model=None):
+    # Score property dicts off the event loop: in a worker process when
+    # JOB_PROCESSES is set, otherwise in a thread
+    if not data:
+        return []
+    pool = get_process_pool()
+    if pool is not None:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, _score_in_process, data)
+        except BrokenProcessPool:
+            # A pool process died; start a fresh pool for the next call
+            logger.warning("Scoring process pool broke, scoring in a thread")
+            close_process_pool()
+    from scoring import score_batch
+
+    return await asyncio.to_thread(score_batch, data, model)
@@ -1,10 +1,87 @@
-import requests
-from fastapi import FastAPI, HTTPException, Request
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-import urllib.parse
 
-app = FastAPI()
+from cache import genome_report_cache, pubchem_cache
+from http_client import close_client, get_client
+from receptor_store import RECEPTOR_PREFETCH, get_receptor_info, prefetch_receptors, rcsb_policy
+from pubchem import (fetch_compound_data, fetch_pubchem_properties, fetch_pubchem_synonym, get_genome_report, has_complete_genome_report,
+                     prefetch_properties, pubchem_policy)
+from result_store import DRUG_LIKENESS_CLASSES, RESULT_STORE_LOOKUPS, SORT_COLUMNS, TOXICITY_CLASSES, get_result_store
+from telemetry import MetricsMiddleware, log_payload, render_metrics, setup_logging, shutdown_logging
+from jobs import FINISHED, JobQueue, close_process_pool, job_events, score_in_pool
+from predictions import build_prediction
+from streaming import encode_ndjson, encode_sse, iter_records, iter_spool, spool_body, stream_predictions
+# The numpy-backed modules (scoring, models, similarity, formula and the
+# local property store) are imported where they are first used, so the
+# server starts answering before they have loaded; see warm_up()
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "10000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+STREAM_MAX_IN_FLIGHT = int(os.getenv("STREAM_MAX_IN_FLIGHT", "16"))
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(256 * 1024 * 1024)))
+# Records a job fetches before scoring them together
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "100"))
+
+setup_logging()
+logger = logging.getLogger("main")
+
+# Genome reports being built in the background for deferred predictions
+_genome_report_tasks = set()
+# warm_up running in a thread, started by the lifespan
+_warm_task = None
+
+def warm_up():
+    # Import the numpy-backed modules and load the local property store,
+    # scoring model and similarity index. Run in a thread at startup; a
+    # request that needs one of them first waits for it instead.
+    import formula
+    from models import get_scoring_model
+    from property_store import get_local_store
+    from similarity import get_similarity_index
+
+    get_local_store()
+    get_scoring_model()
+    get_similarity_index()
+
+async def warmed():
+    # Handlers that use the numpy-backed modules await this first. While
+    # warm_up runs, importing one of them or calling a getter would wait on
+    # the import lock or the getter's lock on the event loop, stalling every
+    # other request; awaiting the thread only holds up this one.
+    if _warm_task is not None and not _warm_task.done():
+        await asyncio.wait({_warm_task})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared upstream connection pool once and close it on shutdown
+    global _warm_task
+    get_client()
+    _warm_task = asyncio.ensure_future(asyncio.to_thread(warm_up))
+    # Warm the receptor store for the configured target panel in the background
+    prefetch_task = asyncio.create_task(prefetch_receptors(RECEPTOR_PREFETCH)) if RECEPTOR_PREFETCH else None
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    close_process_pool()
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    for task in list(_genome_report_tasks):
+        task.cancel()
+    _warm_task.cancel()
+    await close_client()
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -28,262 +105,54 @@ class DrugInput(BaseModel):
             return str(v)
         raise ValueError("CID must be a string or integer")
 
+class BatchInput(BaseModel):
+    cids: List[str] = Field(default_factory=list, description="PubChem CIDs to predict")
+    compounds: List[DrugInput] = Field(default_factory=list, description="SMILES/CID pairs to predict")
+
 class UnknownDrugInput(BaseModel):
     chemical_formula: str = Field(..., description="Chemical formula of the unknown drug")
     receptor_pdb_id: str = Field(..., description="PDB ID of the target receptor")
+    smiles: Optional[str] = Field(None, description="SMILES string, used to find structurally similar known compounds")
 
-def fetch_pubchem_properties(cid: str):
-    # First try to get basic properties
-    basic_props_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/property/MolecularWeight,XLogP,HBondDonorCount,HBondAcceptorCount,RotatableBondCount,MolecularFormula,IUPACName,InChIKey/JSON"
-    r = requests.get(basic_props_url)
-    if r.status_code != 200:
-        raise HTTPException(status_code=404, detail="PubChem properties not found")
-    
-    props = r.json()["PropertyTable"]["Properties"][0]
-    
-    # Try to get additional properties from PubChem
-    try:
-        desc_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/description/JSON"
-        desc_r = requests.get(desc_url)
-        if desc_r.status_code == 200:
-            desc_data = desc_r.json().get("InformationList", {}).get("Information", [{}])[0]
-            props["Description"] = desc_data.get("Description", [""])[0]
-    except Exception as e:
-        print(f"Error fetching description: {e}")
-        
-    # Try to get computed properties
-    try:
-        computed_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/property/Volume3D,Complexity/JSON"
-        comp_r = requests.get(computed_url)
-        if comp_r.status_code == 200:
-            comp_props = comp_r.json()["PropertyTable"]["Properties"][0]
-            props.update(comp_props)
-    except Exception as e:
-        print(f"Error fetching computed properties: {e}")
-    
-    print('PubChem properties:', props)  # LOGGING
-    return props
+class JobInput(BaseModel):
+    cids: List[str] = Field(default_factory=list, description="PubChem CIDs to predict")
+    compounds: List[DrugInput] = Field(default_factory=list, description="SMILES/CID pairs to predict")
+    unknown_compounds: List[UnknownDrugInput] = Field(default_factory=list, description="Unknown compounds to analyse")
+    priority: Literal["interactive", "bulk"] = Field("interactive", description="interactive jobs are run before bulk screening jobs")
 
-def safe_get(props, key, default="N/A"):
-    try:
-        value = props.get(key)
-        # Convert empty strings, None, or "N/A" to default
-        if value in [None, "", "N/A"]:
-            return default
-        # Try to convert numerical strings to float
-        if isinstance(value, str) and any(c.isdigit() for c in value):
-            try:
-                return float(value)
-            except ValueError:
-                pass
-        return value
-    except Exception as e:
-        print(f"Error getting property {key}: {e}")
-        return default
-
-def fetch_pubchem_synonym(cid: str):
-    url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/synonyms/JSON"
-    r = requests.get(url)
-    if r.status_code != 200:
-        return "No description available"
-    synonyms = r.json().get("InformationList", {}).get("Information", [{}])[0].get("Synonym", [])
-    return synonyms[0] if synonyms else "No description available"
-
-def predict_binding_affinity(props):
-    try:
-        # Get properties with fallback values
-        mw = float(safe_get(props, "MolecularWeight", 0))
-        logp = float(safe_get(props, "XLogP", 0))
-        hba = int(safe_get(props, "HBondAcceptorCount", 0))
-        hbd = int(safe_get(props, "HBondDonorCount", 0))
-        complexity = float(safe_get(props, "Complexity", 0))
-        
-        # Calculate score even if some properties are missing
-        mw_score = min(mw / 1000, 1) if mw else 0
-        logp_score = min(abs(logp) / 5, 1) if logp else 0
-        hba_score = min(hba / 10, 1) if hba else 0
-        hbd_score = min(hbd / 5, 1) if hbd else 0
-        complexity_score = min(complexity / 1000, 1) if complexity else 0
-        
-        # Weight the scores, giving more weight to available properties
-        total_weight = sum(bool(x) for x in [mw_score, logp_score, hba_score, hbd_score, complexity_score])
-        if total_weight == 0:
-            return "N/A"
-            
-        score = ((mw_score + logp_score + hba_score + hbd_score + complexity_score) / total_weight) * 100
-        return f"{score:.2f}%"
-    except Exception as e:
-        print('Binding affinity error:', e)
-        return {"score": None, "display": "N/A"}
+class SimilarityInput(BaseModel):
+    smiles: str = Field(..., description="SMILES string of the query molecule")
+    k: int = Field(10, ge=1, le=1000, description="Number of neighbours to return")
+    threshold: float = Field(0.0, ge=0.0, le=1.0, description="Minimum Tanimoto similarity")
 
-def predict_toxicity(props):
-    try:
-        # Get properties with fallback values
-        mw = float(safe_get(props, "MolecularWeight", 0))
-        logp = float(safe_get(props, "XLogP", 0))
-        rotatable_bonds = int(safe_get(props, "RotatableBondCount", 0))
-        complexity = float(safe_get(props, "Complexity", 0))
-        
-        # Calculate score even if some properties are missing
-        mw_score = min(mw / 1000, 1) if mw else 0
-        logp_score = min(abs(logp) / 5, 1) if logp else 0
-        rot_score = min(rotatable_bonds / 10, 1) if rotatable_bonds else 0
-        complexity_score = min(complexity / 1000, 1) if complexity else 0
-        
-        # Weight the scores, giving more weight to available properties
-        total_weight = sum(bool(x) for x in [mw_score, logp_score, rot_score, complexity_score])
-        if total_weight == 0:
-            return "N/A"
-            
-        toxicity_score = ((logp_score * 0.4 + rot_score * 0.3 + mw_score * 0.2 + complexity_score * 0.1) / total_weight) * 100
-        
-        if toxicity_score < 30:
-            return "Low"
-        elif toxicity_score < 70:
-            return "Medium"
-        else:
-            return "High"
-    except Exception as e:
-        print('Toxicity error:', e)
-        return {"score": None, "display": "N/A"}
+class PropertyRange(BaseModel):
+    min: Optional[float] = Field(None, description="Inclusive lower bound")
+    max: Optional[float] = Field(None, description="Inclusive upper bound")
 
-def calculate_drug_likeness(props):
-    try:
-        # Get properties with fallback values
-        mw = float(safe_get(props, "MolecularWeight", 0))
-        logp = float(safe_get(props, "XLogP", 0))
-        hba = int(safe_get(props, "HBondAcceptorCount", 0))
-        hbd = int(safe_get(props, "HBondDonorCount", 0))
-        rotatable_bonds = int(safe_get(props, "RotatableBondCount", 0))
-        
-        # Calculate Lipinski's Rule of 5 and additional criteria
-        rules_passed = 0
-        total_rules = 0
-        
-        if mw:
-            total_rules += 1
-            if mw <= 500: rules_passed += 1
-            
-        if logp is not None:
-            total_rules += 1
-            if -0.4 <= logp <= 5.6: rules_passed += 1
-            
-        if hba is not None:
-            total_rules += 1
-            if hba <= 10: rules_passed += 1
-            
-        if hbd is not None:
-            total_rules += 1
-            if hbd <= 5: rules_passed += 1
-            
-        if rotatable_bonds is not None:
-            total_rules += 1
-            if rotatable_bonds <= 10: rules_passed += 1
-            
-        if total_rules == 0:
-            return "N/A"
-            
-        likeness_score = (rules_passed / total_rules) * 100
-        
-        if likeness_score >= 80:
-            return "Excellent"
-        elif likeness_score >= 60:
-            return "Good"
-        elif likeness_score >= 40:
-            return "Moderate"
-        else:
-            return "Poor"
-    except Exception as e:
-        print('Drug-likeness error:', e)
-        return {"score": None, "display": "N/A"}
-
-def get_genome_report(cid: str):
-    try:
-        # Fetch bioassay data from PubChem
-        bioassay_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/assaysummary/JSON"
-        bioassay_response = requests.get(bioassay_url)
-        
-        if bioassay_response.status_code != 200:
-            return "No genomic data available for this compound"
-            
-        bioassay_data = bioassay_response.json()
-        
-        # Fetch protein targets
-        target_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/protein_targets/JSON"
-        target_response = requests.get(target_url)
-        
-        report_sections = []
-        
-        # Process bioassay data
-        if 'AssaySummaries' in bioassay_data:
-            assays = bioassay_data['AssaySummaries']['AssaySummary']
-            genetic_assays = [a for a in assays if 'gene' in a.get('TargetName', '').lower() 
-                            or 'dna' in a.get('TargetName', '').lower()
-                            or 'protein' in a.get('TargetName', '').lower()]
-            
-            if genetic_assays:
-                report_sections.append("Genetic Interaction Summary:")
-                for assay in genetic_assays[:3]:  # Show top 3 most relevant
-                    report_sections.append(f"- {assay.get('TargetName')}: {assay.get('BioActivitySummary', 'No activity data')}")
-        
-        # Process protein targets
-        if target_response.status_code == 200:
-            target_data = target_response.json()
-            if 'ProteinTargets' in target_data:
-                targets = target_data['ProteinTargets']
-                report_sections.append("\nProtein Interactions:")
-                for target in targets[:3]:  # Show top 3 targets
-                    report_sections.append(f"- {target.get('ProteinName')}: {target.get('InteractionType', 'Unknown interaction')}")
-        
-        # Add genetic pathway analysis
-        pathway_url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/pathway/JSON"
-        pathway_response = requests.get(pathway_url)
-        
-        if pathway_response.status_code == 200:
-            pathway_data = pathway_response.json()
-            if 'Pathways' in pathway_data:
-                report_sections.append("\nGenetic Pathways:")
-                pathways = pathway_data['Pathways'][:3]  # Show top 3 pathways
-                for pathway in pathways:
-                    report_sections.append(f"- {pathway.get('PathwayName')}")
-        
-        # Compile final report
-        if report_sections:
-            return "\n".join(report_sections)
-        else:
-            return "significant genetic interactions found. This compound have direct genomic effects."
-            
-    except Exception as e:
-        print(f"Error generating genome report: {e}")
-        return "Unable to generate genomic analysis. Please try again later."
-
-def get_molecule_image_url(cid: str):
-    return f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/PNG"
-
-def get_3d_structure_url(cid: str):
-    return f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/record/SDF/?record_type=3d"
-
-def get_genome_image_url(cid: str):
-    return f"https://pubchem.ncbi.nlm.nih.gov/image/imgsrv.fcgi?cid={cid}&t=l"
-
-def get_pubchem_url(cid: str):
-    return f"https://pubchem.ncbi.nlm.nih.gov/compound/{cid}"
-
-def get_chembl_url(inchikey: str):
-    return f"https://www.ebi.ac.uk/chembl/compound_report_card/{inchikey}/"
-
-def get_drugbank_url(name: str):
-    # DrugBank URLs are not always predictable, but we can provide a search link
-    return f"https://go.drugbank.com/unearth/q?search={urllib.parse.quote(name)}&searcher=drugs"
-
-def get_qr_code_url(url: str):
-    # Use Google Chart API for QR code
-    return f"https://chart.googleapis.com/chart?cht=qr&chs=200x200&chl={urllib.parse.quote(url)}"
+class CompoundQueryInput(BaseModel):
+    ranges: Dict[str, PropertyRange] = Field(default_factory=dict, description="Property ranges keyed by PubChem property name, e.g. {\"MolecularWeight\": {\"max\": 500}}")
+    drug_like: bool = Field(False, description="Also apply the drug-likeness rules (Lipinski's Rule of 5 and at most 10 rotatable bonds)")
+    limit: Optional[int] = Field(None, ge=1, le=10000, description="Compounds per page (default 100); a stream returns all matches unless set")
+    cursor: Optional[str] = Field(None, description="next_cursor of the previous page")
+    count: bool = Field(False, description="Also count every match (a scan when the ranges are not selective)")
 
 @app.get("/")
 async def root():
     return {"message": "AI Service is running"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "pubchem": pubchem_cache.stats(),
+        "genome_report": genome_report_cache.stats(),
+        "circuits": {policy.name: policy.breaker.state for policy in (pubchem_policy, rcsb_policy)},
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/analysis")
 async def analyze_drug(request: Request):
     try:
@@ -299,187 +168,392 @@ async def analyze_drug(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def start_genome_report(cid: str):
+    # Build the report in the background; /genome-report/{cid} joins the
+    # same in-flight build through the report cache
+    task = asyncio.ensure_future(get_genome_report(cid))
+    _genome_report_tasks.add(task)
+    task.add_done_callback(_genome_report_tasks.discard)
+
+async def predict_compound(cid: str, defer_genome_report: bool = False):
+    await warmed()
+    from models import get_scoring_model, model_version
+    from scoring import PropertyRecord, score_record
+
+    # Responses are deterministic for a CID and scoring model, so a stored
+    # one is served as is
+    model = get_scoring_model()
+    store = get_result_store()
+    if store is not None:
+        stored = await asyncio.to_thread(store.get, cid, model_version(model))
+        RESULT_STORE_LOOKUPS.inc(result="hit" if stored is not None else "miss")
+        if stored is not None:
+            return stored
+
+    props, description, genome_report = await fetch_compound_data(cid, genome_report=not defer_genome_report)
+    log_payload(logger, "Fetched properties", {"cid": cid, "properties": props, "description": description})
+    if defer_genome_report:
+        start_genome_report(cid)
+    
+    # The properties are parsed once, for scoring and for the response
+    record = PropertyRecord(props)
+    scores = score_record(record, model)
+    response_data = build_prediction(cid, record, description, genome_report, scores, model)
+    log_payload(logger, "Returning response", response_data)
+    # Only complete responses are stored, not ones with a deferred or failed genome report
+    if store is not None and genome_report is not None and has_complete_genome_report(cid):
+        await asyncio.to_thread(store.put, cid, model_version(model), response_data)
+    return response_data
+
 @app.post("/predict")
-async def predict_properties(drug_input: DrugInput):
+async def predict_properties(drug_input: DrugInput, defer_genome_report: bool = False):
+    # With defer_genome_report the core properties and scores are returned
+    # without waiting for the genome report, which is then served by
+    # /genome-report/{cid} (genome_report_url in the response)
     try:
-        print(f"\nProcessing prediction request for CID: {drug_input.cid}")
-        props = fetch_pubchem_properties(drug_input.cid)
-        print(f"Fetched properties: {props}")
-        
-        description = fetch_pubchem_synonym(drug_input.cid)
-        print(f"Fetched description: {description}")
-        
-        binding_affinity = predict_binding_affinity(props)
-        print(f"Calculated binding affinity: {binding_affinity}")
-        
-        toxicity = predict_toxicity(props)
-        print(f"Calculated toxicity: {toxicity}")
-        
-        drug_likeness = calculate_drug_likeness(props)
-        print(f"Calculated drug-likeness: {drug_likeness}")
-        
-        genome_report = get_genome_report(drug_input.cid)
-        
-        # Calculate effectiveness using the same resilient approach
-        try:
-            mw = float(safe_get(props, "MolecularWeight", 0))
-            logp = float(safe_get(props, "XLogP", 0))
-            hba = int(safe_get(props, "HBondAcceptorCount", 0))
-            hbd = int(safe_get(props, "HBondDonorCount", 0))
-            complexity = float(safe_get(props, "Complexity", 0))
-            
-            # Calculate scores even if some properties are missing
-            mw_score = min(mw / 1000, 1) if mw else 0
-            logp_score = min(abs(logp) / 5, 1) if logp else 0
-            hba_score = min(hba / 10, 1) if hba else 0
-            hbd_score = min(hbd / 5, 1) if hbd else 0
-            complexity_score = min(complexity / 1000, 1) if complexity else 0
-            
-            # Weight the scores based on available properties
-            weights = {
-                'mw': 0.25 if mw_score else 0,
-                'logp': 0.25 if logp_score else 0,
-                'hba': 0.2 if hba_score else 0,
-                'hbd': 0.2 if hbd_score else 0,
-                'complexity': 0.1 if complexity_score else 0
-            }
-            
-            total_weight = sum(weights.values())
-            if total_weight == 0:
-                effectiveness = None
-            else:
-                # Normalize weights
-                weights = {k: v/total_weight for k, v in weights.items()}
-                effectiveness = (
-                    mw_score * weights['mw'] +
-                    logp_score * weights['logp'] +
-                    hba_score * weights['hba'] +
-                    hbd_score * weights['hbd'] +
-                    complexity_score * weights['complexity']
-                ) * 100
-                
-            print(f"Calculated effectiveness: {effectiveness}")
-        except Exception as e:
-            print('Effectiveness calculation error:', e)
-            effectiveness = None
-            
-        molecule_image_url = get_molecule_image_url(drug_input.cid)
-        structure3d_url = get_3d_structure_url(drug_input.cid)
-        genome_image_url = get_genome_image_url(drug_input.cid)
-        pubchem_url = get_pubchem_url(drug_input.cid)
-        chembl_url = get_chembl_url(safe_get(props, "InChIKey", ""))
-        drugbank_url = get_drugbank_url(safe_get(props, "IUPACName", ""))
-        qr_code_url = get_qr_code_url(pubchem_url)
-        
-        response_data = {
-            "binding_affinity": binding_affinity,
-            "toxicity": toxicity,
-            "drug_likeness": drug_likeness,
-            "effectiveness": effectiveness,
-            "genome_report": genome_report,
-            "molecular_weight": safe_get(props, "MolecularWeight"),
-            "molecular_formula": safe_get(props, "MolecularFormula"),
-            "iupac_name": safe_get(props, "IUPACName"),
-            "h_bond_donor_count": safe_get(props, "HBondDonorCount"),
-            "h_bond_acceptor_count": safe_get(props, "HBondAcceptorCount"),
-            "rotatable_bond_count": safe_get(props, "RotatableBondCount"),
-            "xlogp": safe_get(props, "XLogP"),
-            "description": description,
-            "molecule_image_url": molecule_image_url,
-            "structure3d_url": structure3d_url,
-            "genome_image_url": genome_image_url,
-            "pubchem_url": pubchem_url,
-            "chembl_url": chembl_url,
-            "drugbank_url": drugbank_url,
-            "qr_code_url": qr_code_url
-        }
-        
-        print(f"Returning response: {response_data}")
-        return response_data
+        return await predict_compound(drug_input.cid, defer_genome_report)
+    except HTTPException:
+        raise
     except Exception as e:
-        print('API error:', e)
+        logger.exception("Prediction failed for CID %s", drug_input.cid)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/predict/batch")
+async def predict_batch(batch_input: BatchInput, defer_genome_report: bool = False):
+    await warmed()
+    from models import get_scoring_model
+    from scoring import PropertyRecord, score_batch
+
+    cids = [str(cid) for cid in batch_input.cids] + [compound.cid for compound in batch_input.compounds]
+    if not cids:
+        raise HTTPException(status_code=400, detail="No CIDs provided")
+    if len(cids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_SIZE} compounds")
+
+    logger.info("Processing batch prediction request for %d CIDs", len(cids))
+    await prefetch_properties(cids)
+
+    # Descriptions, synonyms and genome data are still per-CID lookups, so run
+    # them with bounded concurrency; one failing compound never fails the batch
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch_item(cid):
+        async with semaphore:
+            try:
+                props, description, genome_report = await fetch_compound_data(cid, genome_report=not defer_genome_report)
+                data = PropertyRecord(props), description, genome_report
+            except HTTPException as e:
+                return None, e.detail
+            except Exception as e:
+                logger.warning("Batch item error for CID %s: %s", cid, e)
+                return None, str(e)
+        if defer_genome_report:
+            start_genome_report(cid)
+        return data, None
+
+    fetched = await asyncio.gather(*(fetch_item(cid) for cid in cids))
+
+    # Every fetched compound is scored in one vectorised pass
+    model = get_scoring_model()
+    scored = iter(score_batch([data[0] for data, error in fetched if error is None], model))
+    results = []
+    for cid, (data, error) in zip(cids, fetched):
+        if error is not None:
+            results.append({"cid": cid, "result": None, "error": error})
+            continue
+        record, description, genome_report = data
+        result = build_prediction(cid, record, description, genome_report, next(scored), model)
+        results.append({"cid": cid, "result": result, "error": None})
+    failed = sum(1 for item in results if item["error"] is not None)
+    return {"count": len(results), "failed": failed, "results": results}
+
+async def predict_unknown_compound(drug_input: UnknownDrugInput):
+    await warmed()
+    logger.info("Processing prediction request for unknown drug with formula %s", drug_input.chemical_formula)
+    
+    # Calculate molecular weight from chemical formula
+    mw = calculate_molecular_weight(drug_input.chemical_formula)
+    
+    # Nearest known compounds by fingerprint similarity, when a SMILES is
+    # given; an invalid one is rejected before anything is fetched
+    similar_compounds = await find_similar_compounds(drug_input.smiles) if drug_input.smiles else None
+    
+    # Fetch receptor information from PDB
+    receptor_info = await fetch_receptor_info(drug_input.receptor_pdb_id)
+    
+    # Use Perplexity for predictions
+    perplexity_response = await analyze_with_perplexity(drug_input.chemical_formula, drug_input.receptor_pdb_id, mw)
+    
+    # Process and validate the response
+    binding_affinity = perplexity_response.get('binding_affinity', 'N/A')
+    toxicity = perplexity_response.get('toxicity', 'N/A')
+    drug_likeness = perplexity_response.get('drug_likeness', 'N/A')
+    effectiveness = perplexity_response.get('effectiveness')
+    
+    # Generate genome report
+    genome_report = generate_genome_report(perplexity_response, similar_compounds)
+    
+    response_data = {
+        "binding_affinity": binding_affinity,
+        "toxicity": toxicity,
+        "drug_likeness": drug_likeness,
+        "effectiveness": effectiveness,
+        "genome_report": genome_report,
+        "molecular_weight": str(mw) if mw else "N/A",
+        "description": f"Analysis of unknown compound with formula {drug_input.chemical_formula} targeting receptor {drug_input.receptor_pdb_id}",
+        "xlogp": perplexity_response.get('xlogp', 'N/A'),
+        "similar_compounds": similar_compounds
+    }
+    
+    log_payload(logger, "Returning response", response_data)
+    return response_data
+
 @app.post("/predict-unknown")
 async def predict_unknown_properties(drug_input: UnknownDrugInput):
     try:
-        print(f"\nProcessing prediction request for unknown drug with formula: {drug_input.chemical_formula}")
-        
-        # Calculate molecular weight from chemical formula
-        mw = calculate_molecular_weight(drug_input.chemical_formula)
-        
-        # Fetch receptor information from PDB
-        receptor_info = fetch_receptor_info(drug_input.receptor_pdb_id)
-        
-        # Use Perplexity for predictions
-        perplexity_response = await analyze_with_perplexity(drug_input.chemical_formula, drug_input.receptor_pdb_id)
-        
-        # Process and validate the response
-        binding_affinity = perplexity_response.get('binding_affinity', 'N/A')
-        toxicity = perplexity_response.get('toxicity', 'N/A')
-        drug_likeness = perplexity_response.get('drug_likeness', 'N/A')
-        effectiveness = perplexity_response.get('effectiveness')
-        
-        # Generate genome report
-        genome_report = generate_genome_report(perplexity_response)
-        
-        response_data = {
-            "binding_affinity": binding_affinity,
-            "toxicity": toxicity,
-            "drug_likeness": drug_likeness,
-            "effectiveness": effectiveness,
-            "genome_report": genome_report,
-            "molecular_weight": str(mw) if mw else "N/A",
-            "description": f"Analysis of unknown compound with formula {drug_input.chemical_formula} targeting receptor {drug_input.receptor_pdb_id}",
-            "xlogp": perplexity_response.get('xlogp', 'N/A')
-        }
-        
-        print(f"Returning response: {response_data}")
-        return response_data
-        
+        return await predict_unknown_compound(drug_input)
+    except HTTPException:
+        raise
     except Exception as e:
-        print('Unknown drug analysis error:', e)
+        logger.exception("Unknown drug analysis failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/leaderboard")
+async def leaderboard(
+    sort: Literal[SORT_COLUMNS] = "effectiveness",
+    order: Literal["desc", "asc"] = "desc",
+    limit: int = Query(20, ge=1, le=1000),
+    toxicity: Optional[Literal[TOXICITY_CLASSES]] = None,
+    drug_likeness: Optional[Literal[DRUG_LIKENESS_CLASSES]] = None,
+    min_value: Optional[float] = Query(None, alias="min", description="Lower bound of the sort column"),
+    max_value: Optional[float] = Query(None, alias="max", description="Upper bound of the sort column"),
+    scoring_model: Optional[str] = Query(None, description="Defaults to the model currently in use"),
+):
+    # Stored compounds ranked by a score, e.g. ?sort=effectiveness&toxicity=Low
+    await warmed()
+    from models import get_scoring_model, model_version
+
+    store = get_result_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="No result store configured (RESULT_STORE_PATH)")
+    version = scoring_model or model_version(get_scoring_model())
+    results = await asyncio.to_thread(store.top, version, sort, order == "desc", limit, toxicity, drug_likeness, min_value, max_value)
+    return {"scoring_model": version, "count": len(results), "results": results}
+
+@app.post("/compounds/query")
+async def query_compounds(query_input: CompoundQueryInput, format: str = "json"):
+    # Compounds in the local property store within property ranges, in CID
+    # order: a page with a cursor for the next one, or every match as NDJSON
+    await warmed()
+    from property_store import check_ranges, get_local_store, intersect_ranges
+    from scoring import DRUG_LIKENESS_RANGES
+
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    store = get_local_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="No local property store configured (PUBCHEM_LOCAL_STORE)")
+    ranges = {name: (bounds.min, bounds.max) for name, bounds in query_input.ranges.items()}
+    if query_input.drug_like:
+        ranges = intersect_ranges(ranges, DRUG_LIKENESS_RANGES)
+    after = query_input.cursor
+    if after is not None and not after.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        check_ranges(ranges)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        def lines():
+            # Runs in the threadpool, one block of rows per chunk
+            for rows in store.query(ranges, after, query_input.limit):
+                yield "".join(json.dumps(store.row_properties(row)) + "\n" for row in rows.tolist())
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    def page():
+        limit = query_input.limit or 100
+        # One row past the page tells whether there is another
+        rows = [row for block in store.query(ranges, after, limit + 1) for row in block.tolist()]
+        results = [store.row_properties(row) for row in rows[:limit]]
+        response = {"count": len(results), "results": results,
+                    "next_cursor": str(results[-1]["CID"]) if len(rows) > limit else None}
+        if query_input.count:
+            response["total"] = store.count(ranges)
+        return response
+
+    return await asyncio.to_thread(page)
+
+@app.get("/genome-report/{cid}")
+async def genome_report(cid: str):
+    # Served from the report cache, or joins a build started by a deferred
+    # prediction, or builds it now
+    return {"cid": cid, "genome_report": await get_genome_report(cid)}
+
+@app.post("/similar")
+async def similar_compounds(similarity_input: SimilarityInput):
+    await warmed()
+    from fingerprint import SmilesError
+    from similarity import get_similarity_index
+
+    try:
+        index = get_similarity_index()
+        matches = await asyncio.to_thread(index.search, similarity_input.smiles, similarity_input.k, similarity_input.threshold)
+    except SmilesError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid SMILES: {e}")
+    return {"count": len(matches), "indexed": len(index), "results": matches}
+
+async def predict_record(record):
+    # A streamed record is either a known compound (DrugInput) or an unknown
+    # one (UnknownDrugInput); SMILES is not needed to predict a known CID
+    if record.get("cid"):
+        return await predict_compound(str(record["cid"]))
+    if record.get("chemical_formula") and record.get("receptor_pdb_id"):
+        return await predict_unknown_compound(UnknownDrugInput(**record))
+    raise ValueError("Record needs a cid, or a chemical_formula and receptor_pdb_id")
+
+async def run_job(payload, progress):
+    # Records are handled a chunk at a time: async workers fetch each
+    # compound, then the chunk's known compounds are scored together off the
+    # event loop (in the scoring process pool when JOB_PROCESSES is set)
+    await warmed()
+    from models import get_scoring_model
+    from scoring import PropertyRecord
+
+    records = payload["records"]
+    await prefetch_properties([str(record["cid"]) for record in records if record.get("cid")])
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    model = get_scoring_model()
+
+    async def fetch_record(record):
+        async with semaphore:
+            try:
+                if record.get("cid"):
+                    props, description, genome_report = await fetch_compound_data(str(record["cid"]))
+                    return (PropertyRecord(props), description, genome_report), None
+                if record.get("chemical_formula") and record.get("receptor_pdb_id"):
+                    return await predict_unknown_compound(UnknownDrugInput(**record)), None
+                raise ValueError("Record needs a cid, or a chemical_formula and receptor_pdb_id")
+            except HTTPException as e:
+                return None, e.detail
+            except Exception as e:
+                logger.warning("Job item error: %s", e)
+                return None, str(e)
+
+    results = []
+    for start in range(0, len(records), JOB_CHUNK_SIZE):
+        chunk = records[start:start + JOB_CHUNK_SIZE]
+        fetched = await asyncio.gather(*(fetch_record(record) for record in chunk))
+        known = [data[0] for record, (data, error) in zip(chunk, fetched) if error is None and record.get("cid")]
+        scored = iter(await score_in_pool(known, model))
+        for index, (record, (data, error)) in enumerate(zip(chunk, fetched), start):
+            if error is None and record.get("cid"):
+                properties, description, genome_report = data
+                data = build_prediction(str(record["cid"]), properties, description, genome_report, next(scored), model)
+            results.append({"index": index, "input": record, "result": data, "error": error})
+            progress.advance(error is None)
+        await progress.update()
+    return results
+
+job_queue = JobQueue(run_job)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(job_input: JobInput):
+    # Analyses run in the background; poll GET /jobs/{job_id} or subscribe
+    # to /jobs/{job_id}/events, then fetch /jobs/{job_id}/result
+    records = ([{"cid": str(cid)} for cid in job_input.cids]
+               + [compound.model_dump() for compound in job_input.compounds]
+               + [compound.model_dump(exclude_none=True) for compound in job_input.unknown_compounds])
+    if not records:
+        raise HTTPException(status_code=400, detail="No compounds provided")
+    if len(records) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Job exceeds {BATCH_MAX_SIZE} compounds")
+    job = await job_queue.submit({"records": records}, len(records), job_input.priority)
+    return {**job, "status_url": f"/jobs/{job['job_id']}", "events_url": f"/jobs/{job['job_id']}/events",
+            "result_url": f"/jobs/{job['job_id']}/result"}
+
+@app.get("/jobs")
+async def job_counts():
+    return await job_queue.counts()
+
+async def get_job_or_404(job_id):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return await get_job_or_404(job_id)
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = await get_job_or_404(job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    results = await job_queue.result(job_id)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return {**job, "results": results}
+
+@app.get("/jobs/{job_id}/events")
+async def job_progress_events(job_id: str):
+    await get_job_or_404(job_id)
+    return StreamingResponse(job_events(job_queue, job_id), media_type="text/event-stream")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = await get_job_or_404(job_id)
+    if job["status"] in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job is already {job['status']}")
+    await job_queue.cancel(job_id)
+    return await get_job_or_404(job_id)
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request, format: str = "ndjson"):
+    # Upload a CSV (with a header row) or NDJSON body of compounds; each result
+    # is emitted as soon as it is ready, as NDJSON lines or Server-Sent Events
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or sse")
+    spool = await spool_body(request.stream(), STREAM_MAX_BYTES)
+    results = stream_predictions(iter_records(iter_spool(spool)), predict_record, STREAM_MAX_IN_FLIGHT)
+    if format == "sse":
+        return StreamingResponse(encode_sse(results), media_type="text/event-stream")
+    return StreamingResponse(encode_ndjson(results), media_type="application/x-ndjson")
+
 def calculate_molecular_weight(formula):
+    from formula import FormulaError, molecular_mass
+
     try:
-        # Basic molecular weight calculation
-        # This is a simplified version - you might want to use a chemistry library for more accuracy
-        atomic_weights = {
-            'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'P': 30.974,
-            'S': 32.065, 'F': 18.998, 'Cl': 35.453, 'Br': 79.904, 'I': 126.904
-        }
-        
-        import re
-        pattern = r'([A-Z][a-z]*)(\d*)'
-        matches = re.findall(pattern, formula)
-        
-        total_weight = 0
-        for element, count in matches:
-            count = int(count) if count else 1
-            if element in atomic_weights:
-                total_weight += atomic_weights[element] * count
-        
-        return round(total_weight, 3)
-    except Exception as e:
-        print(f"Error calculating molecular weight: {e}")
+        return round(molecular_mass(formula), 3)
+    except FormulaError as e:
+        logger.warning("Error calculating molecular weight: %s", e)
         return None
 
-def fetch_receptor_info(pdb_id):
+async def fetch_receptor_info(pdb_id):
     try:
-        url = f"https://data.rcsb.org/rest/v1/core/entry/{pdb_id}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        return None
+        return await get_receptor_info(pdb_id)
     except Exception as e:
-        print(f"Error fetching receptor info: {e}")
+        logger.warning("Error fetching receptor info: %s", e)
         return None
 
-async def analyze_with_perplexity(chemical_formula, receptor_pdb_id):
+async def find_similar_compounds(smiles, k=5):
+    await warmed()
+    from fingerprint import SmilesError
+    from similarity import get_similarity_index
+
+    try:
+        return await asyncio.to_thread(get_similarity_index().search, smiles, k)
+    except SmilesError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid SMILES: {e}")
+
+async def analyze_with_perplexity(chemical_formula, receptor_pdb_id, mw=None):
     # This is where you would integrate with Perplexity
     # For now, we'll return simulated results based on the molecular weight and complexity
-    mw = calculate_molecular_weight(chemical_formula)
+    await warmed()
+    if mw is None:
+        mw = calculate_molecular_weight(chemical_formula)
     
     # Simulate binding affinity based on molecular weight
     binding_score = min((mw / 500) * 100, 100) if mw else 50
@@ -493,8 +567,18 @@ async def analyze_with_perplexity(chemical_formula, receptor_pdb_id):
         "xlogp": "2.45",  # Simulated value
     }
 
-def generate_genome_report(perplexity_data):
+def generate_genome_report(perplexity_data, similar_compounds=None):
     # Generate a structured report based on the analysis
+    if similar_compounds:
+        similarity_lines = [
+            f"- {match['name'] or 'CID ' + match['cid']} (CID {match['cid']}): Tanimoto similarity {match['similarity']:.2f}"
+            for match in similar_compounds
+        ]
+    elif similar_compounds is None:
+        similarity_lines = ["- No similarity search performed (no SMILES provided)"]
+    else:
+        similarity_lines = ["- No similar compounds found in the reference index"]
+
     report_sections = [
         "Genetic Interaction Summary:",
         "- Predicted receptor binding site analysis completed",
@@ -502,9 +586,11 @@ def generate_genome_report(perplexity_data):
         f"- Binding affinity score: {perplexity_data.get('binding_affinity', 'N/A')}",
         "",
         "Protein Interactions:",
-        "- Analysis based on structural similarities",
         "- Potential interaction pathways identified",
         "",
+        "Structurally Similar Known Compounds:",
+        *similarity_lines,
+        "",
         "Genetic Pathways:",
         "- Predicted metabolic pathways analyzed",
         "- Safety profile assessment completed"
@@ -0,0 +1,366 @@
+# Trained scoring models for binding affinity and toxicity.
+#
+# Train on a labelled CSV of descriptors (PubChem property names as headers, as
+# in the property store) with a numeric 0-100 `binding_affinity` and/or
+# `toxicity` column:
+#
+#   python models.py train data/labelled.csv models/scoring.joblib
+#   python models.py compile models/scoring.joblib models/scoring
+#   python models.py info models/scoring
+#
+# and point the service at the compiled directory (or the joblib artifact)
+# with SCORING_MODEL_PATH. A compiled model is a table of every tree's nodes
+# per target, memory-mapped and evaluated with numpy, so the service loads it
+# without importing scikit-learn or unpickling anything. A joblib artifact
+# is compiled when it loads too, for small inputs. The model is loaded
+# on first use and scores a whole batch with one predict call per target.
+# SCORING_MODE=heuristic (or a missing/unloadable artifact) keeps the
+# hand-weighted heuristics in scoring.py.
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+
+from scoring import SCORING_COLUMNS, property_matrix
+from telemetry import span
+
+ARTIFACT_FORMAT = 1
+COMPILED_FORMAT = 1
+MODEL_TARGETS = ("binding_affinity", "toxicity")
+SCORING_MODEL_PATH = os.getenv("SCORING_MODEL_PATH")
+SCORING_MODE = os.getenv("SCORING_MODE", "model")
+
+logger = logging.getLogger(__name__)
+
+# Largest input a joblib artifact scores with its compiled node tables;
+# scikit-learn is faster on larger batches, and compiled models use their
+# tables for every size
+COMPILED_MAX_ROWS = 256
+# Rows evaluated at once, bounding the (rows x trees) working arrays
+COMPILED_BLOCK_ROWS = 256
+# Tree level from which finished (row, tree) pairs are set aside
+COMPILED_COMPACT_STEP = 4
+# Node arrays of a compiled tree ensemble, one .npy file each, concatenated
+# over every tree. children holds each node's left and right child at 2i and
+# 2i + 1; leaves point at themselves, so walking every tree for a fixed
+# number of steps lands each row on a leaf.
+TREE_ARRAYS = ("feature", "threshold", "missing_right", "children", "value")
+
+
+class TreeEnsemble:
+    # A compiled HistGradientBoostingRegressor: the baseline plus one leaf
+    # value per tree, with the same split rules (x <= threshold goes left,
+    # NaN goes right where missing_right is set)
+    def __init__(self, arrays, roots, depth, baseline):
+        # Plain ndarray views of memory-mapped arrays: np.memmap's subclass
+        # overhead on every take() is most of a single-row prediction
+        self.arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.depth = int(depth)
+        self.baseline = float(baseline)
+
+    @classmethod
+    def from_estimator(cls, estimator):
+        # Reads scikit-learn's private tree attributes, so a release that
+        # renames them fails here rather than compiling a different model
+        try:
+            categorical = estimator.is_categorical_
+            trees = [predictor.nodes for (predictor,) in estimator._predictors]
+            sizes = [len(tree) for tree in trees]
+            roots = np.cumsum([0] + sizes[:-1]).astype(np.intp)
+            nodes = np.concatenate(trees)
+            offsets = np.repeat(roots, sizes)
+            leaf = nodes["is_leaf"].astype(bool)
+            own = np.arange(len(nodes), dtype=np.intp)
+            children = np.empty(2 * len(nodes), dtype=np.intp)
+            children[0::2] = np.where(leaf, own, nodes["left"] + offsets)
+            children[1::2] = np.where(leaf, own, nodes["right"] + offsets)
+            arrays = {
+                "feature": np.where(leaf, 0, nodes["feature_idx"]).astype(np.intp),
+                "threshold": nodes["num_threshold"].astype(np.float64),
+                "missing_right": ~nodes["missing_go_to_left"].astype(bool),
+                "children": children,
+                "value": np.where(leaf, nodes["value"], 0.0),
+            }
+            depth = max(int(tree["depth"].max()) for tree in trees)
+            baseline = np.ravel(estimator._baseline_prediction)[0]
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            from sklearn import __version__ as sklearn_version
+
+            raise ValueError(f"Cannot compile {type(estimator).__name__} from scikit-learn {sklearn_version}: {e!r}") from e
+        if estimator.loss != "squared_error" or categorical is not None:
+            raise ValueError("Only squared-error models without categorical features can be compiled")
+        return cls(arrays, roots, depth, baseline)
+
+    def predict(self, matrix):
+        matrix = np.asarray(matrix, dtype=float)
+        predicted = np.empty(len(matrix))
+        for start in range(0, len(matrix), COMPILED_BLOCK_ROWS):
+            block = matrix[start:start + COMPILED_BLOCK_ROWS]
+            predicted[start:start + len(block)] = self._predict_block(np.ascontiguousarray(block))
+        return predicted
+
+    def _predict_block(self, block):
+        # Every (row, tree) pair steps down one level per iteration, as flat
+        # index arrays; x > threshold (or a NaN bound right) picks the child.
+        # Most paths end well above the deepest leaf, so once half the pairs
+        # sit on a leaf they are set aside and the rest walk on alone.
+        feature, threshold, missing_right, children, value = (self.arrays[name] for name in TREE_ARRAYS)
+        trees = len(self.roots)
+        cells = np.repeat(np.arange(len(block), dtype=np.intp) * block.shape[1], trees)
+        node = np.tile(self.roots, len(block))
+        leaves = active = None
+        values = block.ravel()
+        missing = np.isnan(block).any()
+        for step in range(self.depth):
+            left = 2 * node
+            if step >= COMPILED_COMPACT_STEP:
+                done = children.take(left) == node
+                finished = np.count_nonzero(done)
+                if finished == len(node):
+                    break
+                if 2 * finished >= len(node):
+                    if active is None:
+                        leaves, active = node.copy(), np.arange(len(node), dtype=np.intp)
+                    else:
+                        leaves[active] = node
+                    walking = ~done
+                    active, node, cells, left = active[walking], node[walking], cells[walking], left[walking]
+            x = values.take(cells + feature.take(node))
+            right = x > threshold.take(node)
+            if missing:
+                right |= np.isnan(x) & missing_right.take(node)
+            node = children.take(left + right)
+        if active is None:
+            leaves = node
+        else:
+            leaves[active] = node
+        return self.baseline + value.take(leaves).reshape(len(block), trees).sum(axis=1)
+
+
+class ScoringModel:
+    def __init__(self, artifact):
+        if artifact.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported model artifact format {artifact.get('format')}")
+        if tuple(artifact["features"]) != SCORING_COLUMNS:
+            raise ValueError(f"Model was trained on features {artifact['features']}, expected {SCORING_COLUMNS}")
+        self.version = artifact["version"]
+        self.estimators = artifact["estimators"]
+        self.metrics = artifact.get("metrics", {})
+        self.info = {key: value for key, value in artifact.items() if key != "estimators"}
+        # Node tables for small inputs, where scikit-learn's per-call overhead
+        # dominates; a joblib artifact that cannot be compiled keeps using
+        # its estimators for everything
+        try:
+            self.compiled = {target: compile_estimator(estimator) for target, estimator in self.estimators.items()}
+        except ValueError as e:
+            logger.warning("Scoring model %s not compiled, predicting with scikit-learn only: %s", self.version, e)
+            self.compiled = dict(self.estimators)
+
+    @classmethod
+    def load(cls, path):
+        if os.path.isdir(path):
+            return cls(load_compiled(path))
+        import joblib
+
+        return cls(joblib.load(path))
+
+    @property
+    def targets(self):
+        return tuple(self.estimators)
+
+    def predict(self, matrix):
+        # Scores for every row of a property matrix, one vectorised call per
+        # target; unparseable (NaN) features are handled by the estimators
+        matrix = np.asarray(matrix, dtype=float).reshape(-1, len(SCORING_COLUMNS))
+        if not len(matrix):
+            return {target: np.zeros(0) for target in self.estimators}
+        estimators = self.compiled if len(matrix) <= COMPILED_MAX_ROWS else self.estimators
+        predicted = {}
+        for target, estimator in estimators.items():
+            with span(f"scoring.model.{target}"):
+                predicted[target] = np.clip(estimator.predict(matrix), 0, 100)
+        return predicted
+
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_scoring_model():
+    # The model configured with SCORING_MODEL_PATH, loaded on first use, or
+    # None when scoring should use the heuristics. Callers wait while another
+    # thread is loading it rather than score with the heuristics meanwhile.
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                if SCORING_MODE == "heuristic":
+                    logger.info("Scoring with heuristics (SCORING_MODE=heuristic)")
+                elif SCORING_MODEL_PATH:
+                    try:
+                        _model = ScoringModel.load(SCORING_MODEL_PATH)
+                        logger.info("Loaded scoring model %s (%s) from %s", _model.version, ", ".join(_model.targets), SCORING_MODEL_PATH)
+                    except Exception as e:
+                        logger.error("Error loading scoring model %s, falling back to heuristics: %s", SCORING_MODEL_PATH, e)
+                _model_loaded = True
+    return _model
+
+
+def model_version(model):
+    # Identifies the scores a response was computed with
+    return model.version if model is not None else "heuristic"
+
+
+def read_labelled_csv(path):
+    import pandas as pd
+
+    frame = pd.read_csv(path)
+    targets = [target for target in MODEL_TARGETS if target in frame.columns]
+    if not targets:
+        raise ValueError(f"{path} has none of the target columns {', '.join(MODEL_TARGETS)}")
+    return property_matrix(frame), {target: frame[target].to_numpy(dtype=float) for target in targets}
+
+
+def train_models(matrix, labels, version=None, test_size=0.2, seed=0):
+    from sklearn import __version__ as sklearn_version
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    from sklearn.metrics import mean_absolute_error, r2_score
+    from sklearn.model_selection import train_test_split
+
+    estimators = {}
+    metrics = {}
+    for target, y in labels.items():
+        # Rows without a label for this target are left out of its fit
+        labelled = ~np.isnan(y)
+        X, y = matrix[labelled], y[labelled]
+        if len(y) < 10:
+            raise ValueError(f"Need at least 10 labelled rows to train {target}, got {len(y)}")
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+        estimator = HistGradientBoostingRegressor(random_state=seed).fit(X_train, y_train)
+        predicted = np.clip(estimator.predict(X_test), 0, 100)
+        metrics[target] = {
+            "rows": int(len(y)),
+            "mae": float(mean_absolute_error(y_test, predicted)),
+            "r2": float(r2_score(y_test, predicted)),
+        }
+        # Refit on every labelled row once the holdout metrics are recorded
+        estimators[target] = HistGradientBoostingRegressor(random_state=seed).fit(X, y)
+
+    return {
+        "format": ARTIFACT_FORMAT,
+        "version": version or time.strftime("%Y%m%d%H%M%S"),
+        "features": list(SCORING_COLUMNS),
+        "estimators": estimators,
+        "metrics": metrics,
+        "sklearn_version": sklearn_version,
+        "trained_at": time.time(),
+    }
+
+
+def save_artifact(artifact, path):
+    import joblib
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def compile_estimator(estimator, rows=2000, seed=0):
+    # A fitted estimator's node tables, checked against the estimator's own
+    # predictions on rows at and just above every split threshold, with NaNs
+    if isinstance(estimator, TreeEnsemble):
+        return estimator
+    ensemble = TreeEnsemble.from_estimator(estimator)
+    rng = np.random.default_rng(seed)
+    feature, threshold, children = (ensemble.arrays[name] for name in ("feature", "threshold", "children"))
+    split = children[0::2] != np.arange(len(feature))
+    columns = []
+    for index in range(estimator.n_features_in_):
+        thresholds = threshold[split & (feature == index) & np.isfinite(threshold)]
+        columns.append(rng.choice(np.concatenate([thresholds, np.nextafter(thresholds, np.inf), [0.0, np.nan]]), rows))
+    probe = np.column_stack(columns)
+    expected = estimator.predict(probe)
+    if not np.allclose(ensemble.predict(probe), expected, rtol=1e-9, atol=1e-9):
+        error = np.abs(ensemble.predict(probe) - expected).max()
+        raise ValueError(f"Compiled {type(estimator).__name__} disagrees with its predictions by up to {error:g}")
+    return ensemble
+
+
+def compile_artifact(artifact, path):
+    # Write a trained artifact as a compiled model directory: model.json plus
+    # one node table per target, swapped into place when complete
+    meta = {key: value for key, value in artifact.items() if key != "estimators"}
+    meta["compiled_format"] = COMPILED_FORMAT
+    meta["targets"] = {}
+    tmp_dir = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for target, estimator in artifact["estimators"].items():
+        ensemble = compile_estimator(estimator)
+        for name in TREE_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{target}.{name}.npy"), ensemble.arrays[name])
+        meta["targets"][target] = {"roots": ensemble.roots.tolist(), "depth": ensemble.depth, "baseline": ensemble.baseline}
+    with open(os.path.join(tmp_dir, "model.json"), "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_dir, path)
+
+
+def load_compiled(path):
+    with open(os.path.join(path, "model.json")) as f:
+        meta = json.load(f)
+    if meta.get("compiled_format") != COMPILED_FORMAT:
+        raise ValueError(f"Unsupported compiled model format {meta.get('compiled_format')}")
+    targets = meta.pop("targets")
+    meta["estimators"] = {
+        target: TreeEnsemble(
+            {name: np.load(os.path.join(path, f"{target}.{name}.npy"), mmap_mode="r") for name in TREE_ARRAYS},
+            tree["roots"], tree["depth"], tree["baseline"],
+        )
+        for target, tree in targets.items()
+    }
+    return meta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or inspect scoring models")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="Fit models on a labelled descriptor CSV")
+    train.add_argument("csv_path")
+    train.add_argument("out_path")
+    train.add_argument("--version", help="Artifact version (defaults to a timestamp)")
+    train.add_argument("--test-size", type=float, default=0.2)
+    train.add_argument("--seed", type=int, default=0)
+    compile_ = commands.add_parser("compile", help="Convert a joblib artifact into a memory-mappable model directory")
+    compile_.add_argument("path")
+    compile_.add_argument("out_dir")
+    info = commands.add_parser("info", help="Print an artifact's version and metrics")
+    info.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        matrix, labels = read_labelled_csv(args.csv_path)
+        artifact = train_models(matrix, labels, args.version, args.test_size, args.seed)
+        save_artifact(artifact, args.out_path)
+        print(f"Wrote model {artifact['version']} to {args.out_path}")
+        print(json.dumps(artifact["metrics"], indent=2))
+    elif args.command == "compile":
+        import joblib
+
+        compile_artifact(joblib.load(args.path), args.out_dir)
+        print(f"Wrote compiled model to {args.out_dir}")
+    else:
+        print(json.dumps(ScoringModel.load(args.path).info, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
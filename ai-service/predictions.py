@@ -0,0 +1,78 @@
+# The /predict response for a scored compound, shared by the app and the
+# result store's precompute workers, which must not import the app
+import urllib.parse
+
+
+def get_molecule_image_url(cid: str):
+    return f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/PNG"
+
+
+def get_3d_structure_url(cid: str):
+    return f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/cid/{cid}/record/SDF/?record_type=3d"
+
+
+def get_genome_image_url(cid: str):
+    return f"https://pubchem.ncbi.nlm.nih.gov/image/imgsrv.fcgi?cid={cid}&t=l"
+
+
+def get_pubchem_url(cid: str):
+    return f"https://pubchem.ncbi.nlm.nih.gov/compound/{cid}"
+
+
+def get_chembl_url(inchikey: str):
+    return f"https://www.ebi.ac.uk/chembl/compound_report_card/{inchikey}/"
+
+
+def get_drugbank_url(name: str):
+    # DrugBank URLs are not always predictable, but we can provide a search link
+    return f"https://go.drugbank.com/unearth/q?search={urllib.parse.quote(name)}&searcher=drugs"
+
+
+def get_qr_code_url(url: str):
+    # Use Google Chart API for QR code
+    return f"https://chart.googleapis.com/chart?cht=qr&chs=200x200&chl={urllib.parse.quote(url)}"
+
+
+def build_prediction(cid, record, description, genome_report, scores, model):
+    # record is a scoring.PropertyRecord
+    from models import model_version
+
+    binding_affinity = scores["binding_affinity"]
+    toxicity = scores["toxicity"]
+    drug_likeness = scores["drug_likeness"]
+    effectiveness = scores["effectiveness"]
+    
+    molecule_image_url = get_molecule_image_url(cid)
+    structure3d_url = get_3d_structure_url(cid)
+    genome_image_url = get_genome_image_url(cid)
+    pubchem_url = get_pubchem_url(cid)
+    chembl_url = get_chembl_url(record.get("inchikey", ""))
+    drugbank_url = get_drugbank_url(record.get("iupac_name", ""))
+    qr_code_url = get_qr_code_url(pubchem_url)
+    
+    response_data = {
+        "binding_affinity": binding_affinity,
+        "toxicity": toxicity,
+        "drug_likeness": drug_likeness,
+        "effectiveness": effectiveness,
+        "genome_report": genome_report,
+        "molecular_weight": record.get("molecular_weight"),
+        "molecular_formula": record.get("molecular_formula"),
+        "iupac_name": record.get("iupac_name"),
+        "h_bond_donor_count": record.get("h_bond_donor_count"),
+        "h_bond_acceptor_count": record.get("h_bond_acceptor_count"),
+        "rotatable_bond_count": record.get("rotatable_bond_count"),
+        "xlogp": record.get("xlogp"),
+        "description": description,
+        "molecule_image_url": molecule_image_url,
+        "structure3d_url": structure3d_url,
+        "genome_image_url": genome_image_url,
+        "pubchem_url": pubchem_url,
+        "chembl_url": chembl_url,
+        "drugbank_url": drugbank_url,
+        "qr_code_url": qr_code_url,
+        "scoring_model": model_version(model)
+    }
+    if genome_report is None:
+        response_data["genome_report_url"] = f"/genome-report/{urllib.parse.quote(cid, safe='')}"
+    return response_data
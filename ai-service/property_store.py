@@ -0,0 +1,462 @@
+# Local, memory-mapped PubChem property store.
+#
+# Build a store from PubChem bulk extracts (a CID-keyed TSV with PubChem property
+# names as headers, and/or PubChem SDF files, optionally gzipped):
+#
+#   python property_store.py build data/pubchem-props --tsv props.tsv --sdf Compound_000000001_000500000.sdf.gz
+#
+# and point the service at it with PUBCHEM_LOCAL_STORE=data/pubchem-props.
+#
+# The store is a directory of .npy columns sorted by CID. Every worker process
+# maps the same files read-only, so the operating system shares the pages
+# between them and lookups are a binary search over the CID column.
+#
+# Each numeric column also has a sorted index, so property range queries
+# (POST /compounds/query) find their candidates with two binary searches:
+#
+#   python property_store.py query data/pubchem-props --range MolecularWeight::500 --range XLogP:1:3 --drug-like
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+
+STORE_VERSION = 1
+NUMERIC_COLUMNS = ("MolecularWeight", "XLogP", "HBondDonorCount", "HBondAcceptorCount", "RotatableBondCount", "Complexity", "Volume3D")
+INTEGER_COLUMNS = ("HBondDonorCount", "HBondAcceptorCount", "RotatableBondCount")
+TEXT_COLUMNS = ("MolecularFormula", "IUPACName", "InChIKey")
+# Cost of taking one candidate from an index (reading, sorting and checking
+# it) relative to comparing one value in a column scan; a range query reads
+# its most selective index range when that is cheaper than scanning
+INDEX_ROW_COST = 50
+# Rows compared per step of a scan, and candidates checked per step of an
+# index range; queries stop at a step boundary once their page is full
+QUERY_BLOCK_ROWS = 1 << 16
+# Records parsed, and rows copied, per step of a build; a build keeps one
+# chunk of records as Python objects and stages the rest in raw files
+BUILD_CHUNK_ROWS = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+# PubChem SDF data tags and the property names they correspond to
+SDF_TAGS = {
+    "PUBCHEM_COMPOUND_CID": "CID",
+    "PUBCHEM_MOLECULAR_WEIGHT": "MolecularWeight",
+    "PUBCHEM_XLOGP3": "XLogP",
+    "PUBCHEM_XLOGP3_AA": "XLogP",
+    "PUBCHEM_CACTVS_HBOND_DONOR": "HBondDonorCount",
+    "PUBCHEM_CACTVS_HBOND_ACCEPTOR": "HBondAcceptorCount",
+    "PUBCHEM_CACTVS_ROTATABLE_BOND": "RotatableBondCount",
+    "PUBCHEM_CACTVS_COMPLEXITY": "Complexity",
+    "PUBCHEM_SHAPE_VOLUME": "Volume3D",
+    "PUBCHEM_MOLECULAR_FORMULA": "MolecularFormula",
+    "PUBCHEM_IUPAC_NAME": "IUPACName",
+    "PUBCHEM_IUPAC_INCHIKEY": "InChIKey",
+}
+
+
+class PropertyStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported property store version {self.meta.get('version')} in {path}")
+        self.cids = np.load(os.path.join(path, "cid.npy"), mmap_mode="r")
+        # Plain arrays over the maps: indexing an np.memmap with an array of
+        # rows is much slower than indexing the same memory as an ndarray
+        self.numeric = {name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")) for name in NUMERIC_COLUMNS}
+        # Sorted index of each numeric column: (values in ascending order, row of each)
+        self.indexes = {
+            name: tuple(np.asarray(np.load(os.path.join(path, f"{name}.{suffix}.npy"), mmap_mode="r")) for suffix in ("sorted", "rows"))
+            for name in NUMERIC_COLUMNS
+        }
+        self.text = {}
+        for name in TEXT_COLUMNS:
+            offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r")
+            data_path = os.path.join(path, f"{name}.bytes")
+            # np.memmap cannot map an empty file
+            data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) else np.zeros(0, dtype=np.uint8)
+            self.text[name] = (offsets, data)
+
+    def __len__(self):
+        return len(self.cids)
+
+    def find(self, cid):
+        # Row index of a CID, or None
+        try:
+            cid = int(cid)
+        except (TypeError, ValueError):
+            return None
+        row = int(np.searchsorted(self.cids, cid))
+        if row < len(self.cids) and self.cids[row] == cid:
+            return row
+        return None
+
+    def text_value(self, name, row):
+        offsets, data = self.text[name]
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        return bytes(data[start:end]).decode("utf-8") if end > start else None
+
+    def row_properties(self, row):
+        # Properties of one row in the same shape as PubChem's property table;
+        # like PubChem, properties with no value are left out
+        props = {"CID": int(self.cids[row])}
+        for name in NUMERIC_COLUMNS:
+            value = float(self.numeric[name][row])
+            if not np.isnan(value):
+                props[name] = int(value) if name in INTEGER_COLUMNS else value
+        for name in TEXT_COLUMNS:
+            value = self.text_value(name, row)
+            if value is not None:
+                props[name] = value
+        return props
+
+    def get(self, cid):
+        row = self.find(cid)
+        return None if row is None else self.row_properties(row)
+
+    def _index_span(self, name, low, high):
+        # (start, end) of the index entries within [low, high], or None when
+        # the column has no index
+        if name not in self.indexes:
+            return None
+        values = self.indexes[name][0]
+        start = 0 if low is None else int(np.searchsorted(values, low, side="left"))
+        end = len(values) if high is None else int(np.searchsorted(values, high, side="right"))
+        return start, max(start, end)
+
+    def match(self, ranges, start_row=0, limit=None):
+        # Rows from start_row on whose values lie within every range, yielded
+        # as arrays in row (so CID) order. ranges maps numeric columns to
+        # inclusive (low, high) bounds, either of which may be None; compounds
+        # with no value for a filtered column never match. limit, the number
+        # of rows the caller will take, only informs the plan.
+        check_ranges(ranges)
+        count = len(self)
+        # Each range with the number of compounds within it: exact for an
+        # indexed column, the whole store otherwise
+        plan = []
+        for name, (low, high) in ranges.items():
+            span = self._index_span(name, low, high)
+            plan.append((count if span is None else span[1] - span[0], name, low, high, span))
+        plan.sort(key=lambda step: step[0])
+        if plan and plan[0][0] == 0:
+            return
+        if plan and plan[0][4] is not None:
+            # A scan for a page stops once it is full: estimate how far it
+            # goes from the share of the store expected to match, taking the
+            # ranges as independent
+            scan_rows = count - start_row
+            if limit is not None:
+                share = float(np.prod([size / count for size, *_ in plan]))
+                scan_rows = min(scan_rows, limit / share)
+            if plan[0][0] * INDEX_ROW_COST < scan_rows * len(plan):
+                yield from self._match_index(plan, start_row)
+                return
+        for block in range(start_row, count, QUERY_BLOCK_ROWS):
+            end = min(block + QUERY_BLOCK_ROWS, count)
+            mask = None
+            for _, name, low, high, _ in plan:
+                within = _within(self.numeric[name][block:end], low, high)
+                mask = within if mask is None else np.logical_and(mask, within, out=mask)
+            rows = np.arange(block, end) if mask is None else np.flatnonzero(mask) + block
+            if len(rows):
+                yield rows
+
+    def _match_index(self, plan, start_row):
+        # The most selective range's index entries are the candidates, and
+        # only their values are read for the other ranges
+        start, end = plan[0][4]
+        candidates = self.indexes[plan[0][1]][1][start:end]
+        candidates = np.sort(candidates[candidates >= start_row])
+        for block in range(0, len(candidates), QUERY_BLOCK_ROWS):
+            rows = candidates[block:block + QUERY_BLOCK_ROWS]
+            for _, name, low, high, _ in plan[1:]:
+                rows = rows[_within(self.numeric[name][rows], low, high)]
+            if len(rows):
+                yield rows
+
+    def query(self, ranges, after=None, limit=None):
+        # Like match, from the first CID above after and for at most limit rows
+        start_row = 0 if after is None else int(np.searchsorted(self.cids, int(after), side="right"))
+        remaining = limit
+        for rows in self.match(ranges, start_row, limit):
+            if remaining is not None:
+                rows = rows[:remaining]
+                remaining -= len(rows)
+            yield rows
+            if remaining == 0:
+                return
+
+    def count(self, ranges):
+        return sum(len(rows) for rows in self.match(ranges))
+
+
+def check_ranges(ranges):
+    unknown = sorted(set(ranges) - set(NUMERIC_COLUMNS))
+    if unknown:
+        raise ValueError(f"Unknown properties {', '.join(unknown)}; ranges can filter {', '.join(NUMERIC_COLUMNS)}")
+
+
+def _within(values, low, high):
+    # NaN (no value) compares false, so it is never within a range
+    if low is None and high is None:
+        return ~np.isnan(values)
+    if low is None:
+        return values <= high
+    if high is None:
+        return values >= low
+    return np.logical_and(values >= low, values <= high)
+
+
+def intersect_ranges(*range_sets):
+    # Ranges that hold where all of the given ones do: per column, the
+    # highest low bound and the lowest high bound
+    combined = {}
+    for ranges in range_sets:
+        for name, (low, high) in ranges.items():
+            current_low, current_high = combined.get(name, (None, None))
+            if low is not None and (current_low is None or low > current_low):
+                current_low = low
+            if high is not None and (current_high is None or high < current_high):
+                current_high = high
+            combined[name] = (current_low, current_high)
+    return combined
+
+
+_store = None
+_store_loaded = False
+_store_lock = threading.Lock()
+
+
+def get_local_store():
+    # The store configured with PUBCHEM_LOCAL_STORE, opened on first use (the
+    # service may be warming it in another thread)
+    global _store, _store_loaded
+    if not _store_loaded:
+        with _store_lock:
+            if not _store_loaded:
+                path = os.getenv("PUBCHEM_LOCAL_STORE")
+                if path:
+                    try:
+                        _store = PropertyStore(path)
+                        logger.info("Loaded local PubChem property store with %d compounds from %s", len(_store), path)
+                    except Exception as e:
+                        logger.error("Error loading local property store %s: %s", path, e)
+                _store_loaded = True
+    return _store
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def read_tsv(path, chunksize=500000):
+    import pandas as pd
+
+    for frame in pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False, chunksize=chunksize):
+        if "CID" not in frame.columns:
+            raise ValueError(f"{path} has no CID column")
+        for record in frame.to_dict("records"):
+            yield {k: v for k, v in record.items() if v != ""}
+
+
+def read_sdf(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        record = {}
+        tag = None
+        for line in f:
+            line = line.rstrip("\n")
+            if line == "$$$$":
+                if "CID" in record:
+                    yield record
+                record = {}
+                tag = None
+            elif line.startswith(">"):
+                start = line.find("<")
+                end = line.find(">", start)
+                tag = SDF_TAGS.get(line[start + 1:end]) if start != -1 and end != -1 else None
+            elif tag is not None:
+                if line:
+                    record.setdefault(tag, line.strip())
+                else:
+                    tag = None
+
+
+def _stage_chunk(files, chunk):
+    # Append one chunk of parsed (cid, record) pairs to the raw staging files
+    files["cid"].write(np.asarray([cid for cid, _ in chunk], dtype=np.int64).tobytes())
+    for name in NUMERIC_COLUMNS:
+        files[name].write(np.asarray([_to_float(record.get(name)) for _, record in chunk], dtype=np.float64).tobytes())
+    for name in TEXT_COLUMNS:
+        encoded = [(record.get(name) or "").encode("utf-8") for _, record in chunk]
+        files[f"{name}.lengths"].write(np.asarray([len(value) for value in encoded], dtype=np.int64).tobytes())
+        files[f"{name}.bytes"].write(b"".join(encoded))
+
+
+def _map_staged(path, dtype):
+    # np.memmap cannot map an empty file
+    return np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=dtype)
+
+
+def build_store(records, out_dir):
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    staging = os.path.join(tmp_dir, "staging")
+    os.makedirs(staging)
+
+    # Parse the input a chunk at a time into raw column files, so memory does
+    # not grow with the number of records
+    names = ("cid",) + NUMERIC_COLUMNS + tuple(f"{name}.{part}" for name in TEXT_COLUMNS for part in ("lengths", "bytes"))
+    files = {name: open(os.path.join(staging, name), "wb") for name in names}
+    try:
+        chunk = []
+        for record in records:
+            try:
+                chunk.append((int(record["CID"]), record))
+            except (KeyError, ValueError):
+                continue
+            if len(chunk) == BUILD_CHUNK_ROWS:
+                _stage_chunk(files, chunk)
+                chunk = []
+        if chunk:
+            _stage_chunk(files, chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    staged_cids = _map_staged(os.path.join(staging, "cid"), np.int64)
+    # Sort by CID; for duplicate CIDs the last record wins
+    order = np.argsort(staged_cids, kind="stable")
+    sorted_cids = staged_cids[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[:-1] = sorted_cids[1:] != sorted_cids[:-1]
+    order = order[keep]
+    np.save(os.path.join(tmp_dir, "cid.npy"), sorted_cids[keep])
+    del sorted_cids, keep
+
+    # One column in memory at a time
+    for name in NUMERIC_COLUMNS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), _map_staged(os.path.join(staging, name), np.float64)[order])
+    for name in TEXT_COLUMNS:
+        staged_lengths = _map_staged(os.path.join(staging, f"{name}.lengths"), np.int64)
+        staged_offsets = np.zeros(len(staged_lengths) + 1, dtype=np.int64)
+        np.cumsum(staged_lengths, out=staged_offsets[1:])
+        lengths = staged_lengths[order]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        data = _map_staged(os.path.join(staging, f"{name}.bytes"), np.uint8)
+        with open(os.path.join(tmp_dir, f"{name}.bytes"), "wb") as f:
+            for start in range(0, len(order), BUILD_CHUNK_ROWS):
+                rows = order[start:start + BUILD_CHUNK_ROWS]
+                block_lengths = lengths[start:start + BUILD_CHUNK_ROWS]
+                # Source position of every byte of the block's values, in output order
+                shift = staged_offsets[rows] - (offsets[start:start + len(rows)] - offsets[start])
+                f.write(data[np.repeat(shift, block_lengths) + np.arange(int(block_lengths.sum()))].tobytes())
+        np.save(os.path.join(tmp_dir, f"{name}.offsets.npy"), offsets)
+    del staged_cids, data
+    shutil.rmtree(staging)
+
+    build_indexes(tmp_dir)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"version": STORE_VERSION, "count": int(len(order))}, f)
+
+    # Swap the finished store into place so readers never see a partial build
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp_dir, out_dir)
+    return len(order)
+
+
+def build_indexes(path):
+    # Write each numeric column's sorted index next to it: {name}.sorted.npy
+    # holds the column's values in ascending order and {name}.rows.npy the
+    # row of each, leaving out compounds without a value. Equal values keep
+    # row order.
+    for name in NUMERIC_COLUMNS:
+        column = np.load(os.path.join(path, f"{name}.npy"))
+        rows = np.argsort(column, kind="stable")
+        # NaNs sort last
+        rows = rows[:len(column) - int(np.isnan(column).sum())]
+        dtype = np.int32 if len(column) <= np.iinfo(np.int32).max else np.int64
+        for suffix, array in (("sorted", column[rows]), ("rows", rows.astype(dtype))):
+            # Replaced whole, so a reader never maps a partial file
+            tmp_path = os.path.join(path, f"{name}.{suffix}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(path, f"{name}.{suffix}.npy"))
+
+
+def parse_range(text):
+    # "NAME:LOW:HIGH" with either bound optional, e.g. "XLogP:1:3" or "MolecularWeight::500"
+    try:
+        name, low, high = text.split(":")
+        bounds = (float(low) if low else None, float(high) if high else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected NAME:LOW:HIGH, got {text!r}")
+    if name not in NUMERIC_COLUMNS:
+        raise argparse.ArgumentTypeError(f"{name} is not one of {', '.join(NUMERIC_COLUMNS)}")
+    return name, bounds
+
+
+def _iter_inputs(tsv_paths, sdf_paths):
+    for path in tsv_paths:
+        yield from read_tsv(path)
+    for path in sdf_paths:
+        yield from read_sdf(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a local PubChem property store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a store from PubChem bulk extracts")
+    build.add_argument("out_dir")
+    build.add_argument("--tsv", action="append", default=[], help="CID-keyed TSV with PubChem property names as headers")
+    build.add_argument("--sdf", action="append", default=[], help="PubChem SDF file (.sdf or .sdf.gz)")
+    lookup = commands.add_parser("lookup", help="Print the stored properties of CIDs")
+    lookup.add_argument("store")
+    lookup.add_argument("cids", nargs="+")
+    query = commands.add_parser("query", help="Print the stored compounds within property ranges, in CID order")
+    query.add_argument("store")
+    query.add_argument("--range", dest="ranges", type=parse_range, action="append", default=[],
+                       help="NAME:LOW:HIGH, inclusive, either bound optional (repeatable)")
+    query.add_argument("--drug-like", action="store_true", help="Also apply the drug-likeness rules")
+    query.add_argument("--after", help="Start after this CID")
+    query.add_argument("-n", type=int, default=None, help="At most this many compounds (default: all)")
+    query.add_argument("--count", action="store_true", help="Print only the number of matches")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if not args.tsv and not args.sdf:
+            parser.error("build needs at least one --tsv or --sdf input")
+        count = build_store(_iter_inputs(args.tsv, args.sdf), args.out_dir)
+        print(f"Wrote {count} compounds to {args.out_dir}")
+    elif args.command == "query":
+        ranges = intersect_ranges(*({name: bounds} for name, bounds in args.ranges))
+        if args.drug_like:
+            from scoring import DRUG_LIKENESS_RANGES
+
+            ranges = intersect_ranges(ranges, DRUG_LIKENESS_RANGES)
+        store = PropertyStore(args.store)
+        if args.count:
+            print(store.count(ranges))
+        else:
+            for rows in store.query(ranges, args.after, args.n):
+                for row in rows.tolist():
+                    print(json.dumps(store.row_properties(row)))
+    else:
+        store = PropertyStore(args.store)
+        for cid in args.cids:
+            print(json.dumps(store.get(cid)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import os
+
+import httpx
+from fastapi import HTTPException
+
+from cache import genome_report_cache, pubchem_cache
+from http_client import UpstreamError, fetch, post
+from resilience import UpstreamPolicy
+from streaming import iter_json_array
+from telemetry import log_payload
+
+# Base URLs can be pointed at a local stand-in (see benchmarks/fake_upstream.py)
+PUBCHEM_PUG_URL = os.getenv("PUBCHEM_PUG_URL", "https://pubchem.ncbi.nlm.nih.gov/rest/pug").rstrip("/")
+PUBCHEM_COMPOUND_URL = f"{PUBCHEM_PUG_URL}/compound/cid"
+BASIC_PROPERTIES = "MolecularWeight,XLogP,HBondDonorCount,HBondAcceptorCount,RotatableBondCount,MolecularFormula,IUPACName,InChIKey"
+COMPUTED_PROPERTIES = "Volume3D,Complexity"
+
+# Number of CIDs per multi-CID property query
+PUBCHEM_BATCH_CHUNK = int(os.getenv("PUBCHEM_BATCH_CHUNK", "200"))
+
+# PubChem allows roughly 5 requests per second per client; every call site
+# shares one rate limiter, retry policy and circuit breaker
+PUBCHEM_RATE_LIMIT = float(os.getenv("PUBCHEM_RATE_LIMIT", "5"))
+PUBCHEM_RATE_BURST = int(os.getenv("PUBCHEM_RATE_BURST", "5"))
+pubchem_policy = UpstreamPolicy("pubchem", rate=PUBCHEM_RATE_LIMIT, burst=PUBCHEM_RATE_BURST)
+
+# Property lookups for different CIDs arriving within this many seconds are
+# merged into one multi-CID query (0 disables coalescing)
+PUBCHEM_COALESCE_WINDOW = float(os.getenv("PUBCHEM_COALESCE_WINDOW", "0.01"))
+
+# Every upstream lookup is cached on its own, keyed by "<kind>:<cid>". Fetchers
+# return the value to cache for a definitive answer (including a 404) and
+# raise for anything transient so that it is retried on the next request.
+
+logger = logging.getLogger(__name__)
+
+
+async def _get_json(name, url, not_found=None):
+    r = await pubchem_policy.call(lambda: fetch(url, name=name), url)
+    if r.status_code == 404 and not_found is not None:
+        return None
+    if r.status_code != 200:
+        raise UpstreamError(r.status_code, url)
+    return r.json()
+
+
+def cached(kind, cid, fetcher):
+    return pubchem_cache.get_or_fetch(f"{kind}:{cid}", fetcher)
+
+
+async def _fetch_basic_properties(cid):
+    if PUBCHEM_COALESCE_WINDOW > 0 and cid.isdigit():
+        row = await _property_coalescer.get(cid)
+        if row is None:
+            raise UpstreamError(404, f"{PUBCHEM_COMPOUND_URL}/{cid}/property")
+        basic, computed = row
+        # The same query usually answered the computed lookup as well
+        if computed is not None:
+            await pubchem_cache.set(f"computed:{cid}", computed)
+        return basic
+    return await _get_basic_properties(cid)
+
+
+async def _get_basic_properties(cid):
+    data = await _get_json("properties", f"{PUBCHEM_COMPOUND_URL}/{cid}/property/{BASIC_PROPERTIES}/JSON")
+    return data["PropertyTable"]["Properties"][0]
+
+
+async def _fetch_description(cid):
+    data = await _get_json("description", f"{PUBCHEM_COMPOUND_URL}/{cid}/description/JSON", not_found=True)
+    if data is None:
+        return None
+    desc_data = data.get("InformationList", {}).get("Information", [{}])[0]
+    return desc_data.get("Description", [""])[0]
+
+
+async def _fetch_computed_properties(cid):
+    data = await _get_json("computed", f"{PUBCHEM_COMPOUND_URL}/{cid}/property/{COMPUTED_PROPERTIES}/JSON", not_found=True)
+    if data is None:
+        return {}
+    return data["PropertyTable"]["Properties"][0]
+
+
+async def _fetch_synonym(cid):
+    data = await _get_json("synonyms", f"{PUBCHEM_COMPOUND_URL}/{cid}/synonyms/JSON", not_found=True)
+    if data is None:
+        return "No description available"
+    synonyms = data.get("InformationList", {}).get("Information", [{}])[0].get("Synonym", [])
+    return synonyms[0] if synonyms else "No description available"
+
+
+def _is_genetic_assay(assay):
+    target = assay.get('TargetName', '').lower()
+    return 'gene' in target or 'dna' in target or 'protein' in target
+
+
+async def _fetch_genetic_assays(cid):
+    # Only the top 3 genetic assays are ever reported, so only those are
+    # cached. Assay summaries of well-studied drugs run to megabytes, so the
+    # body is parsed as it arrives and the download stops once 3 are found.
+    url = f"{PUBCHEM_COMPOUND_URL}/{cid}/assaysummary/JSON"
+    genetic_assays = []
+
+    async def read(response):
+        genetic_assays.clear()
+        async for assay in iter_json_array(response.aiter_bytes(), "AssaySummary"):
+            if _is_genetic_assay(assay):
+                genetic_assays.append({"TargetName": assay.get('TargetName'),
+                                       "BioActivitySummary": assay.get('BioActivitySummary', 'No activity data')})
+                if len(genetic_assays) == 3:
+                    break
+
+    r = await pubchem_policy.call(lambda: fetch(url, name="assaysummary", consume=read), url)
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise UpstreamError(r.status_code, url)
+    return genetic_assays
+
+
+async def _fetch_protein_targets(cid):
+    data = await _get_json("protein_targets", f"{PUBCHEM_COMPOUND_URL}/{cid}/protein_targets/JSON", not_found=True)
+    if data is None or 'ProteinTargets' not in data:
+        return None
+    return [{"ProteinName": t.get('ProteinName'), "InteractionType": t.get('InteractionType', 'Unknown interaction')}
+            for t in data['ProteinTargets'][:3]]
+
+
+async def _fetch_pathways(cid):
+    data = await _get_json("pathway", f"{PUBCHEM_COMPOUND_URL}/{cid}/pathway/JSON", not_found=True)
+    if data is None or 'Pathways' not in data:
+        return None
+    return [p.get('PathwayName') for p in data['Pathways'][:3]]
+
+
+def _local_properties(cid):
+    from property_store import get_local_store
+
+    store = get_local_store()
+    return store.get(cid) if store is not None else None
+
+
+async def fetch_pubchem_properties(cid: str):
+    # Properties come from the local bulk store when one is configured and has
+    # the CID; otherwise the basic and description lookups are issued
+    # together. Computed properties usually arrive with the (coalesced) basic
+    # ones, so they are looked up afterwards.
+    local_props = _local_properties(cid)
+    lookups = [cached("description", cid, lambda: _fetch_description(cid))]
+    if local_props is None:
+        lookups.append(cached("properties", cid, lambda: _fetch_basic_properties(cid)))
+    description, *remote = await asyncio.gather(*lookups, return_exceptions=True)
+    basic = remote[0] if remote else local_props
+    if isinstance(basic, UpstreamError) and basic.status_code in (400, 404):
+        raise HTTPException(status_code=404, detail="PubChem properties not found")
+    if isinstance(basic, (UpstreamError, asyncio.TimeoutError, httpx.HTTPError)):
+        # Throttled, failing or circuit open, with nothing cached to fall back on
+        raise HTTPException(status_code=503, detail="PubChem is unavailable, please try again later")
+    if isinstance(basic, Exception):
+        raise basic
+    computed = {}
+    if remote:
+        try:
+            computed = await cached("computed", cid, lambda: _fetch_computed_properties(cid))
+        except Exception as e:
+            computed = e
+
+    # Copy so callers can never mutate the cached entry
+    props = dict(basic)
+
+    if isinstance(description, Exception):
+        logger.warning("Error fetching description for CID %s: %s", cid, description)
+    elif description is not None:
+        props["Description"] = description
+
+    if isinstance(computed, Exception):
+        logger.warning("Error fetching computed properties for CID %s: %s", cid, computed)
+    else:
+        props.update(computed)
+
+    log_payload(logger, "PubChem properties", props)
+    return props
+
+
+async def fetch_pubchem_synonym(cid: str):
+    # Like the description and computed properties, a failed synonym lookup
+    # does not fail the prediction
+    try:
+        return await cached("synonym", cid, lambda: _fetch_synonym(cid))
+    except (UpstreamError, asyncio.TimeoutError, httpx.HTTPError) as e:
+        logger.warning("Error fetching synonym for CID %s: %r", cid, e)
+        return "No description available"
+
+
+class _PartialReport(Exception):
+    # A report missing sections because of upstream failures; returned as is
+    # but not cached, so the next request tries the missing lookups again
+    def __init__(self, report):
+        super().__init__(report)
+        self.report = report
+
+
+async def _build_genome_report(cid):
+    # Fetch bioassay data, protein targets and pathways from PubChem concurrently
+    assays, targets, pathways = await asyncio.gather(
+        cached("assays", cid, lambda: _fetch_genetic_assays(cid)),
+        cached("targets", cid, lambda: _fetch_protein_targets(cid)),
+        cached("pathways", cid, lambda: _fetch_pathways(cid)),
+        return_exceptions=True,
+    )
+    for result in (assays, targets, pathways):
+        if isinstance(result, Exception) and not isinstance(result, UpstreamError):
+            raise result
+    if isinstance(assays, UpstreamError):
+        raise _PartialReport("No genomic data available for this compound")
+    if assays is None:
+        return "No genomic data available for this compound"
+
+    report_sections = []
+
+    # Process bioassay data
+    if assays:
+        report_sections.append("Genetic Interaction Summary:")
+        for assay in assays:
+            report_sections.append(f"- {assay['TargetName']}: {assay['BioActivitySummary']}")
+
+    # Process protein targets
+    if targets is not None and not isinstance(targets, UpstreamError):
+        report_sections.append("\nProtein Interactions:")
+        for target in targets:
+            report_sections.append(f"- {target['ProteinName']}: {target['InteractionType']}")
+
+    # Add genetic pathway analysis
+    if pathways is not None and not isinstance(pathways, UpstreamError):
+        report_sections.append("\nGenetic Pathways:")
+        for pathway in pathways:
+            report_sections.append(f"- {pathway}")
+
+    # Compile final report
+    if report_sections:
+        report = "\n".join(report_sections)
+    else:
+        report = "significant genetic interactions found. This compound have direct genomic effects."
+    if isinstance(targets, UpstreamError) or isinstance(pathways, UpstreamError):
+        raise _PartialReport(report)
+    return report
+
+
+async def get_genome_report(cid: str):
+    try:
+        return await genome_report_cache.get_or_fetch(f"genome:{cid}", lambda: _build_genome_report(cid))
+    except _PartialReport as e:
+        return e.report
+    except Exception as e:
+        logger.warning("Error generating genome report for CID %s: %s", cid, e)
+        return "Unable to generate genomic analysis. Please try again later."
+
+
+def has_complete_genome_report(cid: str):
+    # Only complete reports are cached, so this tells a report from the
+    # fallback messages returned when its lookups failed
+    return genome_report_cache.contains(f"genome:{cid}")
+
+
+async def fetch_compound_data(cid: str, genome_report=True):
+    # All seven PubChem lookups for a CID run concurrently; the properties
+    # lookup is the only one whose failure fails the whole prediction. With
+    # genome_report=False the three genome lookups are left to the caller.
+    if not genome_report:
+        props, synonym = await asyncio.gather(fetch_pubchem_properties(cid), fetch_pubchem_synonym(cid))
+        return props, synonym, None
+    return await asyncio.gather(
+        fetch_pubchem_properties(cid),
+        fetch_pubchem_synonym(cid),
+        get_genome_report(cid),
+    )
+
+
+async def _query_properties(cids):
+    # One multi-CID query for basic and computed properties; returns
+    # {cid: (basic, computed)} for the CIDs PubChem knows
+    url = f"{PUBCHEM_COMPOUND_URL}/property/{BASIC_PROPERTIES},{COMPUTED_PROPERTIES}/JSON"
+    data = {"cid": ",".join(cids)}
+    r = await pubchem_policy.call(lambda: post(url, data, name="properties_batch"), url)
+    if r.status_code == 404:
+        return {}
+    if r.status_code != 200:
+        raise UpstreamError(r.status_code, url)
+    basic_keys = ["CID"] + BASIC_PROPERTIES.split(",")
+    computed_keys = ["CID"] + COMPUTED_PROPERTIES.split(",")
+    return {
+        str(row["CID"]): ({k: row[k] for k in basic_keys if k in row}, {k: row[k] for k in computed_keys if k in row})
+        for row in r.json()["PropertyTable"]["Properties"]
+    }
+
+
+class _PropertyCoalescer:
+    # Collects the CIDs of concurrent property lookups for a short window and
+    # answers them all with one multi-CID query, so bursts of requests cost
+    # one call against the rate limit instead of one per compound
+    def __init__(self):
+        self.pending = {}
+        self.timer = None
+
+    def get(self, cid):
+        future = self.pending.get(cid)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[cid] = future
+            if len(self.pending) >= PUBCHEM_BATCH_CHUNK:
+                self._flush()
+            elif self.timer is None:
+                self.timer = asyncio.get_running_loop().call_later(PUBCHEM_COALESCE_WINDOW, self._flush)
+        return future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            asyncio.ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch):
+        try:
+            rows = await _query_properties(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for cid, future in batch.items():
+            if future.done():
+                continue
+            if cid in rows:
+                future.set_result(rows[cid])
+            elif len(batch) == 1:
+                future.set_result(None)
+            else:
+                # Not in the combined answer: look it up on its own, so one
+                # unknown CID cannot fail the others
+                asyncio.ensure_future(self._resolve_single(cid, future))
+
+    async def _resolve_single(self, cid, future):
+        try:
+            future.set_result((await _get_basic_properties(cid), None))
+        except Exception as e:
+            future.set_exception(e)
+
+
+_property_coalescer = _PropertyCoalescer()
+
+
+async def _prime_properties_chunk(cids):
+    # The multi-CID answer is split into the same cache entries that the
+    # per-CID lookups read, so the per-compound path finds them cached
+    for cid, (basic, computed) in (await _query_properties(cids)).items():
+        await pubchem_cache.set(f"properties:{cid}", basic)
+        await pubchem_cache.set(f"computed:{cid}", computed)
+
+
+async def prefetch_properties(cids):
+    # Warm the properties cache for many CIDs with chunked multi-CID queries.
+    # A failed chunk is only logged: its compounds fall back to per-CID lookups.
+    from property_store import get_local_store
+
+    store = get_local_store()
+    missing = [cid for cid in dict.fromkeys(cids)
+               if cid.isdigit() and not pubchem_cache.contains(f"properties:{cid}") and (store is None or store.find(cid) is None)]
+    chunks = [missing[i:i + PUBCHEM_BATCH_CHUNK] for i in range(0, len(missing), PUBCHEM_BATCH_CHUNK)]
+    results = await asyncio.gather(*(_prime_properties_chunk(chunk) for chunk in chunks), return_exceptions=True)
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception):
+            logger.warning("Error prefetching properties for %d CIDs: %s", len(chunk), result)
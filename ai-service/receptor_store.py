@@ -0,0 +1,186 @@
+# Persistent RCSB receptor store.
+#
+# Receptor entry JSON (and optionally the mmCIF coordinate file) is cached on
+# disk keyed by PDB ID and revalidated with conditional requests once it is
+# older than RECEPTOR_MAX_AGE. Prefetch a target panel ahead of time with:
+#
+#   python receptor_store.py prefetch 1HSG 3PBL 6LU7
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from email.utils import formatdate
+
+from cache import TieredCache
+from http_client import UpstreamError, close_client, fetch
+from resilience import UpstreamPolicy
+
+RCSB_DATA_URL = os.getenv("RCSB_DATA_URL", "https://data.rcsb.org").rstrip("/")
+RCSB_ENTRY_URL = f"{RCSB_DATA_URL}/rest/v1/core/entry"
+RCSB_FILES_URL = os.getenv("RCSB_FILES_URL", "https://files.rcsb.org/download").rstrip("/")
+RECEPTOR_CACHE_DIR = os.getenv("RECEPTOR_CACHE_DIR", os.path.join("cache", "receptors"))
+RECEPTOR_MAX_AGE = float(os.getenv("RECEPTOR_MAX_AGE", str(24 * 3600)))
+RECEPTOR_FETCH_COORDINATES = os.getenv("RECEPTOR_FETCH_COORDINATES", "0") == "1"
+RECEPTOR_PREFETCH = [pdb_id for pdb_id in os.getenv("RECEPTOR_PREFETCH", "").replace(" ", "").split(",") if pdb_id]
+
+# Classic 4-character IDs as well as extended "pdb_0000xxxx" IDs; also keeps
+# the ID safe to use as a file name
+PDB_ID = re.compile(r"^(?:[0-9][A-Za-z0-9]{3}|pdb_[0-9]{4}[A-Za-z0-9]{4})$", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+# Retries and circuit breaking for RCSB; it publishes no per-client rate limit
+rcsb_policy = UpstreamPolicy("rcsb")
+
+# Entries recently served from disk or RCSB are kept in memory as well, and
+# concurrent requests for the same receptor share one load
+receptor_cache = TieredCache(maxsize=int(os.getenv("RECEPTOR_MEMORY_CACHE_SIZE", "256")), ttl=RECEPTOR_MAX_AGE)
+
+
+def normalize_pdb_id(pdb_id):
+    pdb_id = str(pdb_id).strip()
+    if not PDB_ID.match(pdb_id):
+        raise ValueError(f"Invalid PDB ID '{pdb_id}'")
+    return pdb_id.upper()
+
+
+def _path(pdb_id, suffix):
+    return os.path.join(RECEPTOR_CACHE_DIR, f"{pdb_id}.{suffix}")
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _load_from_disk(pdb_id):
+    meta = _read_json(_path(pdb_id, "meta.json"))
+    entry = _read_json(_path(pdb_id, "json")) if meta is not None else None
+    return entry, meta
+
+
+def _save_to_disk(pdb_id, entry, meta):
+    _write_atomic(_path(pdb_id, "json"), json.dumps(entry).encode("utf-8"))
+    _write_atomic(_path(pdb_id, "meta.json"), json.dumps(meta).encode("utf-8"))
+
+
+def _save_meta(pdb_id, meta):
+    _write_atomic(_path(pdb_id, "meta.json"), json.dumps(meta).encode("utf-8"))
+
+
+async def _fetch_coordinates(pdb_id):
+    path = _path(pdb_id, "cif")
+    if os.path.exists(path):
+        return
+    try:
+        url = f"{RCSB_FILES_URL}/{pdb_id}.cif"
+        r = await rcsb_policy.call(lambda: fetch(url, name="rcsb_coordinates"), url)
+        if r.status_code == 200:
+            await asyncio.to_thread(_write_atomic, path, r.content)
+    except Exception as e:
+        logger.warning("Error fetching coordinates for %s: %s", pdb_id, e)
+
+
+async def _load_receptor(pdb_id):
+    entry, meta = await asyncio.to_thread(_load_from_disk, pdb_id)
+    if entry is not None and time.time() - meta.get("fetched_at", 0) < RECEPTOR_MAX_AGE:
+        return entry
+
+    # Missing or stale: (re)validate against RCSB, sending the validators of
+    # the stored copy so an unchanged entry costs a 304 with no body
+    headers = {}
+    if entry is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        elif meta.get("fetched_at"):
+            headers["If-Modified-Since"] = formatdate(meta["fetched_at"], usegmt=True)
+    try:
+        url = f"{RCSB_ENTRY_URL}/{pdb_id}"
+        r = await rcsb_policy.call(lambda: fetch(url, headers=headers, name="rcsb_entry"), url)
+    except Exception as e:
+        if entry is not None:
+            logger.warning("Error revalidating receptor %s, serving stored copy: %s", pdb_id, e)
+            return entry
+        raise
+
+    if r.status_code == 304 and entry is not None:
+        meta["fetched_at"] = time.time()
+        await asyncio.to_thread(_save_meta, pdb_id, meta)
+        return entry
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        if entry is not None:
+            return entry
+        raise UpstreamError(r.status_code, f"{RCSB_ENTRY_URL}/{pdb_id}")
+
+    entry = r.json()
+    meta = {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }
+    await asyncio.to_thread(_save_to_disk, pdb_id, entry, meta)
+    if RECEPTOR_FETCH_COORDINATES:
+        await _fetch_coordinates(pdb_id)
+    return entry
+
+
+async def get_receptor_info(pdb_id):
+    # RCSB entry JSON for a PDB ID, or None when it does not exist
+    pdb_id = normalize_pdb_id(pdb_id)
+    return await receptor_cache.get_or_fetch(pdb_id, lambda: _load_receptor(pdb_id))
+
+
+async def prefetch_receptors(pdb_ids):
+    # Warm the store for a target panel; failures are logged and skipped
+    loaded = 0
+    for pdb_id in pdb_ids:
+        try:
+            if await get_receptor_info(pdb_id) is not None:
+                loaded += 1
+        except Exception as e:
+            logger.warning("Error prefetching receptor %s: %s", pdb_id, e)
+    logger.info("Prefetched %d/%d receptors", loaded, len(pdb_ids))
+    return loaded
+
+
+async def _prefetch_command(pdb_ids):
+    try:
+        return await prefetch_receptors(pdb_ids)
+    finally:
+        await close_client()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local RCSB receptor store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prefetch = commands.add_parser("prefetch", help="Fetch and store receptor entries")
+    prefetch.add_argument("pdb_ids", nargs="*", help="PDB IDs (defaults to RECEPTOR_PREFETCH)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    pdb_ids = args.pdb_ids or RECEPTOR_PREFETCH
+    loaded = asyncio.run(_prefetch_command(pdb_ids))
+    return 0 if loaded == len(pdb_ids) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
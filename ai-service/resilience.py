@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from http_client import UpstreamError
+from telemetry import Counter, span
+
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.25"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "4"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Answers that mean "slow down / try again shortly"
+RETRY_STATUSES = (429, 503)
+
+UPSTREAM_RETRIES = Counter("ai_service_upstream_retries_total", "Upstream calls retried, by upstream and reason", ("upstream", "reason"))
+CIRCUIT_OPENED = Counter("ai_service_circuit_opened_total", "Times an upstream circuit breaker opened", ("upstream",))
+CIRCUIT_REJECTED = Counter("ai_service_circuit_rejected_total", "Upstream calls rejected by an open circuit breaker", ("upstream",))
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(UpstreamError):
+    # Raised without calling the upstream while its circuit breaker is open
+    def __init__(self, upstream, url):
+        super().__init__(503, url)
+        self.args = (f"{upstream} circuit breaker is open, not calling {url}",)
+
+
+class TokenBucket:
+    # Client-side rate limiter: at most `rate` calls per second on average,
+    # with bursts of up to `burst`. Waiters are served in arrival order.
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        # Spend the next `seconds` worth of tokens, e.g. after a 429, so every
+        # caller backs off rather than only the one that was throttled
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures; after `reset_timeout`
+    # one trial call is let through, and its outcome closes or re-opens it
+    def __init__(self, name, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or (self.opened_at is None and self.failures >= self.threshold):
+            if self.opened_at is None:
+                logger.warning("%s circuit breaker opened after %d failures", self.name, self.failures)
+                CIRCUIT_OPENED.inc(upstream=self.name)
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+
+def retry_after(response):
+    # Seconds requested by a Retry-After header (delta-seconds or HTTP date)
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamPolicy:
+    # Rate limiting, retries with jittered exponential backoff on 429/503 and
+    # transport errors, and a circuit breaker, shared by every call site of
+    # one upstream service
+    def __init__(self, name, rate=0.0, burst=1, max_retries=UPSTREAM_MAX_RETRIES,
+                 backoff_base=UPSTREAM_BACKOFF_BASE, backoff_max=UPSTREAM_BACKOFF_MAX):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _backoff(self, attempt):
+        # "Full jitter": uniform over [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def call(self, send, url):
+        # send is an async callable issuing the request; returns the final
+        # response, which may still be an error status once retries run out
+        trial = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            CIRCUIT_REJECTED.inc(upstream=self.name)
+            raise CircuitOpenError(self.name, url)
+        try:
+            return await self._attempts(send)
+        finally:
+            # A cancelled trial call must not leave the breaker waiting forever
+            if trial:
+                self.breaker.trial_running = False
+
+    async def _attempts(self, send):
+        attempt = 0
+        while True:
+            with span(f"ratelimit.{self.name}"):
+                await self.bucket.acquire()
+            try:
+                r = await send()
+            except (asyncio.TimeoutError, httpx.HTTPError):
+                if attempt >= self.max_retries:
+                    self.breaker.record_failure()
+                    raise
+                reason, delay = "error", self._backoff(attempt)
+            else:
+                if r.status_code not in RETRY_STATUSES:
+                    if r.status_code >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    return r
+                requested = retry_after(r)
+                if r.status_code == 429:
+                    self.bucket.pause(requested if requested is not None else self._backoff(attempt))
+                # Give up rather than hold the request when the upstream asks
+                # for a longer pause than we are willing to wait
+                if attempt >= self.max_retries or (requested is not None and requested > self.backoff_max):
+                    self.breaker.record_failure()
+                    return r
+                reason, delay = str(r.status_code), max(requested or 0.0, self._backoff(attempt))
+            UPSTREAM_RETRIES.inc(upstream=self.name, reason=reason)
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,312 @@
+# Persistent store of complete /predict responses, keyed by CID and scoring
+# model version.
+#
+# With RESULT_STORE_PATH set, /predict serves stored responses directly and
+# stores the complete responses it computes. Fill it offline for a CID list
+# (one CID per line) with
+#
+#   python result_store.py precompute data/results.sqlite cids.txt --processes 8
+#   python result_store.py top data/results.sqlite --sort effectiveness --toxicity Low -n 20
+#
+# Each worker process fetches and scores its own chunks of CIDs, with the
+# PubChem rate limit split between the processes. Score columns are stored
+# next to the response and indexed per model version (and per toxicity and
+# drug-likeness class), so ranking queries read the top rows of an index
+# instead of scanning and sorting the table.
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing.util
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from cache import SQLITE_MMAP_SIZE
+from telemetry import Counter
+
+# Seconds a stored response is served for; responses embed upstream data
+# (names, genome reports) that the PubChem caches also expire. 0 keeps them.
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", str(7 * 24 * 3600)))
+RESULT_STORE_LOOKUPS = Counter("ai_service_result_store_lookups_total", "Result store lookups by /predict, by result", ("result",))
+
+logger = logging.getLogger(__name__)
+
+# Columns results can be ranked by, and the categorical ones they can be
+# filtered on
+SORT_COLUMNS = ("effectiveness", "binding_affinity", "molecular_weight", "xlogp")
+TOXICITY_CLASSES = ("Low", "Medium", "High")
+DRUG_LIKENESS_CLASSES = ("Excellent", "Good", "Moderate", "Poor")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    cid TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    response TEXT NOT NULL,
+    iupac_name TEXT,
+    binding_affinity REAL,
+    toxicity TEXT,
+    drug_likeness TEXT,
+    effectiveness REAL,
+    molecular_weight REAL,
+    xlogp REAL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (cid, model_version)
+);
+""" + "".join(
+    f"CREATE INDEX IF NOT EXISTS results_{column} ON results (model_version, {column});\n"
+    f"CREATE INDEX IF NOT EXISTS results_toxicity_{column} ON results (model_version, toxicity, {column});\n"
+    f"CREATE INDEX IF NOT EXISTS results_drug_likeness_{column} ON results (model_version, drug_likeness, {column});\n"
+    for column in SORT_COLUMNS
+)
+_SUMMARY_COLUMNS = ("cid", "iupac_name", "binding_affinity", "toxicity", "drug_likeness", "effectiveness", "molecular_weight", "xlogp")
+
+
+def _number(value):
+    # Score columns from a response: "24.64%" -> 24.64, "N/A" -> None
+    if isinstance(value, str):
+        value = value.rstrip("%")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _label(value):
+    return value if isinstance(value, str) and value != "N/A" else None
+
+
+def result_row(cid, model_version, response):
+    return (
+        str(cid), model_version, json.dumps(response), _label(response.get("iupac_name")),
+        _number(response.get("binding_affinity")), _label(response.get("toxicity")), _label(response.get("drug_likeness")),
+        _number(response.get("effectiveness")), _number(response.get("molecular_weight")), _number(response.get("xlogp")),
+        time.time(),
+    )
+
+
+class ResultStore:
+    # SQLite table of responses; the connection is opened lazily and every
+    # method is blocking (the service calls them through asyncio.to_thread)
+    def __init__(self, path, max_age=RESULT_STORE_TTL):
+        self.path = path
+        self.max_age = max_age
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get(self, cid, model_version):
+        # A response computed more than max_age seconds ago counts as missing,
+        # so /predict computes and stores it again
+        oldest = time.time() - self.max_age if self.max_age else 0
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT response FROM results WHERE cid = ? AND model_version = ? AND computed_at >= ?",
+                (str(cid), model_version, oldest)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_many(self, model_version, responses):
+        # responses: iterable of (cid, response)
+        rows = [result_row(cid, model_version, response) for cid, response in responses]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+        return len(rows)
+
+    def put(self, cid, model_version, response):
+        self.put_many(model_version, [(cid, response)])
+
+    def top(self, model_version, sort="effectiveness", descending=True, limit=20, toxicity=None, drug_likeness=None,
+            minimum=None, maximum=None):
+        # Stored compounds ordered by a score column, optionally filtered by
+        # toxicity / drug-likeness class and a range of the sort column.
+        # Rows without a value for the sort column are left out. Each class
+        # filter has its own index; with both, SQLite reads one and checks the
+        # other on the rows it visits. Ranking includes responses older than
+        # max_age, whose scores only change with the model version.
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        conditions = ["model_version = ?", f"{sort} IS NOT NULL"]
+        params = [model_version]
+        for column, value in (("toxicity", toxicity), ("drug_likeness", drug_likeness)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if minimum is not None:
+            conditions.append(f"{sort} >= ?")
+            params.append(minimum)
+        if maximum is not None:
+            conditions.append(f"{sort} <= ?")
+            params.append(maximum)
+        query = (f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM results WHERE {' AND '.join(conditions)} "
+                 f"ORDER BY {sort} {'DESC' if descending else 'ASC'} LIMIT ?")
+        with self._lock:
+            rows = self._connect().execute(query, (*params, limit)).fetchall()
+        return [dict(zip(_SUMMARY_COLUMNS, row)) for row in rows]
+
+    def count(self, model_version=None):
+        with self._lock:
+            if model_version is None:
+                return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return self._connect().execute("SELECT COUNT(*) FROM results WHERE model_version = ?", (model_version,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_store = None
+
+
+def get_result_store():
+    # The store configured with RESULT_STORE_PATH, or None when unset
+    global _store
+    path = os.getenv("RESULT_STORE_PATH")
+    if _store is None and path:
+        _store = ResultStore(path)
+    return _store
+
+
+# Precompute workers: each process runs its own event loop over its chunks
+_loop = None
+_worker_store = None
+
+
+def _init_worker(processes, path):
+    global _loop, _worker_store
+    # Split PubChem's client-side rate limit between the processes; this has
+    # to happen before pubchem is first imported in this process
+    rate = float(os.getenv("PUBCHEM_RATE_LIMIT", "5"))
+    burst = int(os.getenv("PUBCHEM_RATE_BURST", "5"))
+    os.environ["PUBCHEM_RATE_LIMIT"] = str(rate / processes)
+    os.environ["PUBCHEM_RATE_BURST"] = str(max(1, burst // processes))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _worker_store = ResultStore(path)
+    # The HTTP client, loop and store last for the worker's lifetime, so
+    # keep-alive connections carry over between chunks
+    multiprocessing.util.Finalize(None, _close_worker, exitpriority=0)
+
+
+def _close_worker():
+    from http_client import close_client
+
+    _loop.run_until_complete(close_client())
+    _loop.close()
+    _worker_store.close()
+
+
+async def _predict_chunk(cids, concurrency):
+    # Same fetch, score and build steps as /predict/batch
+    from models import get_scoring_model, model_version
+    from predictions import build_prediction
+    from pubchem import fetch_compound_data, has_complete_genome_report, prefetch_properties
+    from scoring import PropertyRecord, score_batch
+
+    await prefetch_properties(cids)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(cid):
+        async with semaphore:
+            return await fetch_compound_data(cid)
+
+    fetched = await asyncio.gather(*(fetch(cid) for cid in cids), return_exceptions=True)
+    ok = []
+    for cid, data in zip(cids, fetched):
+        if isinstance(data, BaseException):
+            logger.warning("Precompute failed for CID %s: %s", cid, getattr(data, "detail", data))
+        elif not has_complete_genome_report(cid):
+            logger.warning("Precompute failed for CID %s: incomplete genome report", cid)
+        else:
+            props, description, report = data
+            ok.append((cid, (PropertyRecord(props), description, report)))
+    model = get_scoring_model()
+    version = model_version(model)
+    scores = score_batch([data[0] for _, data in ok], model)
+    responses = [(cid, build_prediction(cid, record, description, report, score, model))
+                 for (cid, (record, description, report)), score in zip(ok, scores)]
+    stored = await asyncio.to_thread(_worker_store.put_many, version, responses)
+    return stored, len(cids) - stored
+
+
+def _precompute_chunk(args):
+    return _loop.run_until_complete(_predict_chunk(*args))
+
+
+def precompute(cids, path, processes=None, chunk_size=100, concurrency=8):
+    processes = processes or os.cpu_count() or 1
+    chunks = [(cids[i:i + chunk_size], concurrency) for i in range(0, len(cids), chunk_size)]
+    # Create the schema here rather than in several workers at once
+    ResultStore(path).count()
+    stored = failed = 0
+    started = time.time()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes, initializer=_init_worker, initargs=(processes, path)) as pool:
+        for chunk_stored, chunk_failed in pool.imap_unordered(_precompute_chunk, chunks):
+            stored += chunk_stored
+            failed += chunk_failed
+            print(f"{stored + failed}/{len(cids)} compounds, {failed} failed, {time.time() - started:.1f}s", flush=True)
+        # Let the workers exit on their own, closing their clients, rather
+        # than be terminated when the pool is left
+        pool.close()
+        pool.join()
+    return stored, failed
+
+
+def read_cids(path):
+    with open(path) as f:
+        cids = [line.split(",")[0].strip() for line in f]
+    # Keep the first occurrence of each CID, skipping blanks and a header
+    return list(dict.fromkeys(cid for cid in cids if cid.isdigit()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute and query stored /predict responses")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pre = commands.add_parser("precompute", help="Compute and store responses for a file of CIDs")
+    pre.add_argument("store")
+    pre.add_argument("cids_path")
+    pre.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    pre.add_argument("--chunk", type=int, default=100, help="CIDs per work item")
+    pre.add_argument("--concurrency", type=int, default=8, help="Compounds fetched at once per process")
+    top = commands.add_parser("top", help="Print the top stored compounds")
+    top.add_argument("store")
+    top.add_argument("--model-version", default="heuristic")
+    top.add_argument("--sort", choices=SORT_COLUMNS, default="effectiveness")
+    top.add_argument("--ascending", action="store_true")
+    top.add_argument("--toxicity", choices=TOXICITY_CLASSES)
+    top.add_argument("--drug-likeness", choices=DRUG_LIKENESS_CLASSES)
+    top.add_argument("-n", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == "precompute":
+        logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        cids = read_cids(args.cids_path)
+        stored, failed = precompute(cids, args.store, args.processes, args.chunk, args.concurrency)
+        print(f"Stored {stored} responses in {args.store} ({failed} failed)")
+    else:
+        store = ResultStore(args.store)
+        for row in store.top(args.model_version, args.sort, not args.ascending, args.n, args.toxicity, args.drug_likeness):
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
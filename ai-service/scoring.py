@@ -0,0 +1,363 @@
+import logging
+import math
+import re
+
+import numpy as np
+
+from telemetry import span
+
+# Column order of the property matrix used by the scoring engine
+SCORING_COLUMNS = ("MolecularWeight", "XLogP", "HBondAcceptorCount", "HBondDonorCount", "RotatableBondCount", "Complexity")
+INTEGER_COLUMNS = ("HBondAcceptorCount", "HBondDonorCount", "RotatableBondCount")
+MW, LOGP, HBA, HBD, ROT, COMPLEXITY = range(len(SCORING_COLUMNS))
+
+# Columns each score depends on; an unparseable value in any of them makes
+# that score fail for the row, exactly like the original per-field conversions
+BINDING_COLUMNS = [MW, LOGP, HBA, HBD, COMPLEXITY]
+TOXICITY_COLUMNS = [MW, LOGP, ROT, COMPLEXITY]
+LIKENESS_COLUMNS = [MW, LOGP, HBA, HBD, ROT]
+EFFECTIVENESS_COLUMNS = [MW, LOGP, HBA, HBD, COMPLEXITY]
+# The same column sets as bit masks over a PropertyRecord's flags
+BINDING_MASK, TOXICITY_MASK, LIKENESS_MASK, EFFECTIVENESS_MASK = (
+    sum(1 << column for column in columns) for columns in (BINDING_COLUMNS, TOXICITY_COLUMNS, LIKENESS_COLUMNS, EFFECTIVENESS_COLUMNS)
+)
+
+# PubChem properties a prediction reads, and the PropertyRecord attribute
+# each is kept in; the scoring columns come first, in SCORING_COLUMNS order
+RECORD_FIELDS = (
+    ("MolecularWeight", "molecular_weight"), ("XLogP", "xlogp"), ("HBondAcceptorCount", "h_bond_acceptor_count"),
+    ("HBondDonorCount", "h_bond_donor_count"), ("RotatableBondCount", "rotatable_bond_count"), ("Complexity", "complexity"),
+    ("MolecularFormula", "molecular_formula"), ("IUPACName", "iupac_name"), ("InChIKey", "inchikey"),
+)
+# The drug-likeness rules (Lipinski's Rule of 5 and at most 10 rotatable
+# bonds) as inclusive (low, high) property ranges, for range queries over
+# the local property store
+DRUG_LIKENESS_RANGES = {
+    "MolecularWeight": (None, 500), "XLogP": (-0.4, 5.6), "HBondAcceptorCount": (None, 10),
+    "HBondDonorCount": (None, 5), "RotatableBondCount": (None, 10),
+}
+_INTEGER = tuple(key in INTEGER_COLUMNS for key in SCORING_COLUMNS)
+_MISSING = (None, "", "N/A")
+_DIGIT = re.compile(r"\d")
+
+logger = logging.getLogger(__name__)
+
+
+def _property(props, key):
+    # A property as safe_get returns it, with None for missing: empty
+    # strings and "N/A" are missing, numeric strings become floats
+    try:
+        value = props.get(key)
+        if value in _MISSING:
+            return None
+        if isinstance(value, str) and _DIGIT.search(value):
+            try:
+                return float(value)
+            except ValueError:
+                pass
+        return value
+    except Exception as e:
+        logger.warning("Error getting property %s: %s", key, e)
+        return None
+
+
+def safe_get(props, key, default="N/A"):
+    value = _property(props, key)
+    return default if value is None else value
+
+
+def _score_value(value, integer):
+    # The conversion the scalar scorers always applied: missing values become
+    # 0, counts are truncated with int(). Unparseable values are NaN.
+    if value is None:
+        return 0.0
+    try:
+        return float(int(value)) if integer else float(value)
+    except Exception:
+        return math.nan
+
+
+class PropertyRecord:
+    # One compound's PubChem properties, parsed once for scoring and for the
+    # response: the RECORD_FIELDS attributes hold the values safe_get would
+    # return (None when missing), values the scoring columns as floats, and
+    # missing / invalid are bit flags (1 << column) of the scoring columns
+    # that were absent or unparseable
+    __slots__ = tuple(name for _, name in RECORD_FIELDS) + ("values", "missing", "invalid")
+
+    def __init__(self, props):
+        fields = [_property(props, key) for key, _ in RECORD_FIELDS]
+        (self.molecular_weight, self.xlogp, self.h_bond_acceptor_count, self.h_bond_donor_count, self.rotatable_bond_count,
+         self.complexity, self.molecular_formula, self.iupac_name, self.inchikey) = fields
+        values = []
+        missing = invalid = 0
+        for column, integer in enumerate(_INTEGER):
+            value = fields[column]
+            if value is None:
+                missing |= 1 << column
+                values.append(0.0)
+                continue
+            number = _score_value(value, integer)
+            if number != number:
+                invalid |= 1 << column
+            values.append(number)
+        self.values = tuple(values)
+        self.missing = missing
+        self.invalid = invalid
+
+    def get(self, name, default="N/A"):
+        value = getattr(self, name)
+        return default if value is None else value
+
+
+def as_records(data):
+    # PropertyRecords from PubChem property dicts, parsing only those that
+    # are not records already
+    return [props if isinstance(props, PropertyRecord) else PropertyRecord(props) for props in data]
+
+
+def property_matrix(data):
+    # Build the N x k float matrix from a list of PropertyRecords or PubChem
+    # property dicts, a pandas DataFrame with PubChem column names, or an
+    # existing array. Missing values are 0 and unparseable values are NaN.
+    if isinstance(data, (dict, PropertyRecord)):
+        data = [data]
+    if hasattr(data, "columns"):
+        matrix = np.zeros((len(data), len(SCORING_COLUMNS)))
+        for j, key in enumerate(SCORING_COLUMNS):
+            if key not in data.columns:
+                continue
+            column = data[key]
+            if column.dtype.kind in "biuf":
+                # pandas marks missing values with NaN, which here means "missing"
+                values = np.nan_to_num(column.to_numpy(dtype=float), nan=0.0)
+                matrix[:, j] = np.trunc(values) if key in INTEGER_COLUMNS else values
+            else:
+                matrix[:, j] = [_score_value(_property({key: v}, key), key in INTEGER_COLUMNS) for v in column.tolist()]
+        return matrix
+    if isinstance(data, np.ndarray):
+        return np.asarray(data, dtype=float).reshape(-1, len(SCORING_COLUMNS))
+    # One float64 row per record, built straight from the parsed values
+    return np.array([record.values for record in as_records(data)], dtype=float).reshape(-1, len(SCORING_COLUMNS))
+
+
+class _ArrayOps:
+    # The operations the score formulas need, over numpy columns
+    minimum = staticmethod(np.minimum)
+    abs = staticmethod(np.abs)
+    where = staticmethod(np.where)
+
+    @staticmethod
+    def divide(a, b):
+        # a / b, and NaN where b is 0
+        return np.where(b == 0, np.nan, a / b)
+
+
+class _ScalarOps:
+    # The same operations over the Python floats of a single record; each
+    # gives the float its numpy counterpart gives for that element
+    minimum = min
+    abs = abs
+
+    @staticmethod
+    def where(condition, a, b):
+        return a if condition else b
+
+    @staticmethod
+    def divide(a, b):
+        return a / b if b else math.nan
+
+
+def _score_columns(mw, logp, hba, hbd, rot, complexity, ops):
+    # The heuristic scores, written once for both engines: score_matrix
+    # passes numpy columns with _ArrayOps, score_record one record's floats
+    # with _ScalarOps. Booleans are turned into counts with * 1, since numpy
+    # adds boolean arrays as a logical or.
+    mw_score = ops.minimum(mw / 1000, 1)
+    logp_score = ops.minimum(ops.abs(logp) / 5, 1)
+    hba_score = ops.minimum(hba / 10, 1)
+    hbd_score = ops.minimum(hbd / 5, 1)
+    rot_score = ops.minimum(rot / 10, 1)
+    complexity_score = ops.minimum(complexity / 1000, 1)
+
+    has_mw = mw_score != 0
+    has_logp = logp_score != 0
+    has_hba = hba_score != 0
+    has_hbd = hbd_score != 0
+    has_rot = rot_score != 0
+    has_complexity = complexity_score != 0
+
+    with span("scoring.binding_affinity"):
+        # Scores are averaged over the properties that are available
+        binding_weight = has_mw * 1 + has_logp + has_hba + has_hbd + has_complexity
+        binding = ops.divide(mw_score + logp_score + hba_score + hbd_score + complexity_score, binding_weight) * 100
+
+    with span("scoring.toxicity"):
+        toxicity_weight = has_mw * 1 + has_logp + has_rot + has_complexity
+        toxicity = ops.divide(logp_score * 0.4 + rot_score * 0.3 + mw_score * 0.2 + complexity_score * 0.1, toxicity_weight) * 100
+
+    with span("scoring.drug_likeness"):
+        # Lipinski's Rule of 5 and additional criteria; molecular weight only
+        # counts as a rule when it is known
+        known_mw = mw != 0
+        total_rules = 4 + known_mw * 1
+        rules_passed = ((known_mw & (mw <= 500)) * 1 + ((-0.4 <= logp) & (logp <= 5.6))
+                        + (hba <= 10) + (hbd <= 5) + (rot <= 10))
+        likeness = rules_passed / total_rules * 100
+
+    with span("scoring.effectiveness"):
+        # Effectiveness weights are normalised over the available properties
+        w_mw = ops.where(has_mw, 0.25, 0.0)
+        w_logp = ops.where(has_logp, 0.25, 0.0)
+        w_hba = ops.where(has_hba, 0.2, 0.0)
+        w_hbd = ops.where(has_hbd, 0.2, 0.0)
+        w_complexity = ops.where(has_complexity, 0.1, 0.0)
+        total_weight = w_mw + w_logp + w_hba + w_hbd + w_complexity
+        effectiveness = (
+            mw_score * ops.divide(w_mw, total_weight) +
+            logp_score * ops.divide(w_logp, total_weight) +
+            hba_score * ops.divide(w_hba, total_weight) +
+            hbd_score * ops.divide(w_hbd, total_weight) +
+            complexity_score * ops.divide(w_complexity, total_weight)
+        ) * 100
+
+    return binding, toxicity, likeness, effectiveness
+
+
+def score_matrix(matrix, model=None):
+    # Compute binding affinity, toxicity, drug-likeness and effectiveness for
+    # every row in one vectorised pass. Returns raw scores (NaN where a score
+    # is not available) plus a per-score error mask. With a trained model
+    # (models.ScoringModel) the scores it predicts replace the heuristics.
+    matrix = np.asarray(matrix, dtype=float)
+    invalid = np.isnan(matrix)
+    values = np.where(invalid, 0.0, matrix)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        binding, toxicity, likeness, effectiveness = _score_columns(*values.T, ops=_ArrayOps)
+
+    if model is not None:
+        predicted = model.predict(matrix)
+        # Rows without enough data for the heuristic stay "N/A" rather than
+        # getting a prediction from all-missing features
+        if "binding_affinity" in predicted:
+            binding = np.where(np.isnan(binding), np.nan, predicted["binding_affinity"])
+        if "toxicity" in predicted:
+            toxicity = np.where(np.isnan(toxicity), np.nan, predicted["toxicity"])
+
+    return {
+        "binding_affinity": binding,
+        "binding_affinity_error": invalid[:, BINDING_COLUMNS].any(axis=1),
+        "toxicity": toxicity,
+        "toxicity_error": invalid[:, TOXICITY_COLUMNS].any(axis=1),
+        "drug_likeness": likeness,
+        "drug_likeness_error": invalid[:, LIKENESS_COLUMNS].any(axis=1),
+        "effectiveness": effectiveness,
+        "effectiveness_error": invalid[:, EFFECTIVENESS_COLUMNS].any(axis=1),
+    }
+
+
+def _error_display():
+    return {"score": None, "display": "N/A"}
+
+
+def format_binding_affinity(score, error):
+    if error:
+        return _error_display()
+    if math.isnan(score):
+        return "N/A"
+    return f"{float(score):.2f}%"
+
+
+def format_toxicity(score, error):
+    if error:
+        return _error_display()
+    if math.isnan(score):
+        return "N/A"
+    if score < 30:
+        return "Low"
+    elif score < 70:
+        return "Medium"
+    else:
+        return "High"
+
+
+def format_drug_likeness(score, error):
+    if error:
+        return _error_display()
+    if score >= 80:
+        return "Excellent"
+    elif score >= 60:
+        return "Good"
+    elif score >= 40:
+        return "Moderate"
+    else:
+        return "Poor"
+
+
+def format_effectiveness(score, error):
+    if error or math.isnan(score):
+        return None
+    return float(score)
+
+
+def format_scores(scores):
+    # Convert raw score columns into the display values /predict returns
+    return [
+        {
+            "binding_affinity": format_binding_affinity(scores["binding_affinity"][i], scores["binding_affinity_error"][i]),
+            "toxicity": format_toxicity(scores["toxicity"][i], scores["toxicity_error"][i]),
+            "drug_likeness": format_drug_likeness(scores["drug_likeness"][i], scores["drug_likeness_error"][i]),
+            "effectiveness": format_effectiveness(scores["effectiveness"][i], scores["effectiveness_error"][i]),
+        }
+        for i in range(len(scores["binding_affinity"]))
+    ]
+
+
+def score_batch(data, model=None):
+    return format_scores(score_matrix(property_matrix(data), model))
+
+
+def score_record(record, model=None):
+    # score_matrix for a single record: the same formulas over its Python
+    # floats, which for one row is far cheaper than numpy's per-call overhead
+    values = record.values
+    if record.invalid:
+        values = [0.0 if value != value else value for value in values]
+    binding, toxicity, likeness, effectiveness = _score_columns(*values, ops=_ScalarOps)
+
+    if model is not None:
+        predicted = model.predict(record.values)
+        if "binding_affinity" in predicted and not math.isnan(binding):
+            binding = float(predicted["binding_affinity"][0])
+        if "toxicity" in predicted and not math.isnan(toxicity):
+            toxicity = float(predicted["toxicity"][0])
+
+    invalid = record.invalid
+    return {
+        "binding_affinity": format_binding_affinity(binding, invalid & BINDING_MASK),
+        "toxicity": format_toxicity(toxicity, invalid & TOXICITY_MASK),
+        "drug_likeness": format_drug_likeness(likeness, invalid & LIKENESS_MASK),
+        "effectiveness": format_effectiveness(effectiveness, invalid & EFFECTIVENESS_MASK),
+    }
+
+
+def score_properties(props, model=None):
+    # Scalar entry point for one compound: a PropertyRecord, or a PubChem
+    # property dict parsed into one
+    return score_record(props if isinstance(props, PropertyRecord) else PropertyRecord(props), model)
+
+
+def predict_binding_affinity(props):
+    return score_properties(props)["binding_affinity"]
+
+
+def predict_toxicity(props):
+    return score_properties(props)["toxicity"]
+
+
+def calculate_drug_likeness(props):
+    return score_properties(props)["drug_likeness"]
+
+
+def calculate_effectiveness(props):
+    return score_properties(props)["effectiveness"]
@@ -0,0 +1,206 @@
+# Production entry point: a pre-forking multi-process server.
+#
+#   python serve.py --host 0.0.0.0 --port 8000 --workers 4
+#
+# The parent process imports the app and loads the scoring model, similarity
+# index and local property store once (the warm phase), binds the listening
+# socket and then forks the workers, which share those pages copy-on-write
+# instead of each loading its own copy. Every worker runs uvicorn with its own
+# event loop on the shared socket.
+#
+# Workers are replaced when they exit, and recycled after --max-requests
+# requests (plus a random jitter, so they do not all restart at once). SIGTERM
+# or SIGINT stops them gracefully; SIGHUP recycles them one at a time.
+#
+# Caches shared between workers live in files: the PubChem and genome report
+# caches get a SQLite tier under cache/ by default (read through a shared
+# memory map), and the in-memory PubChem cache is divided between the
+# workers, so adding workers adds neither memory nor cold misses. Receptors
+# are already stored on disk, and RESULT_STORE_PATH shares computed responses.
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger("serve")
+
+# A worker exiting sooner than this after starting is treated as a crash,
+# and the next one is started after a pause instead of immediately
+MIN_WORKER_LIFETIME = 1.0
+# Seconds a new worker gets to start up before the next one is recycled
+RECYCLE_SETTLE_TIME = 3.0
+
+
+def configure_shared_caches(workers):
+    # Must run before the app modules are imported, as they read these once
+    os.environ.setdefault("PUBCHEM_CACHE_PATH", os.path.join("cache", "pubchem.sqlite"))
+    os.environ.setdefault("GENOME_REPORT_CACHE_PATH", os.path.join("cache", "genome_reports.sqlite"))
+    os.environ.setdefault("PUBCHEM_CACHE_SIZE", str(max(256, 4096 // workers)))
+
+
+def warm():
+    # Import the app and load everything read-only that workers would
+    # otherwise each load on first use. Nothing here may start threads or
+    # open SQLite connections, which do not survive a fork.
+    started = time.perf_counter()
+    from main import app, warm_up
+    from telemetry import shutdown_logging
+
+    warm_up()
+    # The log writer thread is started again in each worker
+    shutdown_logging()
+    return app, time.perf_counter() - started
+
+
+def bind(host, port, backlog):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    def __init__(self, app, sock, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.workers = {}
+        self.recycle = []
+        self.stopping = False
+
+    def _run_worker(self, max_requests):
+        import uvicorn
+        from telemetry import setup_logging
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        setup_logging()
+        config = uvicorn.Config(
+            self.app, log_config=None, access_log=False, lifespan="on", backlog=self.args.backlog,
+            limit_max_requests=max_requests, timeout_graceful_shutdown=self.args.graceful_timeout,
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def spawn(self):
+        max_requests = None
+        if self.args.max_requests:
+            max_requests = self.args.max_requests + random.randint(0, self.args.max_requests_jitter)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(max_requests)
+            except BaseException:
+                logging.getLogger("serve").exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+        logger.info("Started worker %d", pid)
+
+    @staticmethod
+    def _kill(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.recycle = list(self.workers)
+        else:
+            self.stopping = True
+
+    def _reap(self):
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+            logger.info("Worker %d exited with code %s", pid, code)
+            if self.stopping:
+                continue
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            self.spawn()
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._on_signal)
+        for _ in range(self.args.workers):
+            self.spawn()
+        while not self.stopping:
+            self._reap()
+            # Recycle one worker at a time, once the previous one is replaced
+            # and its replacement has had time to start
+            if (self.recycle and len(self.workers) >= self.args.workers
+                    and time.monotonic() - max(self.workers.values()) >= RECYCLE_SETTLE_TIME):
+                pid = self.recycle.pop()
+                if pid in self.workers:
+                    self._kill(pid, signal.SIGTERM)
+            time.sleep(0.2)
+        self.shutdown()
+
+    def shutdown(self):
+        logger.info("Stopping %d workers", len(self.workers))
+        for pid in self.workers:
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            logger.warning("Killing worker %d", pid)
+            self._kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def default_workers():
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.getenv("WEB_CONCURRENCY"))
+    # The cores this process may run on, which can be fewer than the machine's
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the AI service with several worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Worker processes (default: WEB_CONCURRENCY, else one per core)")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", "0")),
+                        help="Recycle a worker after this many requests (0: never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", "0")))
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="Seconds a stopping worker may spend finishing its requests")
+    parser.add_argument("--backlog", type=int, default=2048)
+    args = parser.parse_args(argv)
+    if args.max_requests and not args.max_requests_jitter:
+        args.max_requests_jitter = args.max_requests // 10
+
+    configure_shared_caches(args.workers)
+    app, elapsed = warm()
+    sock = bind(args.host, args.port, args.backlog)
+    from telemetry import setup_logging
+
+    setup_logging(background=False)
+    logger.info("Warm phase took %.2fs; serving on %s:%d with %d workers", elapsed, args.host, args.port, args.workers)
+    Supervisor(app, sock, args).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
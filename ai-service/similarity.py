@@ -0,0 +1,213 @@
+# Tanimoto similarity search over a bit-packed fingerprint index.
+#
+# Build an index from a CSV of reference compounds with cid, smiles and an
+# optional name column:
+#
+#   python similarity.py build data/similarity-index reference.csv
+#   python similarity.py search data/similarity-index "CC(=O)OC1=CC=CC=C1C(=O)O" -k 5
+#
+# and point the service at it with SIMILARITY_INDEX=data/similarity-index.
+#
+# Rows are stored sorted by fingerprint popcount. A query with popcount a can
+# only reach Tanimoto min(a, b) / max(a, b) against a row with popcount b, so
+# rows are scanned outwards from popcount a in order of that bound, and the scan
+# stops as soon as no remaining row can beat the current k-th best result.
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+
+from fingerprint import FINGERPRINT_BITS, MAX_PATH_LENGTH, SmilesError, fingerprint
+
+INDEX_VERSION = 1
+SCAN_CHUNK_ROWS = 65536
+
+logger = logging.getLogger(__name__)
+
+if hasattr(np, "bitwise_count"):
+    def popcount(words):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+else:
+    _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        as_bytes = np.ascontiguousarray(words).view(np.uint8)
+        return _BYTE_POPCOUNT[as_bytes].sum(axis=-1, dtype=np.int32)
+
+
+class FingerprintIndex:
+    def __init__(self, path=None, nbits=FINGERPRINT_BITS):
+        self.path = path
+        self.nbits = nbits
+        words = nbits // 64
+        self.fingerprints = np.zeros((0, words), dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int32)
+        self.cids = np.zeros(0, dtype=np.int64)
+        self.names = None
+        if path:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION:
+                raise ValueError(f"Unsupported similarity index version {meta.get('version')} in {path}")
+            self.nbits = meta["nbits"]
+            self.fingerprints = np.load(os.path.join(path, "fingerprints.npy"), mmap_mode="r")
+            self.counts = np.load(os.path.join(path, "counts.npy"), mmap_mode="r")
+            self.cids = np.load(os.path.join(path, "cids.npy"), mmap_mode="r")
+            if os.path.exists(os.path.join(path, "names.offsets.npy")):
+                offsets = np.load(os.path.join(path, "names.offsets.npy"), mmap_mode="r")
+                names_path = os.path.join(path, "names.bytes")
+                data = np.memmap(names_path, dtype=np.uint8, mode="r") if os.path.getsize(names_path) else np.zeros(0, dtype=np.uint8)
+                self.names = (offsets, data)
+
+    def __len__(self):
+        return len(self.cids)
+
+    def name(self, row):
+        if self.names is None:
+            return None
+        offsets, data = self.names
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        return bytes(data[start:end]).decode("utf-8") if end > start else None
+
+    def _scan(self, query, query_count, start, end):
+        fingerprints = self.fingerprints[start:end]
+        common = popcount(fingerprints & query)
+        union = query_count + self.counts[start:end] - common
+        return np.where(union > 0, common / np.maximum(union, 1), 0.0)
+
+    def _bound(self, row, query_count):
+        count = int(self.counts[row])
+        return min(count, query_count) / max(count, query_count, 1)
+
+    def search(self, smiles, k=10, threshold=0.0):
+        query = fingerprint(smiles, self.nbits)
+        query_count = int(popcount(query))
+
+        # Rows are sorted by popcount, and the bound falls off monotonically on
+        # both sides of the query's popcount, so the scan grows a contiguous
+        # window outwards, always extending the side with the higher bound
+        total = len(self.counts)
+        lo = hi = int(np.searchsorted(self.counts, query_count))
+        best_scores = np.zeros(0)
+        best_rows = np.zeros(0, dtype=np.int64)
+        while lo > 0 or hi < total:
+            lower = self._bound(lo - 1, query_count) if lo > 0 else -1.0
+            upper = self._bound(hi, query_count) if hi < total else -1.0
+            bound = max(lower, upper)
+            kth_best = best_scores[k - 1] if len(best_scores) >= k else -1.0
+            if bound < threshold or bound <= kth_best:
+                break
+            if lower >= upper:
+                start, end = max(0, lo - SCAN_CHUNK_ROWS), lo
+                lo = start
+            else:
+                start, end = hi, min(total, hi + SCAN_CHUNK_ROWS)
+                hi = end
+            scores = self._scan(query, query_count, start, end)
+            keep = np.flatnonzero(scores >= threshold)
+            best_scores = np.concatenate([best_scores, scores[keep]])
+            best_rows = np.concatenate([best_rows, keep + start])
+            if len(best_scores) > k:
+                top = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_rows = best_scores[top], best_rows[top]
+            top = np.argsort(-best_scores, kind="stable")
+            best_scores, best_rows = best_scores[top], best_rows[top]
+        ranked = sorted(zip(best_scores.tolist(), best_rows.tolist()), key=lambda hit: (-hit[0], int(self.cids[hit[1]])))[:k]
+        return [{"cid": str(int(self.cids[row])), "name": self.name(row), "similarity": round(score, 4)} for score, row in ranked]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index():
+    # The index configured with SIMILARITY_INDEX (or an empty one), opened on
+    # first use
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = None
+                path = os.getenv("SIMILARITY_INDEX")
+                if path:
+                    try:
+                        index = FingerprintIndex(path)
+                        logger.info("Loaded similarity index with %d compounds from %s", len(index), path)
+                    except Exception as e:
+                        logger.error("Error loading similarity index %s: %s", path, e)
+                _index = index if index is not None else FingerprintIndex()
+    return _index
+
+
+def build_index(rows, out_dir, nbits=FINGERPRINT_BITS):
+    fingerprints = []
+    cids = []
+    names = []
+    skipped = 0
+    for row in rows:
+        try:
+            fingerprints.append(fingerprint(row["smiles"], nbits))
+            cids.append(int(row["cid"]))
+            names.append(row.get("name") or "")
+        except (KeyError, SmilesError, TypeError, ValueError):
+            skipped += 1
+    words = nbits // 64
+    matrix = np.stack(fingerprints) if fingerprints else np.zeros((0, words), dtype=np.uint64)
+    counts = popcount(matrix).astype(np.int32)
+    order = np.argsort(counts, kind="stable")
+
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "fingerprints.npy"), matrix[order])
+    np.save(os.path.join(tmp_dir, "counts.npy"), counts[order])
+    np.save(os.path.join(tmp_dir, "cids.npy"), np.asarray(cids, dtype=np.int64)[order])
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    with open(os.path.join(tmp_dir, "names.bytes"), "wb") as f:
+        for i, row in enumerate(order):
+            encoded = names[row].encode("utf-8")
+            f.write(encoded)
+            offsets[i + 1] = offsets[i] + len(encoded)
+    np.save(os.path.join(tmp_dir, "names.offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"version": INDEX_VERSION, "nbits": nbits, "max_path_length": MAX_PATH_LENGTH, "count": len(order)}, f)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp_dir, out_dir)
+    return len(order), skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a fingerprint similarity index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build an index from a CSV with cid, smiles and optional name columns")
+    build.add_argument("out_dir")
+    build.add_argument("csv_path")
+    build.add_argument("--bits", type=int, default=FINGERPRINT_BITS)
+    search = commands.add_parser("search", help="Print the nearest neighbours of a SMILES")
+    search.add_argument("index")
+    search.add_argument("smiles")
+    search.add_argument("-k", type=int, default=10)
+    search.add_argument("--threshold", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if args.bits % 64:
+            parser.error("--bits must be a multiple of 64")
+        with open(args.csv_path, newline="") as f:
+            count, skipped = build_index(csv.DictReader(f), args.out_dir, args.bits)
+        print(f"Indexed {count} compounds into {args.out_dir} ({skipped} rows skipped)")
+    else:
+        index = FingerprintIndex(args.index)
+        for hit in index.search(args.smiles, args.k, args.threshold):
+            print(json.dumps(hit))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
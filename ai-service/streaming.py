@@ -0,0 +1,210 @@
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import re
+import tempfile
+
+from fastapi import HTTPException
+
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+# Uploads larger than this are spooled to a temporary file instead of memory
+SPOOL_MAX_MEMORY = 1024 * 1024
+SPOOL_READ_SIZE = 64 * 1024
+
+
+class _InvalidRecord:
+    # An input line that could not be parsed; kept apart from the dicts users
+    # send so that no key in a valid record can be mistaken for an error
+    def __init__(self, error):
+        self.error = error
+
+
+async def spool_body(chunks, max_bytes):
+    # The request body has to be consumed before the streaming response starts
+    # (the server listens for client disconnects on the same channel), so it
+    # is copied to a spooled temporary file that keeps memory bounded; bodies
+    # over max_bytes are refused so one upload cannot fill the disk
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            raise HTTPException(status_code=413, detail=f"Upload larger than {max_bytes} bytes")
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+async def iter_spool(spool):
+    try:
+        while True:
+            chunk = spool.read(SPOOL_READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
+
+
+async def iter_lines(chunks):
+    # Split an async byte stream into decoded lines without buffering the body
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8-sig").rstrip("\r")
+
+
+async def iter_records(chunks):
+    # Yield one dict per input record from a CSV (header row first) or NDJSON
+    # stream; the format is detected from the first non-empty line. Lines that
+    # cannot be parsed are yielded as _InvalidRecord so they are reported in
+    # the output instead of aborting the stream.
+    header = None
+    is_json = None
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        if is_json is None:
+            is_json = line.lstrip().startswith("{")
+            if not is_json:
+                header = [name.strip() for name in next(csv.reader([line]))]
+                continue
+        if is_json:
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                yield record
+            except ValueError as e:
+                yield _InvalidRecord(f"Invalid NDJSON record: {e}")
+        else:
+            values = next(csv.reader([line]))
+            yield {name: value.strip() for name, value in zip(header, values) if value.strip()}
+
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+async def iter_json_array(chunks, key):
+    # Yield the elements of the first array stored under `key` in a JSON
+    # byte stream as soon as each one is complete, so a caller that needs
+    # only the first few can stop reading early. Only the unparsed remainder
+    # of the current element is buffered. Yields nothing if the key is absent.
+    decoder = json.JSONDecoder()
+    marker = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    in_array = False
+    async for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        if not in_array:
+            match = marker.search(buffer)
+            if match is None:
+                # Keep enough of the tail for a marker split across chunks
+                buffer = buffer[-(len(key) + 256):]
+                continue
+            buffer = buffer[match.end():]
+            in_array = True
+        pos = 0
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            # A number at the end of the buffer may still be incomplete
+            if end == len(buffer) and not isinstance(item, (dict, list, str)):
+                break
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+    if in_array:
+        raise ValueError(f"Truncated or invalid JSON array {key!r}")
+
+
+async def stream_predictions(records, handler, max_in_flight):
+    # Run handler over an async iterator of records and yield each result as
+    # soon as it completes. At most max_in_flight records are being processed
+    # or waiting to be sent; when the consumer is slow the input is no longer
+    # read, so memory stays flat regardless of the input size.
+    queue = asyncio.Queue(maxsize=max_in_flight)
+    slots = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def run(index, record):
+        item = {"index": index, "input": record, "result": None, "error": None}
+        try:
+            if isinstance(record, _InvalidRecord):
+                item["input"] = None
+                item["error"] = record.error
+            else:
+                item["result"] = await handler(record)
+        except HTTPException as e:
+            item["error"] = e.detail
+        except Exception as e:
+            logger.warning("Stream item %d error: %s", index, e)
+            item["error"] = str(e)
+        await queue.put(item)
+        slots.release()
+
+    async def produce():
+        index = 0
+        error = None
+        try:
+            async for record in records:
+                await slots.acquire()
+                task = asyncio.ensure_future(run(index, record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+        except Exception as e:
+            logger.warning("Stream input error: %s", e)
+            error = {"index": index, "input": None, "result": None, "error": f"Input stream error: {e}"}
+        # Records read before an input error still finish and are sent first
+        if tasks:
+            await asyncio.gather(*tasks)
+        if error is not None:
+            await queue.put(error)
+        await queue.put(_DONE)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        # The client may disconnect mid-stream; stop all outstanding work
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+async def encode_ndjson(results):
+    async for item in results:
+        yield json.dumps(item) + "\n"
+
+
+async def encode_sse(results):
+    count = 0
+    failed = 0
+    async for item in results:
+        count += 1
+        failed += item["error"] is not None
+        yield f"event: result\ndata: {json.dumps(item)}\n\n"
+    yield f"event: end\ndata: {json.dumps({'count': count, 'failed': failed})}\n\n"
@@ -0,0 +1,262 @@
+import bisect
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of requests whose full payloads are logged at DEBUG level
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_id = contextvars.ContextVar("request_id", default=None)
+_payload_sampled = contextvars.ContextVar("payload_sampled", default=False)
+
+logger = logging.getLogger("telemetry")
+
+
+# Metrics
+
+_registry = []
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_metrics():
+    # All registered metrics in the Prometheus text exposition format
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_DURATION = Histogram("ai_service_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+SPAN_DURATION = Histogram("ai_service_span_duration_seconds", "Latency of upstream calls and scoring steps", ("span",))
+UPSTREAM_ERRORS = Counter("ai_service_upstream_errors_total", "Failed upstream calls by call and reason", ("call", "reason"))
+LOG_RECORDS_DROPPED = Counter("ai_service_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+@contextmanager
+def span(name, **fields):
+    # Time a block into the span histogram, and log it at DEBUG level
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_DURATION.observe(duration, span=name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span", extra=log_fields(span=name, duration_ms=round(duration * 1000, 3), **fields))
+
+
+# Logging
+
+def log_fields(**fields):
+    # Structured fields for a log call: logger.info("...", extra=log_fields(cid=cid))
+    return {"fields": fields}
+
+
+def sample_payloads():
+    # Decide once per request whether its payloads are logged
+    _payload_sampled.set(LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE)
+
+
+def log_payload(log, message, payload):
+    # Full payloads are only logged at DEBUG level, for sampled requests
+    if _payload_sampled.get() and log.isEnabledFor(logging.DEBUG):
+        log.debug(message, extra=log_fields(payload=payload))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid is not None:
+            entry["request_id"] = rid
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the caller: records are handed to the writer thread, and
+    # dropped (and counted) when it cannot keep up
+    def prepare(self, record):
+        # Formatting happens on the writer thread; only capture what is bound
+        # to the calling context
+        record.request_id = request_id.get()
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_listener = None
+
+
+def setup_logging(background=True):
+    # Route all logging through a bounded queue to a single writer thread, so
+    # request handlers never wait on stdout. background=False writes
+    # directly instead, for a process that forks (threads do not survive it).
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    # Upstream calls are already covered by spans and metrics
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    if not background:
+        root.handlers = [stream]
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root.handlers = [_QueueHandler(log_queue)]
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    # Flush queued records; called on shutdown
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class MetricsMiddleware:
+    # ASGI middleware timing every HTTP request by route template, tagging its
+    # logs with a request ID and sampling it for payload logging
+    def __init__(self, app):
+        self.app = app
+        self.log = logging.getLogger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] or os.urandom(8).hex()
+        token = request_id.set(rid)
+        sample_payloads()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_DURATION.observe(duration, method=scope["method"], route=route, status=status[0])
+            self.log.info("request", extra=log_fields(method=scope["method"], path=scope["path"], status=status[0], duration_ms=round(duration * 1000, 3)))
+            request_id.reset(token)
@@ -0,0 +1,5 @@
+# Tests import the service modules the way uvicorn does, from ai-service/
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
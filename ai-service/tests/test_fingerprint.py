@@ -0,0 +1,29 @@
+import pytest
+
+from fingerprint import fingerprint_bits, parse_smiles
+
+
+def tanimoto(a, b):
+    a, b = fingerprint_bits(a), fingerprint_bits(b)
+    return (a & b).sum() / (a | b).sum()
+
+
+@pytest.mark.parametrize("kekule, aromatic", [
+    ("CC(=O)OC1=CC=CC=C1C(=O)O", "CC(=O)Oc1ccccc1C(=O)O"),  # aspirin
+    ("C1=CC=C2C=CC=CC2=C1", "c1ccc2ccccc2c1"),  # naphthalene
+    ("C1=CC=C2C(=C1)C=CN2", "c1ccc2c(c1)cc[nH]2"),  # indole
+    ("CN1C=NC2=C1C(=O)N(C(=O)N2C)C", "Cn1cnc2c1c(=O)n(c(=O)n2C)C"),  # caffeine
+    ("C1=CC=C(C=C1)C2=CC=CC=C2", "c1ccc(cc1)c1ccccc1"),  # biphenyl
+])
+def test_kekule_and_aromatic_forms_match(kekule, aromatic):
+    assert tanimoto(kekule, aromatic) == 1.0
+
+
+@pytest.mark.parametrize("smiles", ["C1=CCC=C1", "O=C1C=CC(=O)C=C1", "C1=CCCCC1", "c1ccccc1-c1ccccc1C1CCCCC1"])
+def test_non_aromatic_bonds_are_not_aromatic(smiles):
+    # Cyclopentadiene, quinone and cyclohexene are not aromatic, and neither
+    # is the bond between two aromatic rings
+    labels, neighbours = parse_smiles(smiles)
+    aromatic = [(atom, neighbour) for atom, bonds in enumerate(neighbours) for neighbour, bond in bonds if bond == ":"]
+    assert all(labels[atom].islower() and labels[neighbour].islower() for atom, neighbour in aromatic)
+    assert len(aromatic) == 2 * 12 * ("c1" in smiles)
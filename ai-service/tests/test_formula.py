@@ -0,0 +1,21 @@
+import random
+
+from formula import Composition, bulk_masses, molecular_mass, parse_formula
+
+
+def test_plain_formulas_parse_like_the_general_parser():
+    assert parse_formula("C2H6O") == Composition((("H", 6), ("C", 2), ("O", 1)), 0)
+    assert parse_formula("CH3CH2OH") == Composition((("H", 6), ("C", 2), ("O", 1)), 0)
+    assert parse_formula("C01H4") == Composition((("H", 4), ("C", 1)), 0)
+    assert parse_formula("CD4") == Composition((("C", 1), ("[2H]", 4)), 0)
+
+
+def test_plain_formula_masses_match_the_general_path():
+    # A group around the whole formula sends it through the general parser
+    rng = random.Random(0)
+    symbols = ["C", "H", "N", "O", "S", "Cl", "Br", "Fe", "Pt", "Xe"]
+    for _ in range(2000):
+        formula = "".join(rng.choice(symbols) + str(rng.randint(1, 60)) for _ in range(rng.randint(1, 6)))
+        for kind in ("average", "monoisotopic"):
+            assert molecular_mass(formula, kind) == molecular_mass(f"({formula})", kind)
+    assert bulk_masses(["C9H8O4"])[0] == molecular_mass("C9H8O4")
@@ -0,0 +1,68 @@
+import jobs
+from jobs import JobStore
+
+
+def test_stale_run_cannot_overwrite_the_new_claim(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_TIMEOUT", 0)
+    path = str(tmp_path / "jobs.sqlite")
+    first, second = JobStore(path), JobStore(path)
+    job_id = first.submit({"records": []}, 0, "interactive")
+
+    job, _, first_claim = first.claim(jobs.LANES)
+    assert job["job_id"] == job_id
+    # With no stale timeout the running job is queued again and claimed by the second store
+    _, _, second_claim = second.claim(jobs.LANES)
+    assert second_claim != first_claim
+
+    assert not first.progress(job_id, first_claim, 1, 0)
+    assert not first.finish(job_id, first_claim, "done", {"run": "first"})
+    assert second.finish(job_id, second_claim, "done", {"run": "second"})
+    assert first.result(job_id) == {"run": "second"}
+    first.close()
+    second.close()
+
+
+def test_cancelled_job_cannot_finish(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    job_id = store.submit({"records": []}, 0, "bulk")
+    _, _, claim = store.claim(jobs.LANES)
+    assert store.progress(job_id, claim, 0, 0)
+    assert store.cancel(job_id)
+    assert not store.progress(job_id, claim, 0, 0)
+    assert not store.finish(job_id, claim, "done", {})
+    assert store.get(job_id)["status"] == "cancelled"
+    store.close()
+
+
+def test_slow_live_job_is_not_run_twice(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(jobs, "JOB_STALE_TIMEOUT", 0.4)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_INTERVAL", 0.1)
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.05)
+    path = str(tmp_path / "jobs.sqlite")
+    runs = []
+
+    async def handler(payload, progress):
+        # No progress updates for longer than the stale timeout
+        runs.append(payload)
+        await asyncio.sleep(1.2)
+        return {"ok": True}
+
+    async def scenario():
+        # Two server processes sharing the queue
+        queues = [jobs.JobQueue(handler, JobStore(path), workers=1, bulk_workers=1) for _ in range(2)]
+        for queue in queues:
+            queue.start()
+        job = await queues[0].submit({"records": []}, 0, "interactive")
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if (await queues[1].get(job["job_id"]))["status"] == "done":
+                break
+        result = await queues[1].result(job["job_id"])
+        for queue in queues:
+            await queue.stop()
+        return result
+
+    assert asyncio.run(scenario()) == {"ok": True}
+    assert len(runs) == 1
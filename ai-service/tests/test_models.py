@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sklearn")
+
+import models
+from models import ScoringModel, TreeEnsemble, compile_artifact, compile_estimator, save_artifact, train_models
+
+
+def random_matrix(n, rng, missing=0.1):
+    matrix = np.column_stack([
+        rng.uniform(50, 900, n),
+        rng.normal(2, 2.5, n),
+        rng.integers(0, 15, n),
+        rng.integers(0, 8, n),
+        rng.integers(0, 15, n),
+        rng.uniform(0, 1200, n),
+    ])
+    matrix[rng.random(matrix.shape) < missing] = np.nan
+    return matrix
+
+
+@pytest.fixture(scope="module")
+def artifact():
+    rng = np.random.default_rng(0)
+    matrix = random_matrix(3000, rng)
+    labels = {
+        "binding_affinity": np.nan_to_num(matrix[:, 0] / 10 + matrix[:, 1] * 3, nan=20) + rng.normal(0, 2, len(matrix)),
+        "toxicity": np.nan_to_num(matrix[:, 5] / 15 - matrix[:, 3], nan=40) + rng.normal(0, 2, len(matrix)),
+    }
+    return train_models(matrix, labels, version="test")
+
+
+def test_compiled_trees_predict_like_the_estimator(artifact):
+    matrix = random_matrix(5000, np.random.default_rng(1), missing=0.2)
+    matrix[:20, 0] = np.inf
+    matrix[20:40, 1] = -np.inf
+    for estimator in artifact["estimators"].values():
+        ensemble = TreeEnsemble.from_estimator(estimator)
+        np.testing.assert_allclose(ensemble.predict(matrix), estimator.predict(matrix), rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(ensemble.predict(matrix[:1]), estimator.predict(matrix[:1]), rtol=1e-9, atol=1e-9)
+
+
+def test_joblib_and_compiled_models_score_alike(artifact, tmp_path):
+    save_artifact(artifact, str(tmp_path / "scoring.joblib"))
+    compile_artifact(artifact, str(tmp_path / "scoring"))
+    joblib_model = ScoringModel.load(str(tmp_path / "scoring.joblib"))
+    compiled_model = ScoringModel.load(str(tmp_path / "scoring"))
+    matrix = random_matrix(models.COMPILED_MAX_ROWS + 100, np.random.default_rng(2))
+    # Small inputs take the node tables and larger ones scikit-learn
+    for rows in (1, models.COMPILED_MAX_ROWS, len(matrix)):
+        for model in (joblib_model, compiled_model):
+            predicted = model.predict(matrix[:rows])
+            for target, estimator in artifact["estimators"].items():
+                expected = np.clip(estimator.predict(matrix[:rows]), 0, 100)
+                np.testing.assert_allclose(predicted[target], expected, rtol=1e-9, atol=1e-9)
+    assert compiled_model.version == joblib_model.version == "test"
+
+
+def test_compiling_fails_loudly_without_the_tree_attributes(artifact):
+    estimator = artifact["estimators"]["toxicity"]
+    predictors = estimator._predictors
+    try:
+        del estimator._predictors
+        with pytest.raises(ValueError, match="Cannot compile"):
+            compile_estimator(estimator)
+    finally:
+        estimator._predictors = predictors
+
+
+def test_compiling_fails_when_the_tables_disagree(artifact, monkeypatch):
+    estimator = artifact["estimators"]["toxicity"]
+    original = TreeEnsemble.from_estimator.__func__
+
+    def off_by_one(cls, estimator):
+        ensemble = original(cls, estimator)
+        ensemble.baseline += 1
+        return ensemble
+
+    monkeypatch.setattr(TreeEnsemble, "from_estimator", classmethod(off_by_one))
+    with pytest.raises(ValueError, match="disagrees"):
+        compile_estimator(estimator)
@@ -0,0 +1,25 @@
+import property_store
+from property_store import PropertyStore, build_store
+
+
+def test_build_store_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(property_store, "BUILD_CHUNK_ROWS", 2)
+    records = [
+        {"CID": "30", "MolecularWeight": "300.5", "IUPACName": "third"},
+        {"CID": "10", "HBondDonorCount": "2", "InChIKey": "KEY-10"},
+        {"MolecularWeight": "1"},
+        {"CID": "20", "XLogP": "1.5", "IUPACName": "β-alanine"},
+        {"CID": "30", "MolecularWeight": "310.25", "IUPACName": "third, again"},
+        {"CID": "40"},
+    ]
+    path = str(tmp_path / "store")
+    assert build_store(iter(records), path) == 4
+
+    store = PropertyStore(path)
+    assert store.cids.tolist() == [10, 20, 30, 40]
+    assert store.get(10) == {"CID": 10, "HBondDonorCount": 2, "InChIKey": "KEY-10"}
+    assert store.get(20) == {"CID": 20, "XLogP": 1.5, "IUPACName": "β-alanine"}
+    # The last record of a CID wins
+    assert store.get(30) == {"CID": 30, "MolecularWeight": 310.25, "IUPACName": "third, again"}
+    assert store.get(40) == {"CID": 40}
+    assert store.count({"MolecularWeight": (300, 400)}) == 1
@@ -0,0 +1,30 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+import pubchem
+
+PROPERTIES = {"CID": 990001, "MolecularWeight": 180.16, "XLogP": 1.2, "HBondAcceptorCount": 4, "HBondDonorCount": 1,
+              "RotatableBondCount": 3, "Complexity": 212, "MolecularFormula": "C9H8O4"}
+
+
+def test_predict_survives_synonym_timeout(monkeypatch):
+    async def properties(cid):
+        return dict(PROPERTIES)
+
+    async def synonym(cid):
+        raise asyncio.TimeoutError()
+
+    async def genome_report(cid):
+        return "No genomic data available for this compound"
+
+    monkeypatch.delenv("RESULT_STORE_PATH", raising=False)
+    monkeypatch.setattr(pubchem, "fetch_pubchem_properties", properties)
+    monkeypatch.setattr(pubchem, "_fetch_synonym", synonym)
+    monkeypatch.setattr(pubchem, "get_genome_report", genome_report)
+
+    response = TestClient(main.app).post("/predict", json={"cid": "990001", "smiles": "C"})
+    assert response.status_code == 200
+    assert response.json()["description"] == "No description available"
+    assert response.json()["molecular_formula"] == "C9H8O4"
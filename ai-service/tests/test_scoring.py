@@ -0,0 +1,53 @@
+import random
+
+import numpy as np
+
+from scoring import SCORING_COLUMNS, PropertyRecord, format_scores, property_matrix, score_matrix, score_record
+
+# Aspirin as PubChem returns it, and the edge cases of the conversions
+FIXED = [
+    {"MolecularWeight": "180.16", "XLogP": 1.2, "HBondAcceptorCount": 4, "HBondDonorCount": 1, "RotatableBondCount": 3,
+     "Complexity": 212},
+    {},
+    {"MolecularWeight": "N/A", "XLogP": "", "Complexity": None},
+    {"MolecularWeight": 0, "XLogP": 0, "HBondAcceptorCount": 0, "HBondDonorCount": 0, "RotatableBondCount": 0, "Complexity": 0},
+    {"MolecularWeight": "12abc", "XLogP": 2.0},
+    {"XLogP": "abc", "RotatableBondCount": "7"},
+    {"MolecularWeight": 2500, "XLogP": -9.5, "HBondAcceptorCount": 30, "HBondDonorCount": 12, "RotatableBondCount": 40,
+     "Complexity": 4000},
+    {"MolecularWeight": 500, "XLogP": -0.4, "HBondAcceptorCount": "10", "HBondDonorCount": 5.9, "RotatableBondCount": 10},
+]
+
+
+class HalfModel:
+    # A stand-in trained model: predicts half the molecular weight
+    def predict(self, matrix):
+        matrix = np.asarray(matrix, dtype=float).reshape(-1, len(SCORING_COLUMNS))
+        return {"binding_affinity": matrix[:, 0] / 2, "toxicity": matrix[:, 1] * 10}
+
+
+def random_props(rng):
+    props = {}
+    for key in SCORING_COLUMNS:
+        kind = rng.random()
+        if kind < 0.05:
+            continue
+        if kind < 0.1:
+            props[key] = rng.choice([None, "", "N/A", 0, "abc", "-"])
+        else:
+            value = round(rng.uniform(-5, 1500), 2)
+            props[key] = str(value) if rng.random() < 0.3 else value
+    return props
+
+
+def check(records, model=None):
+    batch = format_scores(score_matrix(property_matrix(records), model))
+    single = [score_record(PropertyRecord(props), model) for props in records]
+    assert single == batch
+
+
+def test_predict_path_matches_score_matrix():
+    rng = random.Random(0)
+    records = FIXED + [random_props(rng) for _ in range(5000)]
+    check(records)
+    check(records, HalfModel())
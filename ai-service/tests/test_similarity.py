@@ -0,0 +1,14 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_predict_unknown_rejects_invalid_smiles(monkeypatch):
+    async def receptor_info(pdb_id):
+        raise AssertionError("the receptor is fetched after the SMILES is checked")
+
+    monkeypatch.setattr(main, "fetch_receptor_info", receptor_info)
+    response = TestClient(main.app).post("/predict-unknown", json={"chemical_formula": "C9H8O4", "receptor_pdb_id": "1HSG",
+                                                                  "smiles": "C1CC(("})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid SMILES")
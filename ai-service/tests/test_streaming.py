@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from streaming import iter_records, iter_spool, spool_body, stream_predictions
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def collect(body):
+    async def handler(record):
+        return {"cid": record.get("cid")}
+
+    spool = await spool_body(chunks(body), 1024)
+    return [item async for item in stream_predictions(iter_records(iter_spool(spool)), handler, 4)]
+
+
+def test_record_with_error_key_is_predicted():
+    items = asyncio.run(collect(b'{"cid": "2244", "error": "mine"}\nnot json\n'))
+    items.sort(key=lambda item: item["index"])
+    assert items[0]["error"] is None
+    assert items[0]["result"] == {"cid": "2244"}
+    assert items[0]["input"] == {"cid": "2244", "error": "mine"}
+    assert items[1]["result"] is None
+    assert items[1]["error"].startswith("Invalid NDJSON record")
+
+
+def test_records_in_flight_finish_before_an_input_error():
+    async def records():
+        yield {"cid": "1"}
+        yield {"cid": "2"}
+        raise ValueError("connection reset")
+
+    async def handler(record):
+        await asyncio.sleep(0.01)
+        return {"cid": record["cid"]}
+
+    async def run():
+        return [item async for item in stream_predictions(records(), handler, 4)]
+
+    items = asyncio.run(run())
+    assert sorted(item["result"]["cid"] for item in items[:2]) == ["1", "2"]
+    assert items[2] == {"index": 2, "input": None, "result": None, "error": "Input stream error: connection reset"}
+
+
+def test_oversized_upload_is_refused():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(spool_body(chunks(b"x" * 600, b"x" * 600), 1024))
+    assert e.value.status_code == 413